@@ -0,0 +1,150 @@
+# Exports campaigns to a gzipped file with one campaign per line, and imports them back, a batch of campaigns at a time
+# Only one batch of campaigns is held in memory at once, so any number of campaigns can be exported or imported
+# Each line is a whole campaign in MongoDB's extended JSON, so the file can be imported into either layout of the database
+# The bot should be stopped (with its journal, if it has one, written to the database) while campaigns are imported
+# Campaign names are unique, so a campaign can't be imported while another campaign in the database has its name
+# Usage: python backup.py export campaigns.jsonl.gz [--name NAME ...] [--dungeon-master NAME ...] [--batch-size 1000]
+#        python backup.py import campaigns.jsonl.gz [--name NAME ...] [--dungeon-master NAME ...] [--batch-size 1000]
+from argparse import ArgumentParser
+from bson import json_util
+from pymongo import ASCENDING, ReplaceOne
+import database
+import gzip
+import json
+from journal import SEQUENCE_FIELD
+from migrate import in_batches
+import schema
+import time
+
+# The peak memory use is only known on systems that have the resource module
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# Gets the filter that finds the campaigns with any of the given names or dungeon masters
+# Without any names or dungeon masters, every campaign is found
+def get_filter(names, dungeon_masters):
+  filter = {}
+  if names:
+    filter["name"] = { "$in": names }
+  if dungeon_masters:
+    filter["dungeon_master"] = { "$in": dungeon_masters }
+  return filter
+
+# Checks if a campaign matches the filter from get_filter
+def matches(campaign, names, dungeon_masters):
+  return (not names or campaign.get("name") in names) and (not dungeon_masters or campaign.get("dungeon_master") in dungeon_masters)
+
+# Puts a batch of normalized campaigns back together
+# The players and items of the whole batch are loaded with one query each, instead of a query per campaign
+def join_batch(documents):
+  ids = [ document["_id"] for document in documents ]
+  players = {}
+  items = {}
+  for player in database.players_collection.find({ "campaign_id": { "$in": ids } }).sort("_id", ASCENDING):
+    players.setdefault(player["campaign_id"], []).append(player)
+  for item in database.items_collection.find({ "campaign_id": { "$in": ids } }):
+    items.setdefault(item["campaign_id"], []).append(item)
+  return [ schema.join_campaign(document, players.get(document["_id"], []), items.get(document["_id"], [])) for document in documents ]
+
+# Leaves out the number of the last journaled change that was written to a campaign
+# The numbers only mean something to the journal that wrote them, and a campaign imported with a higher number than
+# the bot's own journal has reached would have the journal's next changes to it skipped
+def strip_sequence(campaign):
+  campaign.pop(SEQUENCE_FIELD, None)
+  return campaign
+
+# Turns a campaign into a line of extended JSON
+# Only the values that JSON doesn't have, such as ids, are converted by json_util, instead of every value in the campaign
+def dumps(campaign):
+  return json.dumps(campaign, default=json_util.default, separators=(",", ":"))
+
+# Goes through the lines of a file in lists of the given size
+def read_batches(file, batch_size):
+  batch = []
+  for line in file:
+    if line.strip():
+      batch.append(line)
+      if len(batch) == batch_size:
+        yield batch
+        batch = []
+  if batch:
+    yield batch
+
+# Writes a batch of campaigns to the database, replacing any campaigns that have the same ids
+def import_batch(campaigns):
+  if database.SCHEMA == schema.EMBEDDED:
+    database.collection.bulk_write([ ReplaceOne({ "_id": campaign["_id"] }, campaign, upsert=True) for campaign in campaigns ], ordered=False)
+    return
+  ids = [ campaign["_id"] for campaign in campaigns ]
+  documents, players, items = [], [], []
+  for campaign in campaigns:
+    document, campaign_players, campaign_items = schema.split_campaign(campaign)
+    documents.append(document)
+    players += campaign_players
+    items += campaign_items
+  # The campaigns' old players and items are replaced as a whole, so ones that aren't in the file don't stay behind
+  database.players_collection.delete_many({ "campaign_id": { "$in": ids } })
+  database.items_collection.delete_many({ "campaign_id": { "$in": ids } })
+  database.collection.bulk_write([ ReplaceOne({ "_id": document["_id"] }, document, upsert=True) for document in documents ], ordered=False)
+  # The players are inserted in order, so they keep their order in the campaign
+  if players:
+    database.players_collection.insert_many(players, ordered=True)
+  if items:
+    database.items_collection.insert_many(items, ordered=False)
+
+# Shows how many campaigns were moved, how quickly, and the most memory that was used at once
+def report(action, count, start):
+  elapsed = time.perf_counter() - start
+  rate = count / elapsed if elapsed > 0 else 0
+  print(f"{action} {count} campaign/s in {elapsed:.2f}s ({rate:.0f} campaign/s)")
+  if resource:
+    # Linux gives the peak in kilobytes
+    print(f"The peak memory use was {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+# Writes every campaign that matches the filter to a file
+def export(path, names, dungeon_masters, batch_size):
+  start = time.perf_counter()
+  count = 0
+  with gzip.open(path, "wt", encoding="utf-8") as file:
+    for batch in in_batches(database.collection.find(get_filter(names, dungeon_masters)), batch_size):
+      if database.SCHEMA == schema.NORMALIZED:
+        batch = join_batch(batch)
+      file.writelines(f"{dumps(strip_sequence(campaign))}\n" for campaign in batch)
+      count += len(batch)
+  report("Exported", count, start)
+
+# Reads the campaigns that match the filter from a file into the database
+def import_campaigns(path, names, dungeon_masters, batch_size):
+  database.create_name_index()
+  if database.SCHEMA == schema.NORMALIZED:
+    database.create_normalized_indexes()
+  start = time.perf_counter()
+  count = 0
+  with gzip.open(path, "rt", encoding="utf-8") as file:
+    for lines in read_batches(file, batch_size):
+      # Files exported before the numbers were left out can still have them
+      campaigns = [ strip_sequence(campaign) for campaign in map(json_util.loads, lines) if matches(campaign, names, dungeon_masters) ]
+      if campaigns:
+        import_batch(campaigns)
+        count += len(campaigns)
+  report("Imported", count, start)
+
+if __name__ == "__main__":
+  parser = ArgumentParser(description="Export the campaigns in the database to a file, or import them from one.")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  for command, help in (("export", "write campaigns to a gzipped file"), ("import", "read campaigns from a gzipped file, replacing any with the same ids")):
+    command_parser = subparsers.add_parser(command, help=help)
+    command_parser.add_argument("path", help="the file to write to or read from")
+    command_parser.add_argument("--name", action="append", default=[], help="only include the campaign with this name (can be given more than once)")
+    command_parser.add_argument("--dungeon-master", action="append", default=[], help="only include the campaigns run by this user (can be given more than once)")
+    command_parser.add_argument("--batch-size", type=int, default=1000, help="how many campaigns are held in memory at once")
+  arguments = parser.parse_args()
+  if arguments.batch_size < 1:
+    parser.error("the batch size must be at least 1")
+  match arguments.command:
+    case "export":
+      export(arguments.path, arguments.name, arguments.dungeon_master, arguments.batch_size)
+    case "import":
+      import_campaigns(arguments.path, arguments.name, arguments.dungeon_master, arguments.batch_size)
@@ -0,0 +1,360 @@
+# Measures how quickly the bot's commands run, without connecting to Discord or to the real database
+# Every command is run except /stats, which only describes the timings of the others
+# The commands are called with fake interactions, and the database is replaced with an in-memory mongomock collection
+# Usage: python benchmark.py --campaigns 1000 --players 20 --items 50 --iterations 500 [--workers 4]
+#        python benchmark.py registry --campaigns 5000 --players 50
+#        python benchmark.py startup --campaigns 100000 --players 5 --items 5
+#        python benchmark.py rolls --times 10000
+#        python benchmark.py members --members 100000
+# Set DATABASE_SCHEMA to benchmark a different layout of the database
+# The registry scenario compares the registry's lookups with searching through lists of campaigns and players
+# The startup scenario compares loading every campaign at startup, as the bot used to, with only loading their names
+# The rolls scenario compares making a roll many times in batches with rolling every die on its own, as the bot used to
+# The members scenario compares finding a member of a big server with a query, as /addplayer does, with going through every member
+# mongomock has no indexes, so loading every campaign one at a time in the normalized layout is too slow to try with many campaigns
+# With --workers, several copies of the bot change the same campaign at once, as if they were separate processes,
+# and the benchmark checks that no change is lost and that every copy's cached campaign ends up matching the database
+from argparse import ArgumentParser
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+try:
+  import mongomock
+except ImportError:
+  raise SystemExit("The benchmarks need mongomock to stand in for the database. Install it with `pip install -r requirements-dev.txt`.")
+
+import bot
+import database
+import dice
+from registry import CampaignRegistry
+import schema
+
+# The fakes that stand in for Discord and the database are shared with the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests"))
+from helpers import FakeGuild, FakeInteraction, FakeMember, use_mongomock
+
+# Fills the database with campaigns, each with the given number of players and items
+# Every player starts with some of each item
+def populate(campaign_count, player_count, item_count):
+  items = {}
+  for i in range(item_count):
+    if i % 3 == 0:
+      items[f"item{i}"] = { "type": bot.ItemType.RESOURCE.value }
+    elif i % 3 == 1:
+      items[f"item{i}"] = { "type": bot.ItemType.MELEE_WEAPON.value, "hit": "1d20", "damage": "2d6+1" }
+    else:
+      items[f"item{i}"] = { "type": bot.ItemType.RANGE_WEAPON.value, "hit": "1d20", "damage": "1d8", "projectile": "item0", "range": 30 }
+  inventory = { name: { "item_ref": name, "amount": 1000000 } for name in items }
+  documents = []
+  for i in range(campaign_count):
+    documents.append({
+      "name": f"campaign{i}",
+      "dungeon_master": f"dm{i}",
+      "players": [ { "name": f"player{i}_{j}", "inventory": { name: dict(item) for name, item in inventory.items() } } for j in range(player_count) ],
+      "items": items
+    })
+  if database.SCHEMA == schema.NORMALIZED:
+    for document in documents:
+      document["_id"] = database.ObjectId()
+      campaign, players, items = schema.split_campaign(document)
+      database.collection.insert_one(campaign)
+      if players:
+        database.players_collection.insert_many(players)
+      if items:
+        database.items_collection.insert_many(items)
+    database.create_normalized_indexes()
+  elif documents:
+    database.collection.insert_many(documents)
+  database.create_name_index()
+
+# Gets a value from a sorted list of latencies at the given percentile
+def percentile(latencies, percent):
+  return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+# Calls a command many times and returns its latencies in seconds
+async def measure(iterations, make_call):
+  latencies = []
+  for i in range(iterations):
+    call = make_call(i)
+    start = time.perf_counter()
+    await call
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+async def run(campaign_count, player_count, item_count, iterations):
+  start = time.perf_counter()
+  populate(campaign_count, player_count, item_count)
+  print(f"Populated {campaign_count} {database.SCHEMA} campaign/s with {player_count} player/s and {item_count} item/s each in {time.perf_counter() - start:.2f}s")
+  guild_members = [ f"dm{i}" for i in range(campaign_count) ]
+  guild_members += [ f"player{i}_{j}" for i in range(campaign_count) for j in range(player_count) ]
+  guild_members += [ f"newplayer{i}" for i in range(iterations) ]
+  guild = FakeGuild(1, guild_members)
+
+  # Each campaign is played in its own channel
+  def interaction(user, campaign_number):
+    return FakeInteraction(FakeMember(user, hash(user)), guild, campaign_number)
+
+  def campaign_number(i):
+    return i % campaign_count
+
+  def player(i):
+    return f"player{campaign_number(i)}_{i % player_count}"
+
+  # Each campaign is managed in a channel of its own too, so it stays in management mode while it's played
+  def manage(i):
+    return interaction(f"dm{campaign_number(i)}", campaign_count + campaign_number(i))
+
+  weapon = "item1" if item_count > 1 else None
+  # Each command is called the given number of times, in this order
+  # Campaigns are only renamed and deleted at the end, once nothing else needs to find them by their names
+  commands = []
+  commands.append(("campaign show", iterations, lambda i: bot.campaign.callback(interaction("anyone", 0), "show", f"campaign{campaign_number(i)}")))
+  commands.append(("campaign manage", iterations, lambda i: bot.campaign.callback(manage(i), "manage", f"campaign{campaign_number(i)}")))
+  commands.append(("addplayer", iterations, lambda i: bot.add_player.callback(manage(i), f"newplayer{i}")))
+  commands.append(("removeplayer", iterations, lambda i: bot.remove_player.callback(manage(i), f"newplayer{i}")))
+  commands.append(("addresource", iterations, lambda i: bot.add_resource.callback(manage(i), f"resource{i}")))
+  commands.append(("addmeleeweapon", iterations, lambda i: bot.add_melee_weapon.callback(manage(i), f"melee{i}", "1d8+2")))
+  if item_count > 0:
+    commands.append(("addrangeweapon", iterations, lambda i: bot.add_range_weapon.callback(manage(i), f"range{i}", "1d6", "item0", 60)))
+  commands.append(("campaign play", iterations, lambda i: bot.campaign.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), "play", f"campaign{campaign_number(i)}")))
+  if player_count > 0 and item_count > 0:
+    usernames = lambda i: ", ".join(f"player{campaign_number(i)}_{j}" for j in range(player_count))
+    items = lambda i: ", ".join(f"item{j}:2" for j in range(min(item_count, 5)))
+    commands.append(("give", iterations, lambda i: bot.give.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), player(i), f"item{i % item_count}", 1)))
+    commands.append(("givemany", iterations, lambda i: bot.give_many.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), usernames(i), items(i))))
+    commands.append(("takemany", iterations, lambda i: bot.take_many.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), usernames(i), items(i))))
+    commands.append(("inventory", iterations, lambda i: bot.inventory.callback(interaction(player(i), campaign_number(i)))))
+  if player_count > 0 and weapon:
+    commands.append(("rollweapon hit", iterations, lambda i: bot.roll_weapon.callback(interaction(player(i), campaign_number(i)), "hit", weapon)))
+    commands.append(("rollweapon damage", iterations, lambda i: bot.roll_weapon.callback(interaction(player(i), campaign_number(i)), "damage", weapon)))
+    commands.append(("weaponstats", iterations, lambda i: bot.weapon_stats.callback(interaction(player(i), campaign_number(i)), weapon, 15)))
+  commands.append(("rollcustom", iterations, lambda i: bot.roll_custom.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), "2d20kh1+5")))
+  commands.append(("rollcustom times:40", iterations, lambda i: bot.roll_custom.callback(interaction(f"dm{campaign_number(i)}", campaign_number(i)), "1d20+5", 40, 15)))
+  commands.append(("rollstats", iterations, lambda i: bot.roll_stats.callback(interaction("anyone", 0), f"{i % 20 + 1}d20", 100)))
+  commands.append(("campaign show all", iterations, lambda i: bot.campaign.callback(interaction("anyone", 0), "show", "all")))
+  commands.append(("changename", iterations, lambda i: bot.change_name.callback(manage(i), f"renamed{i}")))
+  # A campaign can only be deleted once, so each one is deleted by a single call
+  commands.append(("deletecampaign", min(iterations, campaign_count), lambda i: bot.delete_campaign.callback(manage(i))))
+
+  print(f"{'command':<22}{'commands/sec':>14}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+  for name, count, make_call in commands:
+    latencies = await measure(count, make_call)
+    total = sum(latencies)
+    latencies.sort()
+    print(f"{name:<22}{count / total:>14.1f}{percentile(latencies, 50) * 1000:>12.3f}{percentile(latencies, 99) * 1000:>12.3f}")
+
+# Loads another copy of the bot, with its own cached campaigns and sessions, that shares the database with every other copy
+# Changes reach every copy through the same pub/sub, standing in for the database's change stream
+def load_worker(number):
+  spec = importlib.util.spec_from_file_location(f"bot_worker{number}", bot.__file__)
+  worker = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(worker)
+  database.campaign_changes.subscribe(worker.campaigns.apply_change)
+  return worker
+
+# Gets the amount of an item that each player in a campaign has in the database
+def get_amounts(campaign, item):
+  return { player["name"]: player["inventory"].get(item, {}).get("amount", 0) for player in campaign["players"] }
+
+# Has several copies of the bot give items to the players of the same campaign at once
+# Each copy retries its change whenever another copy changed the campaign first, like a user trying again
+# The commands benchmark renames and deletes its campaigns at the end, so the workers get a campaign of their own
+async def run_workers(worker_count, player_count, iterations):
+  populate(1, player_count, 1)
+  workers = [ load_worker(number) for number in range(worker_count) ]
+  guild = FakeGuild(2, [ "dm0" ] + [ f"player0_{j}" for j in range(player_count) ])
+  usernames = ", ".join(f"player0_{j}" for j in range(player_count))
+  campaign = await database.find_item({ "name": "campaign0" })
+  before = get_amounts(campaign, "item0")
+  conflicts = 0
+
+  async def work(number, worker):
+    nonlocal conflicts
+    await worker.campaign.callback(FakeInteraction(FakeMember("dm0", 0), guild, 0), "play", "campaign0")
+    for i in range(iterations):
+      while True:
+        try:
+          await worker.give_many.callback(FakeInteraction(FakeMember("dm0", 0), guild, 0), usernames, f"item0:{number + 1}")
+          break
+        except database.ConflictError:
+          conflicts += 1
+
+  start = time.perf_counter()
+  await asyncio.gather(*(work(number, worker) for number, worker in enumerate(workers)))
+  elapsed = time.perf_counter() - start
+  # Let the last changes reach every copy
+  await asyncio.sleep(0)
+  campaign = await database.find_item({ "name": "campaign0" })
+  after = get_amounts(campaign, "item0")
+  expected = iterations * worker_count * (worker_count + 1) // 2
+  lost = sum(1 for j in range(player_count) if after[f"player0_{j}"] - before[f"player0_{j}"] != expected)
+  stale = sum(1 for worker in workers if campaign["_id"] in worker.campaigns.campaigns and get_amounts(worker.campaigns.campaigns[campaign["_id"]], "item0") != after)
+  print(f"{worker_count} worker/s made {iterations * worker_count} change/s to the same campaign in {elapsed:.2f}s, with {conflicts} conflict/s retried")
+  print(f"{lost} player/s had the wrong amount and {stale} worker/s had an out of date campaign cached")
+  return lost == 0 and stale == 0
+
+# Times a lookup (or any other call), returning how many microseconds each call took on average
+def time_lookup(iterations, lookup):
+  start = time.perf_counter()
+  for i in range(iterations):
+    lookup(i)
+  return (time.perf_counter() - start) / iterations * 1000000
+
+# Compares the registry's lookups with searching through lists, which is how campaigns, players and items used to be found
+# Everything is in memory, so only the lookups themselves are timed
+def run_registry(campaign_count, player_count, item_count, iterations):
+  registry = CampaignRegistry(size=campaign_count)
+  campaign_list = []
+  for i in range(campaign_count):
+    campaign = {
+      "_id": i,
+      "name": f"campaign{i}",
+      "dungeon_master": f"dm{i}",
+      "players": [ { "name": f"player{i}_{j}", "inventory": {} } for j in range(player_count) ],
+      "items": { f"item{j}": { "type": bot.ItemType.RESOURCE.value } for j in range(item_count) }
+    }
+    registry.add(campaign)
+    campaign_list.append(campaign)
+  print(f"Indexed {campaign_count} campaign/s with {player_count} player/s and {item_count} item/s each")
+
+  # The campaigns, players and items are looked up in a scattered order, so later ones are searched for as often as early ones
+  def campaign_number(i):
+    return i * 7919 % campaign_count
+
+  def player_name(i):
+    return f"player{campaign_number(i)}_{i * 104729 % max(player_count, 1)}"
+
+  def item_name(i):
+    return f"item{i * 104729 % max(item_count, 1)}"
+
+  lookups = {
+    "campaign by name": (
+      lambda i: registry.use(registry.names[f"campaign{campaign_number(i)}"]),
+      lambda i: next(campaign for campaign in campaign_list if campaign["name"] == f"campaign{campaign_number(i)}")
+    ),
+    "player by name": (
+      lambda i: registry.get_player(campaign_list[campaign_number(i)], player_name(i)),
+      lambda i: next((player for player in campaign_list[campaign_number(i)]["players"] if player["name"] == player_name(i)), None)
+    ),
+    "item exists": (
+      lambda i: item_name(i) in campaign_list[campaign_number(i)]["items"],
+      lambda i: item_name(i) in list(campaign_list[campaign_number(i)]["items"].keys())
+    )
+  }
+  print(f"{'lookup':<22}{'registry (us)':>15}{'list (us)':>12}{'speedup':>10}")
+  for name, (indexed, scanned) in lookups.items():
+    indexed_time = time_lookup(iterations, indexed)
+    scanned_time = time_lookup(iterations, scanned)
+    print(f"{name:<22}{indexed_time:>15.3f}{scanned_time:>12.3f}{scanned_time / indexed_time:>9.1f}x")
+
+# Runs a step of starting up, returning how long it took, the most memory it used at once and the memory it kept afterwards
+# The step is run twice, so tracing the memory doesn't slow down the timed run
+async def measure_startup(step):
+  start = time.perf_counter()
+  kept = await step()
+  elapsed = time.perf_counter() - start
+  del kept
+  tracemalloc.start()
+  kept = await step()
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak, current
+
+# Compares starting up by loading every campaign, as the bot used to, with loading only every campaign's name,
+# along with loading the first campaign that a command uses
+async def run_startup(campaign_count, player_count, item_count):
+  start = time.perf_counter()
+  populate(campaign_count, player_count, item_count)
+  print(f"Populated {campaign_count} {database.SCHEMA} campaign/s with {player_count} player/s and {item_count} item/s each in {time.perf_counter() - start:.2f}s")
+
+  async def load_everything():
+    return await database.run_in_executor(database.get_all)
+
+  async def load_names():
+    registry = CampaignRegistry()
+    await database.create_indexes()
+    await registry.load_names()
+    await registry.get(f"campaign{campaign_count - 1}")
+    return registry
+
+  print(f"{'startup':<22}{'time (s)':>10}{'peak (MB)':>12}{'kept (MB)':>12}")
+  for name, step in (("every campaign", load_everything), ("names only", load_names)):
+    elapsed, peak, kept = await measure_startup(step)
+    print(f"{name:<22}{elapsed:>10.2f}{peak / 1000000:>12.1f}{kept / 1000000:>12.1f}")
+
+# Compares making rolls many times at once in batches with rolling every die on its own, and times doing it through /rollcustom
+async def run_rolls(times, iterations):
+  print(f"{'roll':<22}{'batch (ms)':>12}{'per die (ms)':>14}{'speedup':>10}")
+  for expression in ("1d20+5", "2d6+1d4+3", "4d6kh3", "1d6!"):
+    compiled = dice.compile_roll(expression)
+    batch_time = time_lookup(iterations, lambda i: dice.roll_many(compiled, times)) / 1000
+    single_time = time_lookup(iterations, lambda i: [ dice.roll(compiled) for _ in range(times) ]) / 1000
+    print(f"{expression:<22}{batch_time:>12.2f}{single_time:>14.2f}{single_time / batch_time:>9.1f}x")
+  populate(1, 1, 1)
+  guild = FakeGuild(1, [ "dm0" ])
+  await bot.campaign.callback(FakeInteraction(guild.members["dm0"], guild, 0), "play", "campaign0")
+  latencies = await measure(iterations, lambda i: bot.roll_custom.callback(FakeInteraction(guild.members["dm0"], guild, 0), "1d20+5", times, 15))
+  latencies.sort()
+  print(f"/rollcustom 1d20+5 times:{times} took {percentile(latencies, 50) * 1000:.2f}ms (p50) and {percentile(latencies, 99) * 1000:.2f}ms (p99)")
+
+# Compares checking that users are members of a big server with a query for the names that start with theirs, as /addplayer does,
+# with going through every member of the server, as it used to (which also needed every member to be cached)
+# Only the bot's own work is timed, since the fake server answers queries from memory instead of over the network
+async def run_members(member_count, iterations):
+  guild = FakeGuild(1, [ f"member{i}" for i in range(member_count) ])
+  members = list(guild.members.values())
+  print(f"Made a server with {member_count} member/s")
+  # Half of the users looked up are members and half of them aren't
+  def username(i):
+    return f"member{i * 7919 % member_count}" if i % 2 == 0 else f"stranger{i}"
+
+  scanned_time = time_lookup(iterations, lambda i: next((member for member in members if member.name == username(i)), None))
+  latencies = await measure(iterations, lambda i: bot.is_member(username(i), FakeInteraction(members[0], guild, 0)))
+  queried_time = sum(latencies) / iterations * 1000000
+  # Queries that are sent back as many members as Discord allows can leave out the user that was looked up
+  capped = 0
+  for i in range(iterations):
+    if len(await guild.query_members(username(i), limit=bot.MEMBER_QUERY_LIMIT)) == bot.MEMBER_QUERY_LIMIT:
+      capped += 1
+  print(f"{'lookup':<22}{'query (us)':>12}{'every member (us)':>19}{'speedup':>10}")
+  print(f"{'member by name':<22}{queried_time:>12.3f}{scanned_time:>19.3f}{scanned_time / queried_time:>9.1f}x")
+  print(f"{capped} of {iterations} queries were sent back {bot.MEMBER_QUERY_LIMIT} members, the most Discord sends back")
+
+if __name__ == "__main__":
+  parser = ArgumentParser(description="Benchmark the bot's commands offline.")
+  parser.add_argument("scenario", nargs="?", default="commands", choices=[ "commands", "registry", "startup", "rolls", "members" ], help="what to benchmark (the commands, by default)")
+  parser.add_argument("--campaigns", type=int, default=100, help="how many campaigns to create")
+  parser.add_argument("--players", type=int, default=10, help="how many players each campaign has")
+  parser.add_argument("--items", type=int, default=20, help="how many items each campaign has")
+  parser.add_argument("--iterations", type=int, default=200, help="how many times each command is called")
+  parser.add_argument("--seed", type=int, default=0, help="the seed for the dice rolls")
+  parser.add_argument("--times", type=int, default=dice.MAX_ROLLS, help="how many times each roll is made at once in the rolls scenario")
+  parser.add_argument("--members", type=int, default=100000, help="how many members the server has in the members scenario")
+  parser.add_argument("--workers", type=int, default=0, help="how many copies of the bot change the same campaign at once afterwards")
+  arguments = parser.parse_args()
+  if arguments.campaigns < 1:
+    parser.error("there must be at least one campaign")
+  random.seed(arguments.seed)
+  use_mongomock()
+  if arguments.workers > 0 and (arguments.players < 1 or arguments.items < 1):
+    parser.error("the workers need at least one player and one item to change")
+  async def main():
+    await run(arguments.campaigns, arguments.players, arguments.items, arguments.iterations)
+    if arguments.workers > 0 and not await run_workers(arguments.workers, arguments.players, arguments.iterations):
+      raise SystemExit(1)
+  match arguments.scenario:
+    case "commands":
+      asyncio.run(main())
+    case "registry":
+      run_registry(arguments.campaigns, arguments.players, arguments.items, arguments.iterations)
+    case "startup":
+      asyncio.run(run_startup(arguments.campaigns, arguments.players, arguments.items))
+    case "rolls":
+      asyncio.run(run_rolls(arguments.times, arguments.iterations))
+    case "members":
+      asyncio.run(run_members(arguments.members, arguments.iterations))
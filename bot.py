@@ -1,24 +1,44 @@
+import startup
+import asyncio
+from contextlib import asynccontextmanager
 import discord
 from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 import os
 import database
+import metrics
+from registry import CampaignRegistry
+from sessions import SessionManager
+from pages import Paginator, PageCache, send_pages
 from enum import Enum
-from random import randint
+import dice
 
 # Getting the bot token
 load_dotenv()
 TOKEN = os.getenv("TOKEN")
 
 # Create the bot object
+# The members intent isn't needed, since members are looked up by name when they're added to a campaign
 intents = discord.Intents.default()
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+# The bot can be split into shards, either "auto" (as many as Discord recommends) or a number of shards
+# Set SHARD_IDS (such as "0,1") to run only some of the shards in this process, and the rest in other processes
+# Every process should use CACHE_INVALIDATION=changestream, so they see each other's changes to campaigns
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+if SHARD_COUNT is None:
+  bot = commands.Bot(command_prefix="!", intents=intents)
+elif SHARD_COUNT == "auto":
+  bot = commands.AutoShardedBot(command_prefix="!", intents=intents)
+else:
+  shard_ids = [ int(shard_id) for shard_id in SHARD_IDS.split(",") ] if SHARD_IDS else None
+  bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=int(SHARD_COUNT), shard_ids=shard_ids)
 
 # Game variables
-campaigns = database.get_all()
-player_crits = []
+# Campaigns are loaded from the database when they're first used
+campaigns = CampaignRegistry()
+# Maps each player (as the campaign's id and the player's name) to how many critical hits their next damage rolls will apply
+player_crits = {}
 
 # Common messages
 NOT_DUNGEON_MASTER = lambda campaign_name : f"It looks like you aren't the dungeon master of `{campaign_name}`. Only the campaign's dungeon master can call this command."
@@ -28,9 +48,22 @@ NO_CAMPAIGN_FOUND = lambda campaign_name : f"No campaign was found with the name
 ITEM_EXISTS = lambda campaign_name, item_name : f"There's already an item with the name `{item_name}` in `{campaign_name}`. Please try again with a different name."
 ITEM_CREATION = lambda campaign_name, item_name, item_type : f"A new {item_type} with the name `{item_name}` has been added to `{campaign_name}`."
 ITEM_NOT_FOUND = lambda campaign_name, item_name : f"No item with the name `{item_name}` exists in `{campaign_name}`."
+INVALID_ITEM_NAME = lambda item_name : f"`{item_name}` can't be used as an item name because it contains a `.` or starts with a `$`. Please try again with a different name."
 INVALID_ROLL = lambda roll : f"Whoops! `{roll}` isn't a valid roll. Please enter a valid one instead."
-MANAGE_MODE_NOT_ACTIVE = "Whoops! It looks like management mode hasn't been enabled for any campaigns. Activate it using `/campaign manage` followed by the name of your campaign to use this command."
-PLAY_MODE_NOT_ACTIVE = "Whoops! It looks like play mode hasn't been enabled for any campaigns. Activate it using `/campaign play` followed by the name of your campaign to use this command."
+INVALID_TIMES = f"You can only roll between 1 and {dice.MAX_ROLLS} times at once."
+TOO_MANY_DICE = lambda roll, times : f"Rolling `{roll}` {times} times would roll too many dice. You can only roll up to {dice.MAX_BATCH_DICE} dice at once."
+NAME_TAKEN = lambda name : f"Whoops, it looks like there's already another campaign with the name `{name}`! Please try again with a different name."
+NAME_NOT_ALLOWED = lambda name : f"The campaign name cannot be `{name}`. Please try again with a different name."
+CAMPAIGN_CONFLICT = "This campaign was just changed by someone else, so your change wasn't saved. Please try again."
+INVALID_ITEM_AMOUNT = lambda entry : f"`{entry}` isn't a valid item. List items like `arrow:10, sword`, where the amount after the `:` is at least 1 and can be left out to mean 1."
+MANAGE_MODE_NOT_ACTIVE = "Whoops! It looks like management mode hasn't been enabled for any campaigns in this channel. Activate it using `/campaign manage` followed by the name of your campaign to use this command."
+PLAY_MODE_NOT_ACTIVE = "Whoops! It looks like play mode hasn't been enabled for any campaigns in this channel. Activate it using `/campaign play` followed by the name of your campaign to use this command."
+
+# The most characters that can be sent in a single message
+MESSAGE_LIMIT = 2000
+
+# The most players, and the most items, that can be listed at once when giving or taking many items
+MAX_BULK_NAMES = 25
 
 # Campaign modes
 class CampaignMode(Enum):
@@ -38,8 +71,11 @@ class CampaignMode(Enum):
   PLAY = "play"
   NONE = "none"
 
-mode = CampaignMode.NONE
-campaign_index = -1
+# The campaign and mode that each channel is using
+sessions = SessionManager()
+
+# The campaign and inventory lists that have already been rendered
+rendered_pages = PageCache()
 
 # Item types
 class ItemType(Enum):
@@ -47,51 +83,112 @@ class ItemType(Enum):
   MELEE_WEAPON = "Melee weapon"
   RANGE_WEAPON = "Range weapon"
 
-# All possible dice that can be rolled
-DICE = [ 4, 6, 8, 10, 12, 20, 100 ]
-
 # Game functions
-def display_campaign_details(index, show_num):
-  result = ""
-  # The name of the campaign and its dungeon master
-  result += f"{index + 1 if show_num else 1}. `{campaigns[index]['name']}`\n> Dungeon Master: `{campaigns[index]['dungeon_master']}`"
+# Describe an item's type and, for weapons, its damage, range and projectile
+def describe_item(item):
+  if item is None:
+    return "No longer in the campaign"
+  item_details = f"{item['type']}"
+  if item['type'] != ItemType.RESOURCE.value:
+    item_details += f", `{item['damage']}` damage"
+    if item['type'] == ItemType.RANGE_WEAPON.value:
+      item_details += f", `{item['range']}` feet range, `{item['projectile']}` as projectile"
+  return item_details
+
+# Get the lines that describe a campaign's dungeon master, players and items
+# The lines are only rendered as their pages are shown, so they're made from a copy of the campaign's players and items
+def get_campaign_lines(campaign):
+  players = [ player["name"] for player in campaign["players"] ]
+  items = list(campaign["items"].items())
+  return render_campaign_lines(campaign["dungeon_master"], players, items)
+
+def render_campaign_lines(dungeon_master, players, items):
+  yield f"> Dungeon Master: `{dungeon_master}`"
   # The players of the campaign
-  if len(campaigns[index]["players"]) > 0:
-    result += "\n> Players:"
-    for j in range(len(campaigns[index]["players"])):
-      result += f"\n> {j + 1}. `{campaigns[index]['players'][j]['name']}`"
+  if len(players) > 0:
+    yield "> Players:"
+    for j in range(len(players)):
+      yield f"> {j + 1}. `{players[j]}`"
   # If the campaign has no players
   else:
-    result += "\n> This campaign has no players."
+    yield "> This campaign has no players."
   # The items of the campaign
-  if len(campaigns[index]["items"]) > 0:
-    result += "\n> Items:"
-    items = campaigns[index]["items"]
-    items_keys = list(items.keys())
-    for j in range(len(items_keys)):
-      item = items[items_keys[j]]
-      item_details = f"{item['type']}"
-      if item['type'] != ItemType.RESOURCE.value:
-        item_details += f", `{item['damage']}` damage"
-        if item['type'] == ItemType.RANGE_WEAPON.value:
-          item_details += f", `{item['range']}` feet range, `{item['projectile']}` as projectile"
-      result += f"\n> {j + 1}. `{items_keys[j]}`: {item_details}"
+  if len(items) > 0:
+    yield "> Items:"
+    for j in range(len(items)):
+      yield f"> {j + 1}. `{items[j][0]}`: {describe_item(items[j][1])}"
   # If the campaign has no items
   else:
-    result += "\n> This campaign has no items."
-  result += "\n"
-  return result
+    yield "> This campaign has no items."
+
+# Get the lines that list the summary of every campaign
+def render_summary_lines(summaries):
+  for i in range(len(summaries)):
+    yield display_campaign_summary(summaries[i], i + 1)
+
+# Show the summary of a campaign that's listed by "/campaign show all"
+def display_campaign_summary(summary, number):
+  return f"{number}. `{summary['name']}`\n> Dungeon Master: `{summary['dungeon_master']}`\n> {summary['player_count']} player/s, {summary['item_count']} item/s"
+
+# Get the lines that list the items in a player's inventory
+# Like a campaign's lines, they're made from a copy of the inventory, along with each item's definition
+def get_inventory_lines(inventory, campaign):
+  return render_inventory_lines([ (name, item["amount"], get_item_definition(campaign, item)) for name, item in inventory.items() ])
+
+def render_inventory_lines(items):
+  if len(items) == 0:
+    yield "> This player currently has no items."
+  for j in range(len(items)):
+    item_name, amount, item = items[j]
+    name = f"`{item_name}`s" if amount > 1 else f"`{item_name}`"
+    yield f"> {j + 1}. {amount} {name}: {describe_item(item)}"
+
+# Save changes made to a campaign to the database
+# The campaign's version changes too, so that lists rendered from its old version aren't shown again
+# If the changes can't be saved, either because someone else changed the campaign first (through another process running the bot)
+# or because the database or the journal failed, the cached copy is dropped, since it already has the changes that weren't saved,
+# and the next command loads the campaign again
+async def save_campaign(campaign, changes):
+  campaigns.bump(campaign)
+  try:
+    await database.update_item(campaign, changes)
+  except Exception:
+    campaigns.discard(campaign)
+    raise
+
+# Lock a campaign, so that no other command changes it until this one is done
+# The campaign can be dropped from the cache while waiting for the lock, either because another process changed it or because
+# the cache was full, and the copy this command has is then out of date, so it's treated like any other conflicting change
+@asynccontextmanager
+async def lock_campaign(campaign):
+  async with sessions.lock(campaign):
+    if not campaigns.is_cached(campaign):
+      raise database.ConflictError(f"The campaign with the id {campaign['_id']} was dropped from the cache while waiting to be changed")
+    yield
 
 # Reduce the amount of a certain item that a player has
+# Projectiles can only be used if the player has enough of them
 async def reduce_item_amount(campaign, interaction, username, item, amount, is_projectile):
-  inventory = get_player_inventory(username, campaign)
-  if item in inventory.keys():
-    item_object = inventory[item]
-    item_object["amount"] -= amount
-    if item_object["amount"] <= 0:
-      del inventory[item]
-      database.update_item(campaign)
+  # The inventory and the player's position are only looked up once nothing else can change the campaign,
+  # since another command (such as removing a player) could have changed them while this one waited
+  async with lock_campaign(campaign):
+    inventory = get_player_inventory(username, campaign) or {}
+    held = inventory[item]["amount"] if item in inventory else 0
+    reduced = held > 0 and not (is_projectile and held < amount)
+    if reduced:
+      inventory[item]["amount"] -= amount
+      item_path = f"{get_player_path(username, campaign)}.inventory.{item}"
+      # Only the changed inventory slot is sent to the database
+      if inventory[item]["amount"] <= 0:
+        campaigns.remove_inventory_item(campaign, username, item)
+        await save_campaign(campaign, { "$unset": { item_path: "" } })
+      else:
+        await save_campaign(campaign, { "$inc": { f"{item_path}.amount": -amount } })
+  if reduced:
     return True
+  elif held > 0:
+    await interaction.response.send_message(f"You only have {held} `{item}` left, so you can't attack {amount} times.")
+    return False
   elif is_projectile:
     await interaction.response.send_message("You cannot use this weapon because you don't have its projectile in your inventory.")
     return False
@@ -101,10 +198,56 @@ async def reduce_item_amount(campaign, interaction, username, item, amount, is_p
 
 # Get the inventory of a player with a specific name
 def get_player_inventory(username, campaign):
-  for i in range(len(campaign["players"])):
-    player = campaign["players"][i]
-    if player["name"] == username:
-      return player["inventory"]
+  player = campaigns.get_player(campaign, username)
+  if player:
+    return player["inventory"]
+
+# Get the definition of an item in a player's inventory, or None if the campaign no longer has the item
+# Inventories only store a reference to each item and how many of it the player has,
+# so each item is defined once, in the campaign's items, which are already in memory with the rest of the campaign
+# Inventories that were saved before this still hold a copy of each item, which is used until they're migrated
+def get_item_definition(campaign, inventory_item):
+  if "item_ref" not in inventory_item:
+    return inventory_item
+  return campaign["items"].get(inventory_item["item_ref"])
+
+# Get the definition of a weapon in an inventory, or None if there isn't a weapon with that name in it
+def get_inventory_weapon(campaign, inventory, weapon):
+  if weapon not in inventory:
+    return None
+  item = get_item_definition(campaign, inventory[weapon])
+  if item is None or item["type"] == ItemType.RESOURCE.value:
+    return None
+  return item
+
+# Get the database path of a player with a specific name, such as "players.2"
+def get_player_path(username, campaign):
+  index = campaigns.get_player_index(campaign, username)
+  if index is not None:
+    return f"players.{index}"
+
+# The most members that Discord sends back for a single member query
+MEMBER_QUERY_LIMIT = 100
+
+# Check if a user is a member of the server that a command was sent from
+# Only the members whose usernames or nicknames start with the username are fetched, so the server's members don't all have to be cached
+# Discord sends back at most MEMBER_QUERY_LIMIT of them, so on a big server the user can be left out if enough other members' names
+# start the same way, in which case the dungeon master is told that the user couldn't be found among them instead
+async def is_member(username, interaction):
+  guild = interaction.guild
+  if guild is not None and username != "":
+    try:
+      members = await guild.query_members(query=username, limit=MEMBER_QUERY_LIMIT, cache=False)
+    except asyncio.TimeoutError:
+      await interaction.response.send_message(f"Discord took too long to look up `{username}`. Please try again in a moment.")
+      return False
+    if any(member.name == username for member in members):
+      return True
+    if len(members) == MEMBER_QUERY_LIMIT:
+      await interaction.response.send_message(f"More than {MEMBER_QUERY_LIMIT} members of this server have a name starting with `{username}`, and `{username}` wasn't one of the ones Discord sent back. Please check that the username is exactly right.")
+      return False
+  await interaction.response.send_message(f"No user with the name `{username}` exists in this server.")
+  return False
 
 # Check if a user is the dungeon master of a campaign
 async def is_dungeon_master(campaign, interaction):
@@ -115,9 +258,9 @@ async def is_dungeon_master(campaign, interaction):
 
 # Check if a user is a player in a campaign
 async def is_player(campaign, interaction, username, is_player_only_command):
-  for i in range(len(campaign["players"])):
-    if campaign["players"][i]["name"] == username:
-      return campaign["players"][i]
+  player = campaigns.get_player(campaign, username)
+  if player:
+    return player
   if is_player_only_command:
     await interaction.response.send_message(NOT_PLAYER_NO_ACCESS(campaign["name"]))
   else:
@@ -126,100 +269,245 @@ async def is_player(campaign, interaction, username, is_player_only_command):
 
 # Check if an item's name has already been taken
 async def does_item_exist(item_name, campaign, interaction, send_message):
-  if item_name in list(campaign["items"].keys()):
+  if item_name in campaign["items"]:
     if send_message:
       await interaction.response.send_message(ITEM_EXISTS(campaign["name"], item_name))
     return campaign["items"][item_name]
   return False
 
+# Check if a name can be used for an item
+# Item names become part of database paths, so they can't contain dots or start with a dollar sign
+async def is_item_name_valid(item_name, interaction):
+  if "." in item_name or item_name.startswith("$"):
+    await interaction.response.send_message(INVALID_ITEM_NAME(item_name))
+    return False
+  return True
+
 # Check if a roll is valid
-async def is_roll_valid(roll, interaction, with_addition):
-  valid = True
-  addition = False
+# Returns the compiled roll, which is cached so that the same roll is only ever parsed once
+# Rolls saved on weapons are allowed more dice, so that weapons made before there was a limit can still be used
+async def is_roll_valid(roll, interaction, max_dice=dice.MAX_DICE):
   try:
-    dice_amount = int(roll.split("d")[0])
-    if dice_amount < 1:
-      raise Exception
-  except:
-    valid = False
-  try:
-    if "+" in roll and with_addition:
-      dice_type = int(roll.split("d")[1].split("+")[0])
-      addition = int(roll.split("d")[1].split("+")[1])
-    elif "+" in roll and not with_addition:
-      raise Exception
-    else:
-      dice_type = int(roll.split("d")[1])
-    if dice_type not in DICE:
-      raise Exception
-  except:
-    valid = False
-  if valid:
-    return [ True, dice_amount, dice_type, addition if addition else 0 ]
-  await interaction.response.send_message(INVALID_ROLL(roll))
-  return [ False, None, None, None ]
+    return dice.compile_roll(roll, max_dice)
+  except ValueError:
+    await interaction.response.send_message(INVALID_ROLL(roll))
+    return None
+
+# Check if a roll can be made the given number of times at once without rolling too many dice
+async def is_batch_valid(roll, compiled, times, interaction):
+  if dice.count_dice(compiled) * times > dice.MAX_BATCH_DICE:
+    await interaction.response.send_message(TOO_MANY_DICE(roll, times))
+    return False
+  return True
 
 # Make a roll
-async def roll_dice(roll, interaction, text_prefix, can_crit, username, apply_crit_damage):
-  valid, dice_amount, dice_type, addition = await is_roll_valid(roll, interaction, True)
-  dice_roll = randint(1, dice_type) * dice_amount
-  if can_crit and dice_type == 20 and dice_roll == 20:
+# crit_key is the player that a critical hit is saved for, if the roll can crit
+async def roll_dice(roll, interaction, text_prefix, can_crit, crit_key, apply_crit_damage, max_dice=dice.MAX_DICE):
+  compiled = await is_roll_valid(roll, interaction, max_dice)
+  if not compiled:
+    return
+  result = dice.roll(compiled)
+  if can_crit and dice.is_natural_20(result):
     crit_text = "CRITICAL HIT! "
-    if username not in player_crits:
-      player_crits.append(username)
+    player_crits[crit_key] = player_crits.get(crit_key, 0) + 1
   elif apply_crit_damage:
     crit_text = "CRITICAL DAMAGE! "
   else:
     crit_text = ""
-  if valid:
-    await interaction.response.send_message(f"{text_prefix}\n> {crit_text}Rolled `{roll}` and got `({dice_roll} + {addition}){' * 2' if apply_crit_damage else ''}`.\n> Total: `{(dice_roll + addition) * (2 if apply_crit_damage else 1)}`")
+  message = f"{text_prefix}\n> {crit_text}Rolled `{roll}` and got `({dice.describe(result)}){' * 2' if apply_crit_damage else ''}`.\n> Total: `{result['total'] * (2 if apply_crit_damage else 1)}`"
+  # A roll with too many dice to list them all only shows its total
+  if len(message) > MESSAGE_LIMIT:
+    message = f"{text_prefix}\n> {crit_text}Rolled `{roll}`{' * 2' if apply_crit_damage else ''}.\n> Total: `{result['total'] * (2 if apply_crit_damage else 1)}`"
+  await interaction.response.send_message(message)
+
+# Make the same roll many times at once and send a summary of the results
+# If a target is given, the rolls that reach it are counted as hits, and the first crit_damage_rolls rolls are doubled
+async def roll_dice_many(roll, interaction, text_prefix, times, can_crit, crit_key, crit_damage_rolls, target, max_dice=dice.MAX_DICE):
+  compiled = await is_roll_valid(roll, interaction, max_dice)
+  if not compiled or not await is_batch_valid(roll, compiled, times, interaction):
+    return
+  results = dice.roll_many(compiled, times)
+  totals = results["totals"]
+  for i in range(crit_damage_rolls):
+    totals[i] *= 2
+  crits = sum(results["natural_20s"]) if can_crit else 0
+  if crits > 0:
+    player_crits[crit_key] = player_crits.get(crit_key, 0) + crits
+  summary = [ f"{text_prefix}", f"> Rolled `{roll}` {times} times." ]
+  if target is not None:
+    # A natural 20 always hits
+    hits = sum(1 for i in range(times) if totals[i] >= target or (can_crit and results["natural_20s"][i]))
+    summary.append(f"> Hits: `{hits}` of {times} against `{target}`")
+  if can_crit:
+    summary.append(f"> Critical hits: `{crits}`")
+  if crit_damage_rolls > 0:
+    summary.append(f"> Critical damage: `{crit_damage_rolls}` roll/s doubled")
+  summary.append(f"> Total: `{sum(totals)}` (average `{sum(totals) / times:.1f}`, lowest `{min(totals)}`, highest `{max(totals)}`)")
+  message = "\n".join(summary)
+  # List as many of the rolls as fit in the message, marking natural 20s with an exclamation mark
+  rolls = [ f"{total}{'!' if can_crit and results['natural_20s'][i] else ''}" for i, total in enumerate(totals) ]
+  message += truncate_list("\n> Rolls: ", rolls, MESSAGE_LIMIT - len(message))
+  await interaction.response.send_message(message)
+
+# Describe the chances of a roll, including the chance of reaching the target if one is given
+# The chances are worked out in another thread, so other commands are still answered while they are
+async def display_roll_stats(compiled, target):
+  stats = await asyncio.to_thread(dice.get_stats, compiled, target)
+  percentiles = ", ".join(f"{percentile}%: `{value}`" for percentile, value in stats["percentiles"].items())
+  result = f"> Average: `{stats['mean']:.2f}`\n> Percentiles: {percentiles}"
+  if target is not None:
+    result += f"\n> Chance of rolling `{target}` or higher: `{stats['target_chance'] * 100:.2f}%`"
+  if stats["samples"] is not None:
+    result += f"\n> These odds are estimated from {stats['samples']} rolls, since `{compiled.expression}` has too many dice to work them out exactly."
+  return result
 
-# Check if management mode is active
-async def is_manage_mode(interaction):
-  if mode == CampaignMode.MANAGE:
-    return True
+# Join a list of values after a prefix, leaving out the values that don't fit in the given length
+def truncate_list(prefix, values, length):
+  result = prefix
+  for i, value in enumerate(values):
+    ending = f" and {len(values) - i} more"
+    addition = f"{', ' if i > 0 else ''}`{value}`"
+    if len(result) + len(addition) + len(ending) > length and i < len(values) - 1:
+      return result + ending
+    result += addition
+  return result
+
+# Get the campaign that's active in the channel in a mode, or None if there isn't one, without sending any messages
+async def get_session_campaign(interaction, mode):
+  session = sessions.get(interaction)
+  if session and session["mode"] == mode:
+    return await campaigns.get_by_id(session["campaign_id"])
+  return None
+
+# Get the campaign being managed in the channel, if management mode is active
+async def get_manage_campaign(interaction):
+  campaign = await get_session_campaign(interaction, CampaignMode.MANAGE)
+  if campaign:
+    return campaign
   await interaction.response.send_message(MANAGE_MODE_NOT_ACTIVE)
-  return False
+  return None
 
-# Check if play mode is active
-async def is_play_mode(interaction):
-  if mode == CampaignMode.PLAY:
-    return True
+# Get the campaign being played in the channel, if play mode is active
+async def get_play_campaign(interaction):
+  campaign = await get_session_campaign(interaction, CampaignMode.PLAY)
+  if campaign:
+    return campaign
   await interaction.response.send_message(PLAY_MODE_NOT_ACTIVE)
-  return False
+  return None
+
+# Autocompletion
+# Suggestions come from prefix indexes that are kept up to date as names change, so they're found without going through every name
+def get_choices(names):
+  return [ app_commands.Choice(name=name, value=name) for name in names ]
+
+# Suggest the names of campaigns
+async def complete_campaign_name(interaction: discord.Interaction, current: str):
+  return get_choices(campaigns.name_index.suggest(current))
+
+# Suggest the names of the items in the campaign being played in the channel
+async def complete_item_name(interaction: discord.Interaction, current: str):
+  campaign = await get_session_campaign(interaction, CampaignMode.PLAY)
+  return get_choices(campaigns.get_item_names(campaign).suggest(current)) if campaign else []
+
+# Suggest the names of the players in the campaign being played in the channel
+async def complete_player_name(interaction: discord.Interaction, current: str):
+  campaign = await get_session_campaign(interaction, CampaignMode.PLAY)
+  return get_choices(campaigns.get_player_names(campaign).suggest(current)) if campaign else []
+
+# Suggest the names of the players in the campaign being managed in the channel
+async def complete_managed_player_name(interaction: discord.Interaction, current: str):
+  campaign = await get_session_campaign(interaction, CampaignMode.MANAGE)
+  return get_choices(campaigns.get_player_names(campaign).suggest(current)) if campaign else []
+
+# Suggest the names of the weapons in the inventory of the player using the command
+async def complete_weapon_name(interaction: discord.Interaction, current: str):
+  username = interaction.user.name
+  campaign = await get_session_campaign(interaction, CampaignMode.PLAY)
+  if not campaign or not campaigns.get_player(campaign, username):
+    return []
+  inventory = get_player_inventory(username, campaign)
+  names = campaigns.get_inventory_names(campaign, username).suggest(current, lambda name: get_inventory_weapon(campaign, inventory, name) is not None)
+  return get_choices(names)
 
 # Change the type of commands that can be used
 async def change_mode(new_mode, name, interaction):
-  for i in range(len(campaigns)):
-    # Find the campaign with the given name
-    if campaigns[i]["name"] == name:
-      # If the player owns the campaign, change the mode
-      if await is_dungeon_master(campaigns[i], interaction):
-        global mode, campaign_index
-        mode = new_mode
-        campaign_index = i
-        if new_mode == CampaignMode.MANAGE:
-          await interaction.response.send_message(f"You can now access management commands for `{campaigns[i]['name']}`.")
-        elif new_mode == CampaignMode.PLAY:
-          await interaction.response.send_message(f"You can now access play commands for `{campaigns[i]['name']}`.")
-        elif new_mode == CampaignMode.NONE:
-          await interaction.response.send_message(f"Exited `{campaigns[i]['name']}`.")
-      break
-  else:
+  # Find the campaign with the given name
+  campaign = await campaigns.get(name)
+  if not campaign:
     await interaction.response.send_message(NO_CAMPAIGN_FOUND(name))
+  # If the player owns the campaign, change the mode
+  elif await is_dungeon_master(campaign, interaction):
+    if new_mode == CampaignMode.NONE:
+      sessions.end(interaction)
+    else:
+      sessions.start(interaction, campaign, new_mode)
+    if new_mode == CampaignMode.MANAGE:
+      await interaction.response.send_message(f"You can now access management commands for `{campaign['name']}`.")
+    elif new_mode == CampaignMode.PLAY:
+      await interaction.response.send_message(f"You can now access play commands for `{campaign['name']}`.")
+    elif new_mode == CampaignMode.NONE:
+      await interaction.response.send_message(f"Exited `{campaign['name']}`.")
+
+# Runs once after the bot logs in, before it connects
+@bot.event
+async def setup_hook():
+  startup.mark_phase("login")
+  # Make sure campaigns can be looked up by name without scanning the whole collection
+  await database.create_indexes()
+  # Write any changes that were saved to the journal but not the database before the bot last stopped
+  replayed_changes = await database.open_journal()
+  if replayed_changes:
+    print(f"Replayed {replayed_changes} journaled change/s.")
+  # Load every campaign's name, so they can be autocompleted
+  await campaigns.load_names()
+  # Keep the cached campaigns up to date with changes made by any process running the bot
+  database.campaign_changes.subscribe(campaigns.apply_change)
+  await database.campaign_changes.start()
+  startup.mark_phase("database")
+  # When the bot is split between processes, only the one running the first shard syncs the commands
+  shard_ids = getattr(bot, "shard_ids", None)
+  if shard_ids is None or 0 in shard_ids:
+    try:
+      # Sync the bot's commands, but only if they've changed since they were last synced
+      synced_commands = await startup.sync_commands(bot.tree)
+      if synced_commands is None:
+        print("Commands haven't changed since they were last synced.")
+      else:
+        print(f"Successfully synced {synced_commands} command/s.")
+    except Exception as e:
+      print(e)
+  startup.mark_phase("sync")
+  # Serve the metrics locally, without stopping the bot from starting if the port can't be used
+  try:
+    if await metrics.start_server():
+      print(f"Serving metrics at http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics")
+  except OSError as e:
+    print(f"Couldn't serve metrics: {e}")
+
+# Tells the user to try again when their change to a campaign lost to someone else's
+# Every other error is handled as usual
+@bot.tree.error
+async def on_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+  if isinstance(error, app_commands.CommandInvokeError) and isinstance(error.original, database.ConflictError):
+    if interaction.response.is_done():
+      await interaction.followup.send(CAMPAIGN_CONFLICT)
+    else:
+      await interaction.response.send_message(CAMPAIGN_CONFLICT)
+    return
+  await app_commands.CommandTree.on_error(bot.tree, interaction, error)
 
+# Runs every time the bot connects or reconnects
 @bot.event
 async def on_ready():
-  try:
-    # Sync the bot's commands
-    synced_commands = await bot.tree.sync()
-    print(f"Successfully synced {len(synced_commands)} command/s.")
-  except Exception as e:
-    print(e)
+  if not startup.is_ready():
+    startup.mark_phase("ready")
+    print(startup.report())
 
 # Commands associated with managing the campaigns
 @bot.tree.command(name="campaign")
 @app_commands.describe(command="command", name="name")
+@app_commands.autocomplete(name=complete_campaign_name)
+@metrics.time_command("campaign")
 async def campaign(interaction: discord.Interaction, command: str, name: str):
   match command:
     # Create a new campaign
@@ -227,38 +515,47 @@ async def campaign(interaction: discord.Interaction, command: str, name: str):
       # If the campaign name is "all", it could can cause issues with other commands
       if name == "all":
         await interaction.response.send_message("The campaign name cannot be `all`.")
-      for campaign in campaigns:
-        if campaign["name"] == name:
-          await interaction.response.send_message(f"Whoops, it looks like there's already another campaign with the name `{name}`! Please try again with a different name.")
-          break
-      else:
+        return
+      # No other command can take the name between checking that it's free and saving the campaign
+      async with sessions.name_lock(name):
+        if await campaigns.get(name):
+          await interaction.response.send_message(NAME_TAKEN(name))
+          return
         new_campaign = {
           "name": name,
           "dungeon_master": interaction.user.name,
           "players": [],
           "items": {}
         }
-        campaigns.append(database.add_item(new_campaign))
-        await interaction.response.send_message(f"A new campaign with the name `{name}` has been created.")
+        # Another process running the bot can still take the name first, which the database's unique index on names catches
+        try:
+          campaigns.add(await database.add_item(new_campaign))
+        except database.NameTakenError:
+          await interaction.response.send_message(NAME_TAKEN(name))
+          return
+      await interaction.response.send_message(f"A new campaign with the name `{name}` has been created.")
     # See the details of campaigns
     case "show":
-      if len(campaigns) == 0:
-        await interaction.response.send_message("No campaigns have been created yet! Use `/campaign create` to create a new one!")
-        return
-      result = ""
-      for i in range(len(campaigns)):
-        # If we are showing all campaigns, add this campaign's details to the list
-        if name == "all":
-          result += display_campaign_details(i, True)
-        # If we are showing a specific campaign, set the list's value to its details
-        elif campaigns[i]["name"] == name:
-          result = display_campaign_details(i, False)
-          break
+      # If we are showing all campaigns, list a summary of each one
+      # Only the fields in the summary are loaded, so this doesn't load every campaign
+      if name == "all":
+        paginator = rendered_pages.get("all", campaigns.version)
+        if not paginator:
+          summaries = await database.get_summaries()
+          if len(summaries) == 0:
+            await interaction.response.send_message("No campaigns have been created yet! Use `/campaign create` to create a new one!")
+            return
+          paginator = rendered_pages.add("all", campaigns.version, Paginator("Campaigns", render_summary_lines(summaries)))
+      # If we are showing a specific campaign, show all of its details
       else:
-        if name != "all":
+        campaign = await campaigns.get(name)
+        if not campaign:
           await interaction.response.send_message(NO_CAMPAIGN_FOUND(name))
           return
-      await interaction.response.send_message(result)
+        key = ("campaign", campaign["_id"])
+        version = campaigns.get_version(campaign)
+        paginator = rendered_pages.get(key, version) or rendered_pages.add(key, version, Paginator(campaign["name"], get_campaign_lines(campaign)))
+      await send_pages(interaction, paginator)
     # Enable management commands for a campaign
     case "manage":
       await change_mode(CampaignMode.MANAGE, name, interaction)
@@ -275,213 +572,436 @@ async def campaign(interaction: discord.Interaction, command: str, name: str):
 # Change the name of a campaign
 @bot.tree.command(name="changename")
 @app_commands.describe(name="name")
+@metrics.time_command("changename")
 async def change_name(interaction: discord.Interaction, name: str):
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction):
-    campaigns[campaign_index]["name"] = name
-    database.update_item(campaigns[campaign_index])
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction):
+    # No other command can take the name between checking that it's free and saving it
+    async with sessions.name_lock(name):
+      if name == "all" or await campaigns.get(name):
+        await interaction.response.send_message(NAME_NOT_ALLOWED(name))
+        return
+      old_name = campaign["name"]
+      async with lock_campaign(campaign):
+        campaigns.rename(campaign, name)
+        try:
+          await save_campaign(campaign, { "$set": { "name": name } })
+        # Another process running the bot took the name first, and the renamed copy of the campaign has already been dropped
+        except database.NameTakenError:
+          campaigns.name_index.add(old_name)
+          await interaction.response.send_message(NAME_NOT_ALLOWED(name))
+          return
     await interaction.response.send_message(f"Changed the name of the campaign to `{name}`.")
 
 # Add a player to a campaign
 @bot.tree.command(name="addplayer")
 @app_commands.describe(username="username")
+@metrics.time_command("addplayer")
 async def add_player(interaction: discord.Interaction, username: str):
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction):
-    for member in interaction.guild.members:
-      if member.name == username:
-        for player in campaigns[campaign_index]["players"]:
-          if player["name"] == username:
-            await interaction.response.send_message(f"`{username}` is already a player in `{campaigns[campaign_index]['name']}`.")
-            return
-        campaigns[campaign_index]["players"].append({
-          "name": username,
-          "inventory": {}
-        })
-        database.update_item(campaigns[campaign_index])
-        await interaction.response.send_message(f"`{username}` is now a player in `{campaigns[campaign_index]['name']}`.")
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction):
+    if campaigns.get_player(campaign, username):
+      await interaction.response.send_message(f"`{username}` is already a player in `{campaign['name']}`.")
+      return
+    if not await is_member(username, interaction):
+      return
+    new_player = {
+      "name": username,
+      "inventory": {}
+    }
+    async with lock_campaign(campaign):
+      # The player could have been added by another command while the member was being looked up
+      if campaigns.get_player(campaign, username):
+        await interaction.response.send_message(f"`{username}` is already a player in `{campaign['name']}`.")
         return
-    await interaction.response.send_message(f"No user with the name `{username}` exists in this server.")
+      campaigns.add_player(campaign, new_player)
+      await save_campaign(campaign, { "$push": { "players": new_player } })
+    await interaction.response.send_message(f"`{username}` is now a player in `{campaign['name']}`.")
 
 # Remove a player from a campaign
 @bot.tree.command(name="removeplayer")
 @app_commands.describe(username="username")
+@app_commands.autocomplete(username=complete_managed_player_name)
+@metrics.time_command("removeplayer")
 async def remove_player(interaction: discord.Interaction, username: str):
-  player = await is_player(campaigns[campaign_index], interaction, username, False)
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction) and player:
-    campaigns[campaign_index]["players"].remove(player)
-    database.update_item(campaigns[campaign_index])
-    await interaction.response.send_message(f"`{username}` is no longer a player in `{campaigns[campaign_index]['name']}`.")
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction) and await is_player(campaign, interaction, username, False):
+    async with lock_campaign(campaign):
+      campaigns.remove_player(campaign, username)
+      await save_campaign(campaign, { "$pull": { "players": { "name": username } } })
+    await interaction.response.send_message(f"`{username}` is no longer a player in `{campaign['name']}`.")
 
 # Create a new item that can be used in the campaign
 @bot.tree.command(name="addresource")
 @app_commands.describe(name="name")
+@metrics.time_command("addresource")
 async def add_resource(interaction: discord.Interaction, name: str):
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction) and not await does_item_exist(name, campaigns[campaign_index], interaction, True):
-    campaigns[campaign_index]["items"].update({
-      name: {
-        "type": ItemType.RESOURCE.value
-      }
-    })
-    database.update_item(campaigns[campaign_index])
-    await interaction.response.send_message(ITEM_CREATION(campaigns[campaign_index]["name"], name, "resource"))
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction) and not await does_item_exist(name, campaign, interaction, True) and await is_item_name_valid(name, interaction):
+    new_item = {
+      "type": ItemType.RESOURCE.value
+    }
+    async with lock_campaign(campaign):
+      campaigns.add_item(campaign, name, new_item)
+      await save_campaign(campaign, { "$set": { f"items.{name}": new_item } })
+    await interaction.response.send_message(ITEM_CREATION(campaign["name"], name, "resource"))
 
 # Create a new melee weapon that can be used in the campaign
 @bot.tree.command(name="addmeleeweapon")
 @app_commands.describe(name="name", damage_roll="damage_roll")
+@metrics.time_command("addmeleeweapon")
 async def add_melee_weapon(interaction: discord.Interaction, name: str, damage_roll: str):
-  valid_roll = await is_roll_valid(damage_roll, interaction, False)
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction) and not await does_item_exist(name, campaigns[campaign_index], interaction, True) and valid_roll[0]:
-    campaigns[campaign_index]["items"].update({
-      name: {
-        "type": ItemType.MELEE_WEAPON.value,
-        "hit": "1d20",
-        "damage": damage_roll
-      }
-    })
-    database.update_item(campaigns[campaign_index])
-    await interaction.response.send_message(ITEM_CREATION(campaigns[campaign_index]["name"], name, "melee weapon"))
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction) and not await does_item_exist(name, campaign, interaction, True) and await is_item_name_valid(name, interaction) and await is_roll_valid(damage_roll, interaction):
+    new_item = {
+      "type": ItemType.MELEE_WEAPON.value,
+      "hit": "1d20",
+      "damage": damage_roll
+    }
+    async with lock_campaign(campaign):
+      campaigns.add_item(campaign, name, new_item)
+      await save_campaign(campaign, { "$set": { f"items.{name}": new_item } })
+    await interaction.response.send_message(ITEM_CREATION(campaign["name"], name, "melee weapon"))
 
 # Create a new ranged weapon that can be used in the campaign
 @bot.tree.command(name="addrangeweapon")
 @app_commands.describe(name="name", damage_roll="damage_roll", projectile="projectile", range_distance="range_distance")
+@metrics.time_command("addrangeweapon")
 async def add_range_weapon(interaction: discord.Interaction, name: str, damage_roll: str, projectile: str, range_distance: int):
-  valid_roll = await is_roll_valid(damage_roll, interaction, False)
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction) and not await does_item_exist(name, campaigns[campaign_index], interaction, True) and valid_roll[0]:
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction) and not await does_item_exist(name, campaign, interaction, True) and await is_item_name_valid(name, interaction) and await is_roll_valid(damage_roll, interaction):
     # Check if the item being used as the projectile has already been created in the campaign
-    if not await does_item_exist(projectile, campaigns[campaign_index], interaction, False):
-      await interaction.response.send_message(f"No item with the name {projectile} is currently part of this campaign, so you can't use it as this weapon's projectile. Use `/campaign show {campaigns[campaign_index]['name']}` to see the items in this campaign.")
+    if not await does_item_exist(projectile, campaign, interaction, False):
+      await interaction.response.send_message(f"No item with the name {projectile} is currently part of this campaign, so you can't use it as this weapon's projectile. Use `/campaign show {campaign['name']}` to see the items in this campaign.")
     # The range of the weapon must be greater than zero and a multiple of 5
     elif range_distance % 5 != 0 and range_distance <= 0:
       await interaction.response.send_message(f"{range_distance} is not a valid range. Please ensure that the range of the weapon is greater than zero and a multiple of five.")
     else:
-      campaigns[campaign_index]["items"].update({
-        name: {
-          "type": ItemType.RANGE_WEAPON.value,
-          "hit": "1d20",
-          "damage": damage_roll,
-          "projectile": projectile,
-          "range": range_distance
-        }
-      })
-      database.update_item(campaigns[campaign_index])
-      await interaction.response.send_message(ITEM_CREATION(campaigns[campaign_index]["name"], name, "ranged weapon"))
+      new_item = {
+        "type": ItemType.RANGE_WEAPON.value,
+        "hit": "1d20",
+        "damage": damage_roll,
+        "projectile": projectile,
+        "range": range_distance
+      }
+      async with lock_campaign(campaign):
+        campaigns.add_item(campaign, name, new_item)
+        await save_campaign(campaign, { "$set": { f"items.{name}": new_item } })
+      await interaction.response.send_message(ITEM_CREATION(campaign["name"], name, "ranged weapon"))
 
 # Delete the campaign
 @bot.tree.command(name="deletecampaign")
 @app_commands.describe()
+@metrics.time_command("deletecampaign")
 async def delete_campaign(interaction: discord.Interaction):
-  if await is_manage_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction):
+  campaign = await get_manage_campaign(interaction)
+  if campaign and await is_dungeon_master(campaign, interaction):
     # Get the name for the message
-    name = campaigns[campaign_index]["name"]
+    name = campaign["name"]
     # Remove it from the list of campaigns and the database
-    database.remove_item(campaigns[campaign_index])
-    campaigns.remove(campaigns[campaign_index])
-    # Exit management mode
-    global mode
-    mode = CampaignMode.NONE
+    async with lock_campaign(campaign):
+      await database.remove_item(campaign)
+      campaigns.remove(campaign)
+    # Exit management mode for every channel using the campaign
+    sessions.end_campaign(campaign)
     # Send the message with the name from earlier
     await interaction.response.send_message(f"The campaign `{name}` has been deleted.")
 
 # Make a custom dice roll
 @bot.tree.command(name="rollcustom")
-@app_commands.describe(roll="roll")
-async def roll_custom(interaction: discord.Interaction, roll: str):
-  is_dungeon_master_or_player = False
-  if interaction.user.name == campaigns[campaign_index]["dungeon_master"]:
-    is_dungeon_master_or_player = True
+@app_commands.describe(roll="roll", times="times", target="target")
+@metrics.time_command("rollcustom")
+async def roll_custom(interaction: discord.Interaction, roll: str, times: int = 1, target: int = None):
+  campaign = await get_play_campaign(interaction)
+  if not campaign:
+    return
+  is_dungeon_master_or_player = interaction.user.name == campaign["dungeon_master"] or campaigns.get_player(campaign, interaction.user.name)
+  if not is_dungeon_master_or_player:
+    return
+  if not 1 <= times <= dice.MAX_ROLLS:
+    await interaction.response.send_message(INVALID_TIMES)
+  elif times == 1 and target is None:
+    await roll_dice(roll, interaction, "Custom Roll:", False, None, False)
   else:
-    for player in campaigns[campaign_index]["players"]:
-      if player["name"] == interaction.user.name:
-        is_dungeon_master_or_player = True
-  if await is_play_mode(interaction) and is_dungeon_master_or_player:
-    await roll_dice(roll, interaction, "Custom Roll:", False, "", False)
+    await roll_dice_many(roll, interaction, "Custom Rolls:", times, False, None, 0, target)
 
 # Give an item to a player
 @bot.tree.command(name="give")
 @app_commands.describe(username="username", item="item", amount="amount")
+@app_commands.autocomplete(username=complete_player_name, item=complete_item_name)
+@metrics.time_command("give")
 async def give(interaction: discord.Interaction, username: str, item: str, amount: int):
+  campaign = await get_play_campaign(interaction)
+  if not campaign:
+    return
   # try to access the item
-  given_item = await does_item_exist(item, campaigns[campaign_index], interaction, False)
+  given_item = await does_item_exist(item, campaign, interaction, False)
   # make sure that the item exists in the campaign
   if not given_item:
-    await interaction.response.send_message(ITEM_NOT_FOUND(campaigns[campaign_index]["name"], item))
+    await interaction.response.send_message(ITEM_NOT_FOUND(campaign["name"], item))
     return
   # make sure that the player is not being given a negative amount of items
   if amount < 1:
     await interaction.response.send_message("You must give at least one item.")
     return
-  if await is_play_mode(interaction) and await is_dungeon_master(campaigns[campaign_index], interaction):
+  if await is_dungeon_master(campaign, interaction):
     start_amount = 0
-    inventory = get_player_inventory(username, campaigns[campaign_index])
-    # see if the player already has some of the same item
-    if item in inventory.keys():
-      start_amount = inventory[item]["amount"]
-    # create an object for the item, making sure to add the amount of the item that they had previously
-    inventory_item = {
-      item: {
-        "amount": amount + start_amount
-      }
-    }
-    # add the item's details to the inventory item
-    for key, value in given_item.items():
-      inventory_item[item][key] = value
-    # update the database
-    inventory.update(inventory_item)
-    database.update_item(campaigns[campaign_index])
+    # the player is only looked up once nothing else can change the campaign,
+    # since another command could have removed them (or moved them to a different position) while this one waited
+    async with lock_campaign(campaign):
+      inventory = get_player_inventory(username, campaign)
+      if inventory is not None:
+        item_path = f"{get_player_path(username, campaign)}.inventory.{item}"
+        # see if the player already has some of the same item
+        if item in inventory.keys():
+          start_amount = inventory[item]["amount"]
+        # update the database, only adding to the amount if the player already had the item
+        # the inventory only refers to the campaign's item, instead of holding a copy of it
+        if start_amount > 0:
+          inventory[item]["amount"] += amount
+          await save_campaign(campaign, { "$inc": { f"{item_path}.amount": amount } })
+        else:
+          campaigns.add_inventory_item(campaign, username, item, { "item_ref": item, "amount": amount })
+          await save_campaign(campaign, { "$set": { item_path: inventory[item] } })
+    # make sure that the item is being given to a player in the campaign
+    if inventory is None:
+      await interaction.response.send_message(f"`{username}` isn't a player in `{campaign['name']}`.")
+      return
     # send a success message
     await interaction.response.send_message(f"Gave {amount} `{item + 's' if amount > 1 else item}` to `{username}`.")
 
+# Split a comma-separated list of names, such as "alice, bob", leaving out any that are repeated
+def parse_names(text):
+  names = []
+  for name in text.split(","):
+    name = name.strip()
+    if name and name not in names:
+      names.append(name)
+  return names
+
+# Split a comma-separated list of items and amounts, such as "arrow:10, sword", into the total amount of each item
+# An item without an amount counts as one, and the amounts of an item that's listed more than once are added together
+# Raises a ValueError with the entry if an amount isn't a whole number that's at least 1
+def parse_item_amounts(text):
+  amounts = {}
+  for entry in text.split(","):
+    name, separator, amount = entry.rpartition(":")
+    if not separator:
+      name, amount = amount, "1"
+    name, amount = name.strip(), amount.strip()
+    if name == "" and amount == "1":
+      continue
+    if name == "" or not amount.isdigit() or int(amount) < 1:
+      raise ValueError(entry.strip())
+    amounts[name] = amounts.get(name, 0) + int(amount)
+  return amounts
+
+# Describe amounts of items, such as "10 `arrow`s, 1 `sword`"
+def describe_amounts(amounts):
+  return ", ".join(f"{amount} `{item}`{'s' if amount > 1 else ''}" for item, amount in amounts.items())
+
+# Get everything that stops items from being given to (or taken from) players
+# Everything is checked before anything changes, so either every player gets every item or nothing changes at all
+def get_bulk_problems(campaign, usernames, amounts, taking):
+  problems = []
+  # Items can be taken back even if the campaign no longer has them, as long as the player does
+  if not taking:
+    for item in amounts:
+      if item not in campaign["items"]:
+        problems.append(ITEM_NOT_FOUND(campaign["name"], item))
+  for username in usernames:
+    inventory = get_player_inventory(username, campaign)
+    if inventory is None:
+      problems.append(f"`{username}` isn't a player in `{campaign['name']}`.")
+    elif taking:
+      for item, amount in amounts.items():
+        held = inventory[item]["amount"] if item in inventory else 0
+        if held < amount:
+          problems.append(f"`{username}` only has {held} `{item}`, so {amount} can't be taken.")
+  return problems
+
+# Give items to (or take items from) players in memory
+# Returns the changes that save all of it to the database in a single update
+def apply_bulk_changes(campaign, usernames, amounts, taking):
+  changes = { "$set": {}, "$inc": {}, "$unset": {} }
+  for username in usernames:
+    inventory = get_player_inventory(username, campaign)
+    player_path = get_player_path(username, campaign)
+    for item, amount in amounts.items():
+      item_path = f"{player_path}.inventory.{item}"
+      if taking:
+        inventory[item]["amount"] -= amount
+        if inventory[item]["amount"] <= 0:
+          campaigns.remove_inventory_item(campaign, username, item)
+          changes["$unset"][item_path] = ""
+        else:
+          changes["$inc"][f"{item_path}.amount"] = -amount
+      elif item in inventory:
+        inventory[item]["amount"] += amount
+        changes["$inc"][f"{item_path}.amount"] = amount
+      else:
+        campaigns.add_inventory_item(campaign, username, item, { "item_ref": item, "amount": amount })
+        changes["$set"][item_path] = inventory[item]
+  return { operator: fields for operator, fields in changes.items() if fields }
+
+# Give (or take) every listed item to (or from) every listed player, answering with a single message
+async def change_many_items(interaction, usernames, items, taking):
+  campaign = await get_play_campaign(interaction)
+  if not campaign or not await is_dungeon_master(campaign, interaction):
+    return
+  names = parse_names(usernames)
+  try:
+    amounts = parse_item_amounts(items)
+  except ValueError as e:
+    await interaction.response.send_message(INVALID_ITEM_AMOUNT(e.args[0]))
+    return
+  if len(names) == 0 or len(amounts) == 0:
+    await interaction.response.send_message("You must list at least one player and one item.")
+    return
+  if len(names) > MAX_BULK_NAMES or len(amounts) > MAX_BULK_NAMES:
+    await interaction.response.send_message(f"You can only list up to {MAX_BULK_NAMES} players and {MAX_BULK_NAMES} items at once.")
+    return
+  # Nothing else can change the campaign between checking the items and changing them
+  async with lock_campaign(campaign):
+    problems = get_bulk_problems(campaign, names, amounts, taking)
+    if len(problems) == 0:
+      await save_campaign(campaign, apply_bulk_changes(campaign, names, amounts, taking))
+  if len(problems) > 0:
+    message = f"Nothing was {'taken' if taking else 'given'}, because:"
+    for i, problem in enumerate(problems):
+      ending = f"\n> ...and {len(problems) - i} more"
+      if len(message) + len(problem) + 3 + len(ending) > MESSAGE_LIMIT:
+        message += ending
+        break
+      message += f"\n> {problem}"
+    await interaction.response.send_message(message)
+    return
+  message = truncate_list(f"{'Took' if taking else 'Gave'} {describe_amounts(amounts)} {'from' if taking else 'to'} ", names, MESSAGE_LIMIT - 1) + "."
+  if len(message) > MESSAGE_LIMIT:
+    message = f"{'Took' if taking else 'Gave'} {len(amounts)} kind/s of item {'from' if taking else 'to'} {len(names)} player/s."
+  await interaction.response.send_message(message)
+
+# Give several items to several players at once, such as "arrow:10, sword" to "alice, bob"
+@bot.tree.command(name="givemany")
+@app_commands.describe(usernames="usernames", items="items")
+@metrics.time_command("givemany")
+async def give_many(interaction: discord.Interaction, usernames: str, items: str):
+  await change_many_items(interaction, usernames, items, False)
+
+# Take several items back from several players at once
+@bot.tree.command(name="takemany")
+@app_commands.describe(usernames="usernames", items="items")
+@metrics.time_command("takemany")
+async def take_many(interaction: discord.Interaction, usernames: str, items: str):
+  await change_many_items(interaction, usernames, items, True)
+
 # Show a player's inventory
 @bot.tree.command(name="inventory")
 @app_commands.describe()
+@metrics.time_command("inventory")
 async def inventory(interaction: discord.Interaction):
   username = interaction.user.name
-  if await is_play_mode(interaction) and await is_player(campaigns[campaign_index], interaction, username, True):
-    inventory = get_player_inventory(username, campaigns[campaign_index])
-    message = f"`{username}`'s inventory:"
-    if len(inventory) == 0:
-      message += "\n> This player currently has no items."
-    else:
-      items_keys = list(inventory.keys())
-      for j in range(len(items_keys)):
-        item = inventory[items_keys[j]]
-        item_details = f"{item['type']}"
-        if item['type'] != ItemType.RESOURCE.value:
-          item_details += f", `{item['damage']}` damage"
-          if item['type'] == ItemType.RANGE_WEAPON.value:
-            item_details += f", `{item['range']}` feet range, `{item['projectile']}` as projectile"
-        name = f"`{items_keys[j]}`s" if item['amount'] > 1 else f"`{items_keys[j]}`"
-        message += f"\n> {j + 1}. {item['amount']} {name}: {item_details}"
-    await interaction.response.send_message(message)
+  campaign = await get_play_campaign(interaction)
+  if campaign and await is_player(campaign, interaction, username, True):
+    inventory = get_player_inventory(username, campaign)
+    key = ("inventory", campaign["_id"], username)
+    version = campaigns.get_version(campaign)
+    paginator = rendered_pages.get(key, version) or rendered_pages.add(key, version, Paginator(f"{username}'s inventory", get_inventory_lines(inventory, campaign)))
+    await send_pages(interaction, paginator)
 
 # Allow a player to roll either an attempted attack or damage with a weapon
 @bot.tree.command(name="rollweapon")
-@app_commands.describe(roll_type="roll_type", weapon="weapon")
-async def roll_weapon(interaction: discord.Interaction, roll_type: str, weapon: str):
+@app_commands.describe(roll_type="roll_type", weapon="weapon", count="count", target="target")
+@app_commands.autocomplete(weapon=complete_weapon_name)
+@metrics.time_command("rollweapon")
+async def roll_weapon(interaction: discord.Interaction, roll_type: str, weapon: str, count: int = 1, target: int = None):
   username = interaction.user.name
-  if await is_play_mode(interaction) and await is_player(campaigns[campaign_index], interaction, username, True):
-    inventory = get_player_inventory(username, campaigns[campaign_index])
+  campaign = await get_play_campaign(interaction)
+  if campaign and await is_player(campaign, interaction, username, True):
+    inventory = get_player_inventory(username, campaign)
     # Make sure that the player has the weapon in their inventory, and that it is actually a weapon
-    if weapon in inventory.keys() and inventory[weapon]["type"] != ItemType.RESOURCE.value:
-      chosenWeapon = inventory[weapon]
-    else:
+    chosenWeapon = get_inventory_weapon(campaign, inventory, weapon)
+    if chosenWeapon is None:
       await interaction.response.send_message(f"You don't have any weapon in your inventory with the name `{weapon}`.")
       return
+    if not 1 <= count <= dice.MAX_ROLLS:
+      await interaction.response.send_message(INVALID_TIMES)
+      return
+    crit_key = (campaign["_id"], username)
+    # The roll is checked before any projectiles or saved critical hits are used up, so they aren't lost when it can't be made
+    if roll_type in ("hit", "damage"):
+      compiled = await is_roll_valid(chosenWeapon[roll_type], interaction, dice.MAX_STORED_DICE)
+      if not compiled or not await is_batch_valid(chosenWeapon[roll_type], compiled, count, interaction):
+        return
     match roll_type:
       case "hit":
-        # If the item is a ranged weapon, make sure to subtract one of its projectiles from the player's inventory
+        # If the item is a ranged weapon, make sure to subtract one of its projectiles from the player's inventory for each attack
         if chosenWeapon["type"] == ItemType.RANGE_WEAPON.value:
-          success = await reduce_item_amount(campaigns[campaign_index], interaction, username, chosenWeapon["projectile"], 1, True)
+          success = await reduce_item_amount(campaign, interaction, username, chosenWeapon["projectile"], count, True)
           if not success:
             return
-        await roll_dice(chosenWeapon["hit"], interaction, f"Rolled to hit with {weapon}:", True, username, False)
+        if count == 1 and target is None:
+          await roll_dice(chosenWeapon["hit"], interaction, f"Rolled to hit with {weapon}:", True, crit_key, False, dice.MAX_STORED_DICE)
+        else:
+          await roll_dice_many(chosenWeapon["hit"], interaction, f"Rolled to hit with {weapon}:", count, True, crit_key, 0, target, dice.MAX_STORED_DICE)
       case "damage":
-        is_crit_dmg = False
-        if username in player_crits:
-          is_crit_dmg = True
-          player_crits.remove(username)
-        await roll_dice(chosenWeapon["damage"], interaction, f"Rolled for damage with {weapon}:", False, "", is_crit_dmg)
+        # Each critical hit that the player has saved up doubles one damage roll
+        saved_crits = player_crits.pop(crit_key, 0)
+        crit_damage_rolls = min(saved_crits, count)
+        if saved_crits > crit_damage_rolls:
+          player_crits[crit_key] = saved_crits - crit_damage_rolls
+        if count == 1:
+          await roll_dice(chosenWeapon["damage"], interaction, f"Rolled for damage with {weapon}:", False, None, crit_damage_rolls > 0, dice.MAX_STORED_DICE)
+        else:
+          await roll_dice_many(chosenWeapon["damage"], interaction, f"Rolled for damage with {weapon}:", count, False, None, crit_damage_rolls, None, dice.MAX_STORED_DICE)
       case _:
         await interaction.response.send_message("The roll type must be either `hit` or `damage`.")
 
-# Run the bot
-bot.run(TOKEN)
+# Show the chances of a roll
+@bot.tree.command(name="rollstats")
+@app_commands.describe(roll="roll", target="target")
+@metrics.time_command("rollstats")
+async def roll_stats(interaction: discord.Interaction, roll: str, target: int = None):
+  compiled = await is_roll_valid(roll, interaction)
+  if compiled:
+    await interaction.response.send_message(f"Odds for `{roll}`:\n{await display_roll_stats(compiled, target)}")
+
+# Show the chances of hitting and the damage of a weapon in a player's inventory
+@bot.tree.command(name="weaponstats")
+@app_commands.describe(weapon="weapon", target="target")
+@app_commands.autocomplete(weapon=complete_weapon_name)
+@metrics.time_command("weaponstats")
+async def weapon_stats(interaction: discord.Interaction, weapon: str, target: int = None):
+  username = interaction.user.name
+  campaign = await get_play_campaign(interaction)
+  if campaign and await is_player(campaign, interaction, username, True):
+    inventory = get_player_inventory(username, campaign)
+    chosenWeapon = get_inventory_weapon(campaign, inventory, weapon)
+    if chosenWeapon is None:
+      await interaction.response.send_message(f"You don't have any weapon in your inventory with the name `{weapon}`.")
+      return
+    # Weapons added before rolls were checked can have rolls that aren't valid
+    hit_roll = await is_roll_valid(chosenWeapon["hit"], interaction, dice.MAX_STORED_DICE)
+    damage_roll = hit_roll and await is_roll_valid(chosenWeapon["damage"], interaction, dice.MAX_STORED_DICE)
+    if not damage_roll:
+      return
+    hit = await display_roll_stats(hit_roll, target)
+    damage = await display_roll_stats(damage_roll, None)
+    await interaction.response.send_message(f"Odds to hit with {weapon} (`{chosenWeapon['hit']}`):\n{hit}\nOdds for damage with {weapon} (`{chosenWeapon['damage']}`):\n{damage}")
+
+# Show how long commands and database calls have been taking
+# Only works in a direct message with the bot, so the numbers don't clutter a server's channels
+@bot.tree.command(name="stats")
+@app_commands.describe()
+@app_commands.dm_only()
+@metrics.time_command("stats")
+async def stats(interaction: discord.Interaction):
+  if interaction.guild_id is not None:
+    await interaction.response.send_message("This command can only be used in a direct message with the bot.")
+    return
+  await send_pages(interaction, Paginator("Stats", metrics.describe()))
+
+# Run the bot, unless this file is being imported (by the benchmarks, for example)
+if __name__ == "__main__":
+  startup.mark_phase("import")
+  bot.run(TOKEN)
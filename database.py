@@ -1,33 +1,267 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, DeleteMany, DeleteOne, InsertOne, MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from bson import ObjectId
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bson
+from journal import Journal
+import metrics
 import os
+import pubsub
+import schema
 
 # Get the database connection string
 load_dotenv()
 CONNECTION_STRING = os.getenv("DATABASE_CONNECTION_STRING")
 
+# How campaigns are laid out in the database, either "embedded" (one document per campaign) or "normalized"
+# Existing campaigns can be moved to the normalized layout with `python migrate.py normalize`
+SCHEMA = os.getenv("DATABASE_SCHEMA", schema.EMBEDDED)
+if SCHEMA not in schema.SCHEMAS:
+  raise ValueError(f"DATABASE_SCHEMA must be one of {', '.join(schema.SCHEMAS)}, not {SCHEMA}")
+
 # Connect to the database
 cluster = MongoClient(CONNECTION_STRING)
 collection = cluster["Campaigns"]["Campaigns"]
+# Only used by the normalized schema
+players_collection = cluster["Campaigns"]["Players"]
+items_collection = cluster["Campaigns"]["Items"]
+
+# Gets one of the collections by its name in the schema module
+def get_collection(name):
+  return { schema.CAMPAIGNS: collection, schema.PLAYERS: players_collection, schema.ITEMS: items_collection }[name]
+
+# Raised when a campaign can't be saved because it was changed by another process since it was loaded
+class ConflictError(Exception):
+  pass
+
+# Raised when a campaign can't be saved because another campaign already has its name
+class NameTakenError(Exception):
+  pass
+
+# How every process running the bot finds out about changes to campaigns, either "local" (only this process) or "changestream"
+# Change streams let any number of processes keep their cached campaigns up to date, but need the database to be a replica set
+CACHE_INVALIDATION = os.getenv("CACHE_INVALIDATION", "local")
+if CACHE_INVALIDATION not in pubsub.PUBSUBS:
+  raise ValueError(f"CACHE_INVALIDATION must be one of {', '.join(pubsub.PUBSUBS)}, not {CACHE_INVALIDATION}")
+campaign_changes = pubsub.create(CACHE_INVALIDATION, lambda: collection)
+
+# pymongo is blocking, so every call made while the bot is running goes through this pool of threads
+# The pool is bounded so a slow database can't pile up an unlimited number of threads
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("DATABASE_WORKERS", 4)), thread_name_prefix="database")
+
+# Runs a blocking database call in the thread pool without blocking the event loop
+async def run_in_executor(function, *args):
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(executor, function, *args)
+
+# Sends a batch of journaled changes to a collection in a single request, in order
+@metrics.time_database
+async def write_batch(collection_name, operations):
+  await run_in_executor(lambda: get_collection(collection_name).bulk_write(operations, ordered=True))
+
+# When a journal file is given, changes are saved to it and written to the database in the background,
+# so commands don't wait on the database and changes made while it's down aren't lost
+JOURNAL_PATH = os.getenv("JOURNAL_PATH")
+journal = Journal(JOURNAL_PATH, write_batch) if JOURNAL_PATH else None
+
+# Journaled changes are written later without checking the campaigns' versions, and find players by their positions,
+# so they would overwrite other processes' changes (or change the wrong players) if several processes shared the campaigns
+if journal and CACHE_INVALIDATION == "changestream":
+  raise ValueError("JOURNAL_PATH can't be used with CACHE_INVALIDATION=changestream, since a journal only works with a single process")
+
+# Replays anything left in the journal from the last run and starts writing it to the database in the background
+# Returns how many changes were replayed
+async def open_journal():
+  return await journal.open() if journal else 0
+
+# Makes sure every journaled change is in the database before reading from it, so reads always see the bot's own changes
+async def flush_journal():
+  if journal and journal.unflushed:
+    await journal.flush()
+
+# Makes a single write from the schema module
+# The only unique index on the campaigns' own documents (besides their ids) is on their names, so a duplicate key means the name is taken
+def make_write(write):
+  try:
+    return make_collection_write(write)
+  except DuplicateKeyError as e:
+    if write["collection"] == schema.CAMPAIGNS:
+      raise NameTakenError(f"The campaign with the id {write['filter']['_id']} has a name that another campaign already has") from e
+    raise
+
+def make_collection_write(write):
+  target = get_collection(write["collection"])
+  match write["op"]:
+    case "insert":
+      return target.insert_one(write["document"])
+    case "update":
+      return target.update_one(write["filter"], write["changes"])
+    case "upsert":
+      return target.update_one(write["filter"], write["changes"], upsert=True)
+    case "delete":
+      return target.delete_one(write["filter"])
+    case "delete_many":
+      return target.delete_many(write["filter"])
+
+# Turns a write from the schema module into an operation that can be sent with others in a bulk write
+def get_operation(write):
+  match write["op"]:
+    case "insert":
+      return InsertOne(write["document"])
+    case "update":
+      return UpdateOne(write["filter"], write["changes"])
+    case "upsert":
+      return UpdateOne(write["filter"], write["changes"], upsert=True)
+    case "delete":
+      return DeleteOne(write["filter"])
+    case "delete_many":
+      return DeleteMany(write["filter"])
+
+# Makes the writes from the schema module in order
+# Each run of writes to the same collection is sent in a single bulk write, instead of one request per write
+# A write that checks the campaign's version is made first, on its own, so nothing else is written if the check fails
+def make_writes(writes):
+  if writes and writes[0].get("check"):
+    if make_write(writes[0]).matched_count == 0:
+      raise ConflictError(f"The campaign with the id {writes[0]['filter']['_id']} was changed by another process")
+    writes = writes[1:]
+  start = 0
+  while start < len(writes):
+    end = start + 1
+    while end < len(writes) and writes[end]["collection"] == writes[start]["collection"]:
+      end += 1
+    if end - start == 1:
+      make_write(writes[start])
+    else:
+      get_collection(writes[start]["collection"]).bulk_write([ get_operation(write) for write in writes[start:end] ], ordered=True)
+    start = end
+
+# Saves writes to the journal if there is one, or makes them straight away if there isn't
+async def save_writes(writes):
+  if journal:
+    await journal.append(writes)
+  else:
+    await run_in_executor(make_writes, writes)
+
+# Creates the indexes that the bot's queries rely on
+@metrics.time_database
+async def create_indexes():
+  await run_in_executor(create_name_index)
+  if SCHEMA == schema.NORMALIZED:
+    await run_in_executor(create_normalized_indexes)
+
+# Campaigns are found by their names, which are unique, so two processes can't both create (or rename a campaign to) the same name
+# A database from before the names were unique has a plain index on them, which is replaced with a unique one,
+# unless some of its campaigns already have the same name, in which case a plain index is kept until they're renamed
+def create_name_index():
+  index = collection.index_information().get("name_1")
+  if index is not None and index.get("unique"):
+    return
+  if index is not None:
+    collection.drop_index("name_1")
+  try:
+    collection.create_index("name", unique=True)
+  except OperationFailure as e:
+    collection.create_index("name")
+    print(f"Campaign names aren't unique in the database, so new campaigns can be given names that are already taken until the campaigns with the same name are renamed: {e}")
+
+# Each player and item is found by its campaign and its name, which are unique within the campaign
+def create_normalized_indexes():
+  for member_collection in (players_collection, items_collection):
+    member_collection.create_index([ ("campaign_id", ASCENDING), ("name", ASCENDING) ], unique=True)
+
+# Loads the players and items of a campaign from their own collections and puts the campaign back together
+def join_campaign(document):
+  players = list(players_collection.find({ "campaign_id": document["_id"] }).sort("_id", ASCENDING))
+  items = list(items_collection.find({ "campaign_id": document["_id"] }))
+  return schema.join_campaign(document, players, items)
 
 # Returns a list of all objects in the database
+@metrics.time_database
 def get_all():
-  return list(collection.find({}))
+  documents = list(collection.find({}))
+  if SCHEMA == schema.NORMALIZED:
+    return [ join_campaign(document) for document in documents ]
+  return documents
+
+# Returns the first object in the database that matches the filter, or None if there isn't one
+@metrics.time_database
+async def find_item(filter):
+  await flush_journal()
+  return await run_in_executor(find_campaign, filter)
+
+def find_campaign(filter):
+  document = collection.find_one(filter)
+  if document and SCHEMA == schema.NORMALIZED:
+    return join_campaign(document)
+  return document
+
+# Returns the name of every campaign, without loading anything else
+@metrics.time_database
+async def get_names():
+  await flush_journal()
+  return await run_in_executor(lambda: [ document["name"] for document in collection.find({}, { "name": 1, "_id": 0 }) ])
+
+# Returns the name, dungeon master and number of players and items of every campaign
+# Only those fields are sent back by the database, instead of every campaign's full document
+@metrics.time_database
+async def get_summaries():
+  await flush_journal()
+  if SCHEMA == schema.NORMALIZED:
+    return await run_in_executor(get_normalized_summaries)
+  pipeline = [
+    { "$project": {
+      "name": 1,
+      "dungeon_master": 1,
+      "player_count": { "$size": "$players" },
+      "item_count": { "$size": { "$objectToArray": "$items" } }
+    } }
+  ]
+  return await run_in_executor(lambda: list(collection.aggregate(pipeline)))
+
+# The players and items of every campaign are counted by the database, so only the counts are sent back
+def get_normalized_summaries():
+  summaries = list(collection.find({}, { "name": 1, "dungeon_master": 1 }))
+  counts = {}
+  for field, member_collection in (("player_count", players_collection), ("item_count", items_collection)):
+    for count in member_collection.aggregate([ { "$group": { "_id": "$campaign_id", "count": { "$sum": 1 } } } ]):
+      counts.setdefault(count["_id"], {})[field] = count["count"]
+  for summary in summaries:
+    campaign_counts = counts.get(summary["_id"], {})
+    summary["player_count"] = campaign_counts.get("player_count", 0)
+    summary["item_count"] = campaign_counts.get("item_count", 0)
+  return summaries
 
 # Adds the provided object into the database
-def add_item(item):
-  id = collection.insert_one(item).inserted_id
-  new_item = item
-  new_item["_id"] = id
-  return new_item
+# The id is made here instead of by the database, so the campaign's players and items can refer to it,
+# and so the campaign can be journaled before it's inserted
+@metrics.time_database
+async def add_item(item):
+  item["_id"] = ObjectId()
+  item[schema.VERSION_FIELD] = 0
+  await save_writes(schema.get_insert_writes(item, SCHEMA))
+  campaign_changes.publish({ "op": "insert", "campaign_id": item["_id"], "version": 0, "name": item["name"] })
+  return item
 
 # Finds the object in the database by its id
-# Replaces the found object's value with the object's current value
-def update_item(item):
-  id = item["_id"]
-  collection.update_one({ "_id": id }, { "$set": item })
+# Applies the given changes (a MongoDB update such as { "$set": { "name": "New name" } }) to the found object
+# Without any changes, the found object's value is replaced with the object's current value
+# Raises a ConflictError if the object was changed by another process since it was loaded, in which case nothing is changed
+# Changes that are journaled are always kept, since they were already confirmed, so they aren't checked
+@metrics.time_database
+async def update_item(item, changes=None):
+  version = item.get(schema.VERSION_FIELD, 0)
+  writes = schema.get_update_writes(item, changes, SCHEMA, None if journal else version)
+  for write in writes:
+    metrics.update_sizes.observe(len(bson.encode(write.get("changes") or write.get("document") or write["filter"])))
+  await save_writes(writes)
+  item[schema.VERSION_FIELD] = version + 1
+  campaign_changes.publish({ "op": "update", "campaign_id": item["_id"], "version": version + 1, "name": item["name"] })
 
 # Removes the provided object from the database
-def remove_item(item):
-  id = item["_id"]
-  collection.delete_one({ "_id": id })
+@metrics.time_database
+async def remove_item(item):
+  await save_writes(schema.get_remove_writes(item, SCHEMA))
+  campaign_changes.publish({ "op": "delete", "campaign_id": item["_id"], "name": item["name"] })
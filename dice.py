@@ -0,0 +1,341 @@
+from collections import namedtuple
+from functools import lru_cache
+from math import comb
+from random import choices, randint
+import re
+
+# All possible dice that can be rolled
+DICE = [ 4, 6, 8, 10, 12, 20, 100 ]
+
+# The most dice that can be rolled in a single roll
+MAX_DICE = 100
+
+# The most times a roll can be made at once
+MAX_ROLLS = 10000
+
+# The most dice that can be rolled by making a roll many times at once, so a single command can't take long
+MAX_BATCH_DICE = 100000
+
+# The most dice that a roll saved on a weapon can roll
+# Weapons made before MAX_DICE existed can have bigger rolls, which can still be rolled as long as a single command can't take long
+MAX_STORED_DICE = MAX_BATCH_DICE
+
+# The most times a single exploding die can explode, so that a roll always ends
+MAX_EXPLOSIONS = 20
+
+# A group of dice in a roll, such as "4d6kh3"
+# sign is 1 or -1, explode is whether the dice roll again when they land on their highest side,
+# and keep is how many dice are kept (None to keep them all), from the highest ones if keep_highest is true
+DiceTerm = namedtuple("DiceTerm", [ "sign", "amount", "sides", "explode", "keep", "keep_highest" ])
+
+# A compiled roll: its groups of dice and the number added to them
+CompiledRoll = namedtuple("CompiledRoll", [ "expression", "terms", "modifier" ])
+
+# Matches a single group of dice, such as "2d20kh1" or "3d6!"
+DICE_TERM = re.compile(r"(\d*)d(\d+)(!?)(?:(kh|kl)(\d+))?")
+
+# Turns a roll such as "2d6 + 1d4 - 1" into a compiled roll that can be rolled any number of times without being parsed again
+# Raises a ValueError if the roll isn't valid or rolls more than max_dice dice
+@lru_cache(maxsize=1024)
+def compile_roll(expression, max_dice=MAX_DICE):
+  normalized = expression.replace(" ", "").lower()
+  # Split the roll into its terms, keeping the sign in front of each one
+  parts = re.split(r"([+-])", normalized)
+  if parts[0] == "":
+    parts = parts[1:]
+  else:
+    parts = [ "+" ] + parts
+  terms = []
+  modifier = 0
+  total_dice = 0
+  for i in range(0, len(parts), 2):
+    if i + 1 >= len(parts) or parts[i + 1] == "":
+      raise ValueError(f"Missing a term in {expression}")
+    sign = 1 if parts[i] == "+" else -1
+    term = parts[i + 1]
+    # A plain number is added to (or subtracted from) the total
+    if term.isdigit():
+      modifier += sign * int(term)
+      continue
+    match = DICE_TERM.fullmatch(term)
+    if not match:
+      raise ValueError(f"{term} isn't a valid term")
+    amount = int(match.group(1)) if match.group(1) else 1
+    sides = int(match.group(2))
+    keep = int(match.group(5)) if match.group(4) else None
+    if amount < 1 or sides not in DICE or (keep is not None and not 1 <= keep <= amount):
+      raise ValueError(f"{term} isn't a valid term")
+    total_dice += amount
+    terms.append(DiceTerm(sign, amount, sides, match.group(3) == "!", keep, match.group(4) == "kh"))
+  if len(terms) == 0 or total_dice > max_dice:
+    raise ValueError(f"{expression} must roll between 1 and {max_dice} dice")
+  return CompiledRoll(normalized, tuple(terms), modifier)
+
+# Gets how many dice a compiled roll rolls, not counting the dice that explode
+def count_dice(compiled):
+  return sum(term.amount for term in compiled.terms)
+
+# Rolls a single die, rolling it again and adding the result each time it lands on its highest side if it explodes
+def roll_die(sides, explode):
+  value = randint(1, sides)
+  total = value
+  explosions = 0
+  while explode and value == sides and explosions < MAX_EXPLOSIONS:
+    value = randint(1, sides)
+    total += value
+    explosions += 1
+  return total
+
+# Gets the positions of the dice that are kept in a group of dice
+def get_kept(term, values):
+  if term.keep is None:
+    return set(range(len(values)))
+  order = sorted(range(len(values)), key=lambda i: values[i], reverse=term.keep_highest)
+  return set(order[:term.keep])
+
+# Rolls every die of a compiled roll individually
+# Returns the total and the values of each group's dice, along with which of them were kept
+def roll(compiled):
+  total = compiled.modifier
+  results = []
+  for term in compiled.terms:
+    values = [ roll_die(term.sides, term.explode) for _ in range(term.amount) ]
+    kept = get_kept(term, values)
+    total += term.sign * sum(values[i] for i in kept)
+    results.append((term, values, kept))
+  return {
+    "total": total,
+    "terms": results,
+    "modifier": compiled.modifier
+  }
+
+# Rolls many dice with the same number of sides at once
+# Exploding dice that land on their highest side are all rolled again together, until none of them explode
+def roll_dice_batch(sides, count, explode):
+  faces = range(1, sides + 1)
+  values = choices(faces, k=count)
+  exploding = [ i for i, value in enumerate(values) if value == sides ] if explode else []
+  explosions = 0
+  while exploding and explosions < MAX_EXPLOSIONS:
+    rerolls = choices(faces, k=len(exploding))
+    for i, value in zip(exploding, rerolls):
+      values[i] += value
+    exploding = [ i for i, value in zip(exploding, rerolls) if value == sides ]
+    explosions += 1
+  return values
+
+# Makes the same compiled roll many times, rolling all the dice of each group in one batch
+# Returns the total of each roll and whether each roll landed on a natural 20 with a kept d20
+def roll_many(compiled, times):
+  totals = [ compiled.modifier ] * times
+  natural_20s = [ False ] * times
+  for term in compiled.terms:
+    values = roll_dice_batch(term.sides, term.amount * times, term.explode)
+    # Split the batch into the dice of each roll, dropping the dice that aren't kept
+    if term.amount == 1:
+      rows = [ [ value ] for value in values ]
+    else:
+      rows = [ values[i:i + term.amount] for i in range(0, len(values), term.amount) ]
+    if term.keep is not None:
+      rows = [ sorted(row, reverse=term.keep_highest)[:term.keep] for row in rows ]
+    totals = [ total + term.sign * sum(row) for total, row in zip(totals, rows) ]
+    if term.sides == 20:
+      natural_20s = [ natural_20 or 20 in row for natural_20, row in zip(natural_20s, rows) ]
+  return {
+    "totals": totals,
+    "natural_20s": natural_20s
+  }
+
+# Checks if a roll landed on a natural 20 with a kept d20
+def is_natural_20(result):
+  for term, values, kept in result["terms"]:
+    if term.sides == 20 and any(values[i] == 20 for i in kept):
+      return True
+  return False
+
+# Describes every die of a roll, such as "[4, 2] + [~1~, 6] + 3"
+# Dice that weren't kept are surrounded by tildes
+def describe(result):
+  description = ""
+  for term, values, kept in result["terms"]:
+    dice = ", ".join(str(value) if i in kept else f"~{value}~" for i, value in enumerate(values))
+    if description:
+      description += " + " if term.sign > 0 else " - "
+    elif term.sign < 0:
+      description += "-"
+    description += f"[{dice}]"
+  if result["modifier"]:
+    description += f" {'+' if result['modifier'] > 0 else '-'} {abs(result['modifier'])}"
+  return description
+
+# The smallest chance that's still counted when working out the chances of a roll
+# Exploding dice can go on for a long time, so results that are less likely than this are left out
+MIN_PROBABILITY = 1e-12
+
+# The most steps that working out the exact chances of a roll can take, which keeps it to about half a second
+# A step is multiplying two chances together, and rolls that would take more steps, such as "50d100kh25", have their chances estimated instead
+MAX_EXACT_STEPS = 5000000
+
+# How many steps each chance worked out by keep_distribution and add_uniform_die counts as, since they do more for each one than convolve
+SLOW_STEP = 10
+
+# How many dice are rolled to estimate the chances of a roll that's too big to work out exactly
+SAMPLE_DICE = 500000
+
+# Raised when working out the exact chances of a roll would take more than MAX_EXACT_STEPS steps
+class TooComplexError(Exception):
+  pass
+
+# Counts down the steps that are left for working out the chances of a roll
+class StepBudget:
+  def __init__(self, steps):
+    self.steps = steps
+
+  # Takes steps from the budget before they're made, so a roll that's too big fails before doing most of its work
+  def spend(self, steps):
+    self.steps -= steps
+    if self.steps < 0:
+      raise TooComplexError()
+
+# Gets the chance of each value of a single die as a dictionary
+def die_distribution(sides, explode):
+  if not explode:
+    return { value: 1 / sides for value in range(1, sides + 1) }
+  distribution = {}
+  chance = 1 / sides
+  explosions = 0
+  # Each time the die explodes, the values it can end on move up by its number of sides
+  while chance >= MIN_PROBABILITY:
+    last = explosions == MAX_EXPLOSIONS
+    for value in range(1, sides + (1 if last else 0)):
+      distribution[explosions * sides + value] = chance
+    if last:
+      break
+    chance /= sides
+    explosions += 1
+  return distribution
+
+# Combines the chances of two independent rolls into the chances of their sum
+# Each distribution is a pair of the lowest value and the list of chances starting from it
+def convolve(first, second, budget):
+  first_offset, first_chances = first
+  second_offset, second_chances = second
+  budget.spend(len(first_chances) * len(second_chances))
+  chances = [ 0.0 ] * (len(first_chances) + len(second_chances) - 1)
+  for i, first_chance in enumerate(first_chances):
+    if first_chance == 0:
+      continue
+    for j, second_chance in enumerate(second_chances):
+      chances[i + j] += first_chance * second_chance
+  return (first_offset + second_offset, chances)
+
+# Adds a fair die with the given number of sides to a distribution
+# The chance of each new total is the average of a window of the old chances, so it's worked out with running sums
+def add_uniform_die(distribution, sides, budget):
+  offset, chances = distribution
+  budget.spend((len(chances) + sides) * SLOW_STEP)
+  sums = [ 0.0 ]
+  for chance in chances:
+    sums.append(sums[-1] + chance)
+  length = len(chances) + sides - 1
+  # Rounding errors can make the chance of a very unlikely total slightly negative, so it's kept at zero
+  new_chances = [ max((sums[min(i + 1, len(chances))] - sums[max(i + 1 - sides, 0)]) / sides, 0.0) for i in range(length) ]
+  return (offset + 1, new_chances)
+
+# Gets the chances of the total of the kept dice, when only the highest (or lowest) dice are kept
+# The faces are gone through from the first kept to the last, counting how many dice land on each one
+def keep_distribution(die, amount, keep, keep_highest, budget):
+  combinations = [ [ comb(remaining, count) for count in range(remaining + 1) ] for remaining in range(amount + 1) ]
+  states = { (0, 0): 1.0 }
+  for face in sorted(die, reverse=keep_highest):
+    powers = [ die[face] ** count for count in range(amount + 1) ]
+    new_states = {}
+    for (used, total), state_chance in states.items():
+      remaining = amount - used
+      budget.spend((remaining + 1) * SLOW_STEP)
+      for count, combination in enumerate(combinations[remaining]):
+        kept = min(used + count, keep) - min(used, keep)
+        key = (used + count, total + kept * face)
+        new_states[key] = new_states.get(key, 0.0) + state_chance * combination * powers[count]
+    states = new_states
+  totals = { total: state_chance for (used, total), state_chance in states.items() if used == amount }
+  offset = min(totals)
+  chances = [ 0.0 ] * (max(totals) - offset + 1)
+  for total, state_chance in totals.items():
+    chances[total - offset] = state_chance
+  return (offset, chances)
+
+# Leaves out the highest totals of a distribution while they're less likely than MIN_PROBABILITY
+# Exploding dice have a long tail of very unlikely totals, which would otherwise make each die added to them slower
+def trim(distribution):
+  offset, chances = distribution
+  end = len(chances)
+  while end > 1 and chances[end - 1] < MIN_PROBABILITY:
+    end -= 1
+  return (offset, chances[:end])
+
+# Gets the chances of the total of a single group of dice
+def term_distribution(term, budget):
+  if term.keep is not None and term.keep < term.amount:
+    distribution = keep_distribution(die_distribution(term.sides, term.explode), term.amount, term.keep, term.keep_highest, budget)
+  elif term.explode:
+    die = die_distribution(term.sides, True)
+    die = (1, [ die.get(value, 0.0) for value in range(1, max(die) + 1) ])
+    distribution = (0, [ 1.0 ])
+    for _ in range(term.amount):
+      distribution = trim(convolve(distribution, die, budget))
+  else:
+    distribution = (0, [ 1.0 ])
+    for _ in range(term.amount):
+      distribution = add_uniform_die(distribution, term.sides, budget)
+  if term.sign < 0:
+    offset, chances = distribution
+    distribution = (-(offset + len(chances) - 1), chances[::-1])
+  return distribution
+
+# Gets the exact chance of every total of a compiled roll
+# Returns the lowest total and the list of chances starting from it
+# Raises a TooComplexError if it would take more than MAX_EXACT_STEPS steps
+# The result is cached, so asking about the same roll again costs nothing
+@lru_cache(maxsize=256)
+def distribution(compiled):
+  budget = StepBudget(MAX_EXACT_STEPS)
+  result = (compiled.modifier, [ 1.0 ])
+  for term in compiled.terms:
+    result = convolve(result, term_distribution(term, budget), budget)
+  return result
+
+# Estimates the chance of every total of a compiled roll by making it many times, in the same form as distribution
+# Returns the distribution and how many times the roll was made
+def sample_distribution(compiled):
+  times = max(SAMPLE_DICE // count_dice(compiled), 1)
+  totals = roll_many(compiled, times)["totals"]
+  offset = min(totals)
+  chances = [ 0.0 ] * (max(totals) - offset + 1)
+  for total in totals:
+    chances[total - offset] += 1 / times
+  return (offset, chances), times
+
+# Gets the average and some percentiles of a compiled roll, and the chance of reaching the target if one is given
+# The chances are exact unless the roll is too big to work out exactly, in which case "samples" is how many rolls they're estimated from
+@lru_cache(maxsize=1024)
+def get_stats(compiled, target=None):
+  try:
+    offset, chances = distribution(compiled)
+    samples = None
+  except TooComplexError:
+    (offset, chances), samples = sample_distribution(compiled)
+  stats = {
+    "mean": sum((offset + i) * chance for i, chance in enumerate(chances)),
+    "percentiles": {},
+    "samples": samples
+  }
+  cumulative = 0.0
+  percentiles = [ 10, 25, 50, 75, 90 ]
+  for i, chance in enumerate(chances):
+    cumulative += chance
+    while percentiles and cumulative >= percentiles[0] / 100 - MIN_PROBABILITY:
+      stats["percentiles"][percentiles.pop(0)] = offset + i
+  if target is not None:
+    stats["target_chance"] = sum(chances[max(target - offset, 0):])
+  return stats
@@ -0,0 +1,194 @@
+from bson import json_util
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+import asyncio
+import os
+
+# How many seconds pass between writing the journal to the database
+FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", 1))
+
+# The most changes that are sent to the database in a single batch
+BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", 1000))
+
+# How many changes can be written to the database before the journal is rewritten without them
+COMPACT_SIZE = int(os.getenv("JOURNAL_COMPACT_SIZE", 10000))
+
+# The longest wait, in seconds, before trying again when the database can't be written to
+MAX_RETRY_INTERVAL = 60
+
+# The field of each document that holds the number of the last change that was written to it
+# Changes with a number that isn't higher are skipped, so replaying the journal never applies a change twice
+SEQUENCE_FIELD = "journal_seq"
+
+# The field of the line that starts a compacted journal, which holds the number of the last change that was ever added to it
+# Changes are numbered on from it when the bot starts again, so their numbers never go backwards, even once the journal is empty,
+# and the documents that already have the numbers of old changes don't skip the new ones
+LAST_SEQUENCE_FIELD = "last_seq"
+
+# Turns a change (one of the writes made by the schema module) into the operation that writes it to the database
+# Every operation can be repeated safely: inserts only happen if the document doesn't exist yet,
+# updates only happen if the document hasn't had them (or a later change) yet, upserts only set whole values,
+# and deletes do nothing the second time
+def get_operation(entry):
+  sequence = entry["seq"]
+  filter = entry["filter"]
+  match entry["op"]:
+    case "insert":
+      document = { key: value for key, value in entry["document"].items() if key not in filter }
+      document[SEQUENCE_FIELD] = sequence
+      return UpdateOne(filter, { "$setOnInsert": document }, upsert=True)
+    case "update" | "upsert":
+      changes = dict(entry["changes"])
+      changes["$set"] = { **changes.get("$set", {}), SEQUENCE_FIELD: sequence }
+      if entry["op"] == "upsert":
+        return UpdateOne(filter, changes, upsert=True)
+      return UpdateOne({ **filter, SEQUENCE_FIELD: { "$not": { "$gte": sequence } } }, changes)
+    case "delete":
+      return DeleteOne(filter)
+    case "delete_many":
+      return DeleteMany(filter)
+
+# An append-only file of every change made to the campaigns, which are written to the database in batches afterwards
+# A change counts as saved once it's in the file and the file has been synced to the disk,
+# so the bot doesn't wait on the database, and changes made while the database is down aren't lost
+class Journal:
+  def __init__(self, path, write_batch):
+    self.path = path
+    # Sends a list of operations to a collection of the database
+    self.write_batch = write_batch
+    # The number of the last change that was added
+    self.sequence = 0
+    # The lines of the changes that haven't been written to the database yet, in order
+    self.unflushed = []
+    # The number of the last change that was written to the database,
+    # and how many changes have been written to the database since the journal was last compacted
+    self.flushed_sequence = 0
+    self.flushed_count = 0
+    # The changes that are waiting to be synced to the disk, along with the futures that finish once they are
+    self.pending = []
+    self.syncing = None
+    self.flush_lock = asyncio.Lock()
+    self.flush_task = None
+    self.file = None
+    # All file operations happen on one thread, in the order they were asked for
+    self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+
+  async def run_in_executor(self, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self.executor, function, *args)
+
+  # Reads the changes that are already in the journal, writes them to the database and starts writing new changes in the background
+  # Returns how many changes were replayed
+  async def open(self):
+    self.unflushed = []
+    for line in await self.run_in_executor(self.read_lines):
+      entry = json_util.loads(line)
+      if LAST_SEQUENCE_FIELD in entry:
+        self.sequence = max(self.sequence, entry[LAST_SEQUENCE_FIELD])
+      else:
+        self.sequence = max(self.sequence, entry["seq"])
+        self.unflushed.append(line)
+    self.file = await self.run_in_executor(open, self.path, "a", 1, "utf-8")
+    replayed = len(self.unflushed)
+    if replayed:
+      await self.flush()
+    self.flush_task = asyncio.create_task(self.flush_forever())
+    return replayed
+
+  # Reads every complete line in the journal
+  # A change that was only partly written when the bot stopped was never synced to the disk, so it was never confirmed and is left out
+  def read_lines(self):
+    if not os.path.exists(self.path):
+      return []
+    with open(self.path, encoding="utf-8") as file:
+      return [ line for line in file.read().split("\n")[:-1] if line ]
+
+  # Adds changes to the journal, returning once they have been synced to the disk
+  # The changes are turned into text straight away, so changing the campaign afterwards doesn't change what's saved
+  async def append(self, writes):
+    lines = []
+    for write in writes:
+      self.sequence += 1
+      lines.append(json_util.dumps({ "seq": self.sequence, **write }))
+    future = asyncio.get_running_loop().create_future()
+    self.pending.append((lines, future))
+    if self.syncing is None:
+      self.syncing = asyncio.create_task(self.sync_pending())
+    await future
+
+  # Writes every waiting change to the file with a single sync to the disk
+  # Changes that are added while the disk is syncing wait for the next sync, along with any others that arrive meanwhile
+  async def sync_pending(self):
+    try:
+      while self.pending:
+        batch, self.pending = self.pending, []
+        lines = [ line for appended_lines, future in batch for line in appended_lines ]
+        try:
+          await self.run_in_executor(self.write_lines, lines)
+        except Exception as e:
+          for appended_lines, future in batch:
+            future.set_exception(e)
+          continue
+        self.unflushed += lines
+        for appended_lines, future in batch:
+          future.set_result(None)
+    finally:
+      self.syncing = None
+
+  def write_lines(self, lines):
+    self.file.write("".join(f"{line}\n" for line in lines))
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  # Writes the changes that haven't been written yet to the database, in batches
+  # Raises the database's error if it can't be written to, keeping the changes that weren't written for next time
+  async def flush(self):
+    async with self.flush_lock:
+      while self.unflushed:
+        entries = [ json_util.loads(line) for line in self.unflushed[:BATCH_SIZE] ]
+        # The changes are sent in order, with each run of changes to the same collection sent together
+        start = 0
+        while start < len(entries):
+          end = start + 1
+          while end < len(entries) and entries[end]["collection"] == entries[start]["collection"]:
+            end += 1
+          await self.write_batch(entries[start]["collection"], [ get_operation(entry) for entry in entries[start:end] ])
+          del self.unflushed[:end - start]
+          self.flushed_sequence = entries[end - 1]["seq"]
+          self.flushed_count += end - start
+          start = end
+      if self.flushed_count >= COMPACT_SIZE:
+        await self.compact()
+
+  # Rewrites the journal with only the changes that haven't been written to the database
+  # The new journal is synced to the disk before it replaces the old one, so a crash in the middle leaves one of them whole
+  # The new journal starts with the number of the last change that was added, so it's kept even if every change is left out
+  async def compact(self):
+    await self.run_in_executor(self.rewrite, self.flushed_sequence, self.sequence)
+    self.flushed_count = 0
+
+  # The lines are read back from the file, rather than taken from the unflushed changes,
+  # so changes that were synced to the disk but haven't been confirmed yet are kept too
+  def rewrite(self, flushed_sequence, last_sequence):
+    lines = [ json_util.dumps({ LAST_SEQUENCE_FIELD: last_sequence }) ]
+    lines += [ line for line in self.read_lines() if json_util.loads(line).get("seq", 0) > flushed_sequence ]
+    temporary_path = f"{self.path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+      file.write("".join(f"{line}\n" for line in lines))
+      file.flush()
+      os.fsync(file.fileno())
+    self.file.close()
+    os.replace(temporary_path, self.path)
+    self.file = open(self.path, "a", 1, "utf-8")
+
+  # Writes the journal to the database every so often, waiting longer between tries while the database is down
+  async def flush_forever(self):
+    interval = FLUSH_INTERVAL
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        await self.flush()
+        interval = FLUSH_INTERVAL
+      except Exception as e:
+        interval = min(interval * 2, MAX_RETRY_INTERVAL)
+        print(f"Couldn't write {len(self.unflushed)} journaled change/s to the database, trying again in {interval:g}s: {e}")
@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from functools import wraps
+import asyncio
+import inspect
+import os
+import time
+
+# Where the metrics are served in the Prometheus text format, only reachable from this machine by default
+# Setting the port to 0 turns the endpoint off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9400))
+
+# How many seconds a scrape of the endpoint can take to send its request before it's dropped
+REQUEST_TIMEOUT = 5
+
+# The upper bounds of the histograms' buckets, in seconds for latencies and in bytes for document sizes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Counts how many values fall in each of a set of buckets, along with their sum
+# Recording a value is a binary search and a few additions, so it's cheap enough to do on every call
+class Histogram:
+  def __init__(self, buckets):
+    self.buckets = buckets
+    # The last count is for values that are larger than every bucket
+    self.counts = [ 0 ] * (len(buckets) + 1)
+    self.sum = 0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  # Estimates a quantile (such as 0.99) as the upper bound of the bucket it falls in
+  # Returns None if nothing has been recorded, or infinity if it's larger than every bucket
+  def quantile(self, quantile):
+    if self.count == 0:
+      return None
+    cumulative = 0
+    for bound, count in zip(self.buckets, self.counts):
+      cumulative += count
+      if cumulative >= quantile * self.count:
+        return bound
+    return float("inf")
+
+  # Gets the histogram's lines in the Prometheus text format, with its buckets counted cumulatively
+  def export(self, name, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(self.buckets, self.counts):
+      cumulative += count
+      lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+    lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+    lines.append(f"{name}_count{{{labels}}} {self.count}")
+    return lines
+
+# How long each command took, keyed by the command's name, and how many times each command failed
+command_latency = {}
+command_errors = {}
+
+# How long each call to the database took, keyed by the name of the function in the database module
+database_latency = {}
+
+# How large the documents (or changes to documents) written by update_item were
+update_sizes = Histogram(SIZE_BUCKETS)
+
+# Times every call of a command, including the ones that fail
+# Goes between the command's decorators and its function, so the command is registered with the timed function
+def time_command(name):
+  command_latency[name] = Histogram(LATENCY_BUCKETS)
+  command_errors[name] = 0
+  def decorator(function):
+    histogram = command_latency[name]
+    @wraps(function)
+    async def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return await function(*args, **kwargs)
+      except Exception:
+        command_errors[name] += 1
+        raise
+      finally:
+        histogram.observe(time.perf_counter() - start)
+    return timed
+  return decorator
+
+# Times every call of a database function, whether it's blocking or a coroutine
+def time_database(function):
+  histogram = database_latency[function.__name__] = Histogram(LATENCY_BUCKETS)
+  if inspect.iscoroutinefunction(function):
+    @wraps(function)
+    async def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return await function(*args, **kwargs)
+      finally:
+        histogram.observe(time.perf_counter() - start)
+  else:
+    @wraps(function)
+    def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        histogram.observe(time.perf_counter() - start)
+  return timed
+
+# Gets every metric in the Prometheus text format
+def export():
+  lines = [
+    "# HELP adventure_bot_command_seconds How long each command took to run.",
+    "# TYPE adventure_bot_command_seconds histogram"
+  ]
+  for name, histogram in command_latency.items():
+    lines += histogram.export("adventure_bot_command_seconds", f'command="{name}"')
+  lines += [
+    "# HELP adventure_bot_command_errors_total How many times each command failed with an error.",
+    "# TYPE adventure_bot_command_errors_total counter"
+  ]
+  for name, errors in command_errors.items():
+    lines.append(f'adventure_bot_command_errors_total{{command="{name}"}} {errors}')
+  lines += [
+    "# HELP adventure_bot_database_seconds How long each call to the database took.",
+    "# TYPE adventure_bot_database_seconds histogram"
+  ]
+  for name, histogram in database_latency.items():
+    lines += histogram.export("adventure_bot_database_seconds", f'function="{name}"')
+  lines += [
+    "# HELP adventure_bot_update_bytes How large the documents written by update_item were, encoded as BSON.",
+    "# TYPE adventure_bot_update_bytes histogram"
+  ]
+  lines += update_sizes.export("adventure_bot_update_bytes", 'function="update_item"')
+  return "\n".join(lines) + "\n"
+
+# Formats a number of seconds as milliseconds, for the stats command
+def format_seconds(seconds):
+  if seconds is None:
+    return "-"
+  if seconds == float("inf"):
+    return f">{LATENCY_BUCKETS[-1] * 1000:g}ms"
+  return f"≤{seconds * 1000:g}ms"
+
+# Describes the metrics as lines of text, leaving out anything that hasn't been used yet
+def describe():
+  lines = [ "**Commands** (calls, errors, p50, p99)" ]
+  for name, histogram in command_latency.items():
+    if histogram.count:
+      lines.append(f"/{name}: {histogram.count}, {command_errors[name]}, {format_seconds(histogram.quantile(0.5))}, {format_seconds(histogram.quantile(0.99))}")
+  lines.append("**Database** (calls, average, p99)")
+  for name, histogram in database_latency.items():
+    if histogram.count:
+      lines.append(f"{name}: {histogram.count}, {histogram.sum / histogram.count * 1000:.2f}ms, {format_seconds(histogram.quantile(0.99))}")
+  if update_sizes.count:
+    lines.append(f"**Updates**: {update_sizes.count} written, averaging {update_sizes.sum / update_sizes.count:.0f} bytes")
+  return lines
+
+# Answers a single request to the endpoint with the current metrics
+async def handle_request(reader, writer):
+  try:
+    request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+    # The request's headers aren't needed, but they're read so the connection closes cleanly
+    while await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT) not in (b"\r\n", b"\n", b""):
+      pass
+    parts = request_line.split()
+    if len(parts) >= 2 and parts[1] in (b"/", b"/metrics"):
+      status, body = "200 OK", export()
+    else:
+      status, body = "404 Not Found", "Not found\n"
+    body = body.encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+  except (asyncio.TimeoutError, ConnectionError):
+    pass
+  finally:
+    writer.close()
+
+# Starts serving the metrics, returning the server, or None if the endpoint is turned off
+async def start_server():
+  if not METRICS_PORT:
+    return None
+  return await asyncio.start_server(handle_request, METRICS_HOST, METRICS_PORT)
@@ -0,0 +1,153 @@
+# Moves the campaigns that are already in the database to a different layout, a batch of campaigns at a time
+# Only one batch of campaigns is held in memory at once, so any number of campaigns can be moved
+# The bot should be stopped (with its journal, if it has one, written to the database) while this runs
+# Usage: python migrate.py normalize [--batch-size 100] [--keep-embedded]
+#        python migrate.py references [--batch-size 100] [--dry-run]
+from argparse import ArgumentParser
+from pymongo import UpdateOne
+import bson
+import database
+import schema
+import time
+
+# Splits the documents from a cursor into lists of the given size
+# The cursor fetches the documents from the database in batches of the same size, instead of all at once
+def in_batches(cursor, batch_size):
+  batch = []
+  for document in cursor.batch_size(batch_size):
+    batch.append(document)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+# Moves a batch of embedded campaigns into the normalized layout
+# Players and items that were already moved are left alone, so running this again after it stopped part way through is safe
+# The players are moved in order, so they keep their order in the campaign
+# Returns the number of players and items that were moved
+def normalize_batch(campaigns, keep_embedded):
+  player_operations = []
+  item_operations = []
+  for campaign in campaigns:
+    document, players, items = schema.split_campaign(campaign)
+    player_operations += [ UpdateOne(schema.get_member_filter(campaign["_id"], player["name"]), { "$setOnInsert": player }, upsert=True) for player in players ]
+    item_operations += [ UpdateOne(schema.get_member_filter(campaign["_id"], item["name"]), { "$setOnInsert": item }, upsert=True) for item in items ]
+  if player_operations:
+    database.players_collection.bulk_write(player_operations, ordered=True)
+  if item_operations:
+    database.items_collection.bulk_write(item_operations, ordered=False)
+  # The embedded copies are only removed once their players and items are safely in their own collections
+  if not keep_embedded:
+    database.collection.update_many({ "_id": { "$in": [ campaign["_id"] for campaign in campaigns ] } }, { "$unset": { "players": "", "items": "" } })
+  return len(player_operations), len(item_operations)
+
+# Moves every embedded campaign into the normalized layout
+def normalize(batch_size, keep_embedded):
+  database.create_normalized_indexes()
+  start = time.perf_counter()
+  campaign_count = player_count = item_count = largest_size = 0
+  for batch in in_batches(database.collection.find({ "players": { "$exists": True } }), batch_size):
+    largest_size = max(largest_size, *(len(bson.encode(campaign)) for campaign in batch))
+    players, items = normalize_batch(batch, keep_embedded)
+    campaign_count, player_count, item_count = campaign_count + len(batch), player_count + players, item_count + items
+    print(f"Moved {campaign_count} campaign/s so far...")
+  print(f"Moved {campaign_count} campaign/s, {player_count} player/s and {item_count} item/s in {time.perf_counter() - start:.2f}s")
+  print(f"The largest campaign was {largest_size} bytes. Set DATABASE_SCHEMA={schema.NORMALIZED} to use the normalized layout.")
+
+# Replaces the copies of items in an inventory with references to the campaign's items
+# An item that the campaign doesn't have anymore is added back to the campaign's items from its copy, so nothing is lost
+# Returns the new inventory, or None if it was already only made of references
+def reference_inventory(inventory, items):
+  if all("item_ref" in item for item in inventory.values()):
+    return None
+  new_inventory = {}
+  for name, item in inventory.items():
+    if "item_ref" not in item:
+      if name not in items:
+        items[name] = { key: value for key, value in item.items() if key != "amount" }
+      item = { "item_ref": name, "amount": item["amount"] }
+    new_inventory[name] = item
+  return new_inventory
+
+# Replaces the copies of items in a batch of embedded campaigns
+# Returns the size of the campaigns before and after, in bytes
+def reference_embedded_batch(campaigns, dry_run):
+  operations = []
+  before = after = 0
+  for campaign in campaigns:
+    before += len(bson.encode(campaign))
+    changed = False
+    for player in campaign["players"]:
+      new_inventory = reference_inventory(player["inventory"], campaign["items"])
+      if new_inventory is not None:
+        player["inventory"] = new_inventory
+        changed = True
+    after += len(bson.encode(campaign))
+    if changed:
+      operations.append(UpdateOne({ "_id": campaign["_id"] }, { "$set": { "players": campaign["players"], "items": campaign["items"] } }))
+  if operations and not dry_run:
+    database.collection.bulk_write(operations, ordered=False)
+  return before, after
+
+# Replaces the copies of items in a batch of normalized players
+# Returns the size of the players before and after, in bytes
+def reference_normalized_batch(players, dry_run):
+  campaign_items = {}
+  for item in database.items_collection.find({ "campaign_id": { "$in": list({ player["campaign_id"] for player in players }) } }):
+    campaign_items.setdefault(item["campaign_id"], {})[item["name"]] = item
+  player_operations = []
+  item_operations = []
+  before = after = 0
+  for player in players:
+    before += len(bson.encode(player))
+    items = campaign_items.setdefault(player["campaign_id"], {})
+    known_items = set(items)
+    new_inventory = reference_inventory(player.get("inventory", {}), items)
+    if new_inventory is not None:
+      player["inventory"] = new_inventory
+      player_operations.append(UpdateOne({ "_id": player["_id"] }, { "$set": { "inventory": new_inventory } }))
+      for name in set(items) - known_items:
+        item_operations.append(UpdateOne(schema.get_member_filter(player["campaign_id"], name), { "$setOnInsert": items[name] }, upsert=True))
+    after += len(bson.encode(player))
+  if not dry_run:
+    # Any items that are added back go in before the references to them
+    if item_operations:
+      database.items_collection.bulk_write(item_operations, ordered=False)
+    if player_operations:
+      database.players_collection.bulk_write(player_operations, ordered=False)
+  return before, after
+
+# Replaces the copies of items in every inventory with references to the campaigns' items, and shows how much smaller that makes them
+def reference(batch_size, dry_run):
+  start = time.perf_counter()
+  count = before = after = 0
+  if database.SCHEMA == schema.NORMALIZED:
+    kind = "player/s"
+    batches = ((len(batch), *reference_normalized_batch(batch, dry_run)) for batch in in_batches(database.players_collection.find({}), batch_size))
+  else:
+    kind = "campaign/s"
+    batches = ((len(batch), *reference_embedded_batch(batch, dry_run)) for batch in in_batches(database.collection.find({ "players": { "$exists": True } }), batch_size))
+  for batch_count, batch_before, batch_after in batches:
+    count, before, after = count + batch_count, before + batch_before, after + batch_after
+  reduction = 100 * (before - after) / before if before else 0
+  print(f"{'Checked' if dry_run else 'Migrated'} {count} {kind} in {time.perf_counter() - start:.2f}s")
+  print(f"The {kind} {'would go' if dry_run else 'went'} from {before} bytes to {after} bytes ({reduction:.1f}% smaller)")
+
+if __name__ == "__main__":
+  parser = ArgumentParser(description="Move the campaigns in the database to a different layout.")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  normalize_parser = subparsers.add_parser("normalize", help="move each campaign's players and items into their own collections")
+  normalize_parser.add_argument("--batch-size", type=int, default=100, help="how many campaigns are moved at once")
+  normalize_parser.add_argument("--keep-embedded", action="store_true", help="leave the players and items in the campaigns' documents too")
+  references_parser = subparsers.add_parser("references", help="replace the copies of items in inventories with references to the campaigns' items")
+  references_parser.add_argument("--batch-size", type=int, default=100, help="how many campaigns (or players, in the normalized layout) are migrated at once")
+  references_parser.add_argument("--dry-run", action="store_true", help="only show how much smaller the inventories would be")
+  arguments = parser.parse_args()
+  if arguments.batch_size < 1:
+    parser.error("the batch size must be at least 1")
+  match arguments.command:
+    case "normalize":
+      normalize(arguments.batch_size, arguments.keep_embedded)
+    case "references":
+      reference(arguments.batch_size, arguments.dry_run)
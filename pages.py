@@ -0,0 +1,117 @@
+from collections import OrderedDict
+import discord
+import os
+
+# The most characters that are shown on a single page, well under the limit of an embed's description
+PAGE_LENGTH = 1800
+
+# How many rendered lists are kept in memory at once
+CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 256))
+
+# How many seconds the page buttons keep working after a list is shown
+VIEW_TIMEOUT = 10 * 60
+
+# Splits lines of text into pages, only rendering the lines of a page when that page is first asked for
+# Pages that have already been rendered are kept, so going back to them is free
+class Paginator:
+  def __init__(self, title, lines):
+    self.title = title
+    self.lines = iter(lines)
+    self.pages = []
+    self.finished = False
+    # A line that was rendered but didn't fit on the page before it
+    self.next_line = None
+
+  # Renders the next page, returning False if there are no lines left
+  def render_page(self):
+    if self.finished:
+      return False
+    page = ""
+    while True:
+      line = self.next_line if self.next_line is not None else next(self.lines, None)
+      self.next_line = None
+      if line is None:
+        self.finished = True
+        break
+      # Lines that are too long on their own are cut so that they still fit on a page
+      line = line[:PAGE_LENGTH]
+      if page and len(page) + len(line) + 1 > PAGE_LENGTH:
+        self.next_line = line
+        break
+      page += f"\n{line}" if page else line
+    if page:
+      self.pages.append(page)
+    return bool(page)
+
+  # Checks if a page exists, rendering the pages up to it if they haven't been yet
+  def has_page(self, number):
+    while len(self.pages) <= number:
+      if not self.render_page():
+        return False
+    return True
+
+  # Gets a page as an embed
+  def get_embed(self, number):
+    if not self.has_page(number):
+      return discord.Embed(title=self.title, description="There's nothing to show.")
+    embed = discord.Embed(title=self.title, description=self.pages[number])
+    if number > 0 or self.has_page(1):
+      embed.set_footer(text=f"Page {number + 1}")
+    return embed
+
+# The buttons for moving between the pages of a list
+class PageView(discord.ui.View):
+  def __init__(self, paginator):
+    super().__init__(timeout=VIEW_TIMEOUT)
+    self.paginator = paginator
+    self.page = 0
+    self.update_buttons()
+
+  # Only lets the buttons be pressed when there's a page to move to
+  def update_buttons(self):
+    self.previous_page.disabled = self.page == 0
+    self.next_page.disabled = not self.paginator.has_page(self.page + 1)
+
+  async def show_page(self, interaction, page):
+    self.page = page
+    self.update_buttons()
+    await interaction.response.edit_message(embed=self.paginator.get_embed(self.page), view=self)
+
+  @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+  async def previous_page(self, interaction, button):
+    await self.show_page(interaction, self.page - 1)
+
+  @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+  async def next_page(self, interaction, button):
+    await self.show_page(interaction, self.page + 1)
+
+# Keeps the most recently shown lists, each tagged with the version of the data it was rendered from
+# A list is rendered again once its data has changed, which gives it a new version
+class PageCache:
+  def __init__(self, size=CACHE_SIZE):
+    self.size = size
+    self.paginators = OrderedDict()
+
+  # Gets the cached list for a key if it was rendered from the current version, or None if it wasn't
+  def get(self, key, version):
+    cached = self.paginators.get(key)
+    if cached is None or cached[0] != version:
+      return None
+    self.paginators.move_to_end(key)
+    return cached[1]
+
+  # Caches a list, removing the least recently used lists if the cache is full
+  def add(self, key, version, paginator):
+    self.paginators[key] = (version, paginator)
+    self.paginators.move_to_end(key)
+    while len(self.paginators) > self.size:
+      self.paginators.popitem(last=False)
+    return paginator
+
+# Sends the first page of a list, with buttons to move between the pages if there's more than one
+async def send_pages(interaction, paginator):
+  embed = paginator.get_embed(0)
+  if paginator.has_page(1):
+    await interaction.response.send_message(embed=embed, view=PageView(paginator))
+  else:
+    await interaction.response.send_message(embed=embed)
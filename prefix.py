@@ -0,0 +1,55 @@
+from bisect import bisect_left, insort
+
+# The most suggestions that Discord shows for an autocompleted option
+MAX_SUGGESTIONS = 25
+
+# The longest value that Discord accepts for a suggestion
+MAX_SUGGESTION_LENGTH = 100
+
+# A sorted list of names that can be searched by how they start, ignoring case
+# Adding or removing a name is a binary search and an insertion into the list, so the index is kept up to date as names change
+# instead of being rebuilt, and finding the names with a prefix is a binary search no matter how many names there are
+class PrefixIndex:
+  def __init__(self, names=()):
+    # Each name is stored after its case-folded form, which is what the list is sorted by
+    self.entries = sorted((name.casefold(), name) for name in set(names))
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, name):
+    entry = (name.casefold(), name)
+    i = bisect_left(self.entries, entry)
+    return i < len(self.entries) and self.entries[i] == entry
+
+  # Adds a name, unless it's already in the index
+  def add(self, name):
+    if name not in self:
+      insort(self.entries, (name.casefold(), name))
+
+  # Removes a name, if it's in the index
+  def remove(self, name):
+    entry = (name.casefold(), name)
+    i = bisect_left(self.entries, entry)
+    if i < len(self.entries) and self.entries[i] == entry:
+      del self.entries[i]
+
+  # Goes through the names that start with a prefix, ignoring case, in alphabetical order
+  def search(self, prefix):
+    key = prefix.casefold()
+    for i in range(bisect_left(self.entries, (key,)), len(self.entries)):
+      folded, name = self.entries[i]
+      if not folded.startswith(key):
+        return
+      yield name
+
+  # Gets the first names that start with a prefix and pass a check, as many as Discord can show
+  # Names that are too long to be suggested are left out
+  def suggest(self, prefix, check=None):
+    suggestions = []
+    for name in self.search(prefix):
+      if len(name) <= MAX_SUGGESTION_LENGTH and (check is None or check(name)):
+        suggestions.append(name)
+        if len(suggestions) == MAX_SUGGESTIONS:
+          break
+    return suggestions
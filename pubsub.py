@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+
+# Tells every process running the bot when a campaign changes, so they can drop their cached copies of it
+# Each change is a dictionary with the operation ("insert", "update" or "delete"), the campaign's id,
+# and, when they're known, the campaign's new version and name
+
+# The longest wait, in seconds, before watching the database again after its change stream fails
+MAX_RETRY_INTERVAL = 60
+
+# Passes changes between the subscribers in this process
+# Used when the bot only runs in one process, and to stand in for the database's change stream when testing
+class LocalPubSub:
+  def __init__(self):
+    self.subscribers = []
+
+  # Calls a function with every change that's published from now on
+  def subscribe(self, callback):
+    self.subscribers.append(callback)
+
+  # Sends a change to every subscriber, after whatever is running now has finished
+  def publish(self, change):
+    loop = asyncio.get_running_loop()
+    for callback in self.subscribers:
+      loop.call_soon(callback, change)
+
+  async def start(self):
+    pass
+
+# Watches the campaigns collection with a change stream, so changes made by any process reach every process
+# The database has to be a replica set (or a sharded cluster) for change streams to work
+class ChangeStreamPubSub:
+  def __init__(self, get_collection):
+    # The collection is looked up when watching starts, so it can be swapped out before then
+    self.get_collection = get_collection
+    self.subscribers = []
+
+  def subscribe(self, callback):
+    self.subscribers.append(callback)
+
+  # Every change already reaches the database's change stream, so there's nothing else to send
+  def publish(self, change):
+    pass
+
+  # Starts watching the database on its own thread, since pymongo's change streams are blocking
+  async def start(self):
+    loop = asyncio.get_running_loop()
+    threading.Thread(target=self.watch, args=(loop,), name="change-stream", daemon=True).start()
+
+  def notify(self, change):
+    for callback in self.subscribers:
+      callback(change)
+
+  # Passes every change in the stream to the event loop, picking up where it left off if the stream fails
+  def watch(self, loop):
+    resume_token = None
+    interval = 1
+    while True:
+      try:
+        with self.get_collection().watch(resume_after=resume_token) as stream:
+          interval = 1
+          for event in stream:
+            resume_token = stream.resume_token
+            change = get_change(event)
+            if change:
+              loop.call_soon_threadsafe(self.notify, change)
+      except Exception as e:
+        print(f"The campaigns' change stream failed, watching again in {interval}s: {e}")
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+# Turns an event from a change stream into a change, or None if it isn't a change to a campaign
+def get_change(event):
+  match event["operationType"]:
+    case "insert" | "replace":
+      document = event["fullDocument"]
+      return { "op": "insert" if event["operationType"] == "insert" else "update", "campaign_id": document["_id"], "version": document.get("version"), "name": document.get("name") }
+    case "update":
+      fields = event["updateDescription"]["updatedFields"]
+      return { "op": "update", "campaign_id": event["documentKey"]["_id"], "version": fields.get("version"), "name": fields.get("name") }
+    case "delete":
+      return { "op": "delete", "campaign_id": event["documentKey"]["_id"] }
+  return None
+
+# The ways that changes can be passed between processes
+PUBSUBS = [ "local", "changestream" ]
+
+# Makes the pub/sub with the given name
+def create(name, get_collection):
+  if name == "changestream":
+    return ChangeStreamPubSub(get_collection)
+  return LocalPubSub()
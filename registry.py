@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import database
+import os
+from prefix import PrefixIndex
+import schema
+
+# The most campaigns that are kept in memory at once
+CACHE_SIZE = int(os.getenv("CAMPAIGN_CACHE_SIZE", 1000))
+
+# Loads campaigns from the database when they're first needed and keeps the most recently used ones in memory
+# The cached campaigns are indexed by name, along with an index of each campaign's players,
+# so every lookup is a dictionary access instead of a search through a list
+class CampaignRegistry:
+  def __init__(self, size=CACHE_SIZE):
+    self.size = size
+    # Maps each cached campaign's id to the campaign, with the least recently used campaign first
+    self.campaigns = OrderedDict()
+    # Maps each cached campaign's name to its id
+    self.names = {}
+    # Maps each cached campaign's id to a dictionary of its players' names and their positions in the campaign
+    self.players = {}
+    # Goes up every time any campaign changes, and maps each cached campaign's id to the value it had when the campaign last changed
+    # A campaign that's loaded again gets a new version, so nothing rendered from an older copy of it is reused
+    self.version = 0
+    self.versions = {}
+    # The names of every campaign, including the ones that aren't cached, for autocompleting them
+    self.name_index = PrefixIndex()
+    # Maps each cached campaign's id to the names of its items and players, for autocompleting them
+    self.item_indexes = {}
+    self.player_indexes = {}
+    # Maps each player (as the campaign's id and the player's name) to the names of the items in their inventory
+    # These are only made when a player's inventory is first autocompleted
+    self.inventory_indexes = {}
+
+  def __len__(self):
+    return len(self.campaigns)
+
+  # Adds a campaign to the cache, removing the least recently used campaigns if the cache is full
+  # Changes are written straight to the database, so removed campaigns can simply be loaded again later
+  def add(self, campaign):
+    if campaign["_id"] in self.campaigns:
+      return self.use(campaign["_id"])
+    self.campaigns[campaign["_id"]] = campaign
+    self.names[campaign["name"]] = campaign["_id"]
+    self.name_index.add(campaign["name"])
+    self.index_players(campaign)
+    self.item_indexes[campaign["_id"]] = PrefixIndex(campaign["items"])
+    self.bump(campaign)
+    while len(self.campaigns) > self.size:
+      self.forget(next(iter(self.campaigns.values())))
+    return campaign
+
+  # Gets a cached campaign by its id and marks it as the most recently used
+  def use(self, id):
+    self.campaigns.move_to_end(id)
+    return self.campaigns[id]
+
+  # Gets the campaign with the given name, loading it from the database if it isn't cached
+  # Returns None if there isn't one
+  async def get(self, name):
+    if name in self.names:
+      return self.use(self.names[name])
+    campaign = await database.find_item({ "name": name })
+    # Another command could have loaded the campaign while this one was waiting for the database
+    return self.add(campaign) if campaign else None
+
+  # Gets the campaign with the given id, loading it from the database if it isn't cached
+  # Returns None if there isn't one
+  async def get_by_id(self, id):
+    if id in self.campaigns:
+      return self.use(id)
+    campaign = await database.find_item({ "_id": id })
+    return self.add(campaign) if campaign else None
+
+  # Removes a campaign from the cache without removing it from the database
+  # Another cached campaign can have the same name (from an import, for example), so the name is only removed if it's this campaign's
+  def forget(self, campaign):
+    del self.campaigns[campaign["_id"]]
+    if self.names.get(campaign["name"]) == campaign["_id"]:
+      del self.names[campaign["name"]]
+    del self.players[campaign["_id"]]
+    del self.versions[campaign["_id"]]
+    del self.item_indexes[campaign["_id"]]
+    del self.player_indexes[campaign["_id"]]
+    for player in campaign["players"]:
+      self.inventory_indexes.pop((campaign["_id"], player["name"]), None)
+
+  # Checks if a copy of a campaign is the one that's cached
+  # A command that waited (for the database or for another command) can be left holding a copy that was dropped in the meantime,
+  # because another process changed the campaign or because the cache was full
+  def is_cached(self, campaign):
+    return self.campaigns.get(campaign["_id"]) is campaign
+
+  # Removes a campaign from the cache if that copy of it is still cached, so it's loaded again the next time it's needed
+  def discard(self, campaign):
+    if self.is_cached(campaign):
+      self.forget(campaign)
+      self.version += 1
+
+  # Removes a campaign from the registry
+  def remove(self, campaign):
+    if campaign["_id"] in self.campaigns:
+      self.forget(campaign)
+    self.name_index.remove(campaign["name"])
+    self.version += 1
+
+  # Gives a campaign a new version after it changes
+  # A copy that's no longer cached doesn't get one, so it can't leave a version behind for a campaign that isn't cached
+  def bump(self, campaign):
+    self.version += 1
+    if self.is_cached(campaign):
+      self.versions[campaign["_id"]] = self.version
+
+  # Gets the current version of a cached campaign
+  def get_version(self, campaign):
+    return self.versions[campaign["_id"]]
+
+  # Changes the name of a campaign and moves it to its new name in the index
+  def rename(self, campaign, name):
+    if self.names.get(campaign["name"]) == campaign["_id"]:
+      del self.names[campaign["name"]]
+    self.name_index.remove(campaign["name"])
+    campaign["name"] = name
+    self.names[name] = campaign["_id"]
+    self.name_index.add(name)
+
+  # Updates the registry after a campaign is changed, either by this process or another one running the bot
+  # A cached campaign that's older than the change is forgotten, so it's loaded again the next time it's needed
+  # Changes that this process made itself already match the cached campaign, so it's kept
+  # Changes from the database's change stream only have the campaign's name when it changed, so the name index
+  # is only changed when a campaign is deleted or renamed, rather than losing the names of campaigns that were just updated
+  def apply_change(self, change):
+    campaign = self.campaigns.get(change["campaign_id"])
+    match change["op"]:
+      case "insert" | "update":
+        if campaign is not None and (change.get("version") is None or campaign.get(schema.VERSION_FIELD, 0) < change["version"]):
+          if change.get("name") and change["name"] != campaign["name"]:
+            self.name_index.remove(campaign["name"])
+          self.forget(campaign)
+          self.version += 1
+        if change.get("name"):
+          self.name_index.add(change["name"])
+      case "delete":
+        if campaign is not None:
+          self.remove(campaign)
+        elif change.get("name"):
+          self.name_index.remove(change["name"])
+
+  # Loads the names of every campaign, so they can be autocompleted before the campaigns themselves are loaded
+  async def load_names(self):
+    self.name_index = PrefixIndex(await database.get_names())
+
+  # Rebuilds the index of a campaign's players from its list of players
+  def index_players(self, campaign):
+    self.players[campaign["_id"]] = { player["name"]: i for i, player in enumerate(campaign["players"]) }
+    self.player_indexes[campaign["_id"]] = PrefixIndex(self.players[campaign["_id"]])
+
+  # Gets the position of a player in a campaign's list of players, or None if they aren't a player
+  def get_player_index(self, campaign, username):
+    return self.players[campaign["_id"]].get(username)
+
+  # Gets the player with the given name in a campaign, or None if they aren't a player
+  def get_player(self, campaign, username):
+    index = self.get_player_index(campaign, username)
+    if index is None:
+      return None
+    return campaign["players"][index]
+
+  # Adds a player to the end of a campaign's list of players
+  def add_player(self, campaign, player):
+    self.players[campaign["_id"]][player["name"]] = len(campaign["players"])
+    campaign["players"].append(player)
+    self.player_indexes[campaign["_id"]].add(player["name"])
+
+  # Removes a player from a campaign
+  # The players after them move up one position, so their positions are updated too
+  def remove_player(self, campaign, username):
+    players = self.players[campaign["_id"]]
+    index = players.pop(username)
+    del campaign["players"][index]
+    for player in campaign["players"][index:]:
+      players[player["name"]] -= 1
+    self.player_indexes[campaign["_id"]].remove(username)
+    self.inventory_indexes.pop((campaign["_id"], username), None)
+
+  # Adds an item to a campaign
+  def add_item(self, campaign, name, item):
+    campaign["items"][name] = item
+    self.item_indexes[campaign["_id"]].add(name)
+
+  # Puts an item in a player's inventory, or replaces it if the player already has it
+  def add_inventory_item(self, campaign, username, name, inventory_item):
+    self.get_player(campaign, username)["inventory"][name] = inventory_item
+    index = self.inventory_indexes.get((campaign["_id"], username))
+    if index is not None:
+      index.add(name)
+
+  # Removes an item from a player's inventory
+  def remove_inventory_item(self, campaign, username, name):
+    del self.get_player(campaign, username)["inventory"][name]
+    index = self.inventory_indexes.get((campaign["_id"], username))
+    if index is not None:
+      index.remove(name)
+
+  # Gets the names of a campaign's items or players, or of the items in a player's inventory, as a prefix index
+  def get_item_names(self, campaign):
+    return self.item_indexes[campaign["_id"]]
+
+  def get_player_names(self, campaign):
+    return self.player_indexes[campaign["_id"]]
+
+  def get_inventory_names(self, campaign, username):
+    key = (campaign["_id"], username)
+    if key not in self.inventory_indexes:
+      self.inventory_indexes[key] = PrefixIndex(self.get_player(campaign, username)["inventory"])
+    return self.inventory_indexes[key]
@@ -0,0 +1,132 @@
+# How campaigns are laid out in the database
+# EMBEDDED keeps each campaign in a single document, with its players (and their inventories) and items inside it
+# NORMALIZED keeps only the campaign's name and dungeon master in its document, with each player and item in its own document,
+# so large campaigns don't grow towards the document size limit and changing a player only rewrites that player
+EMBEDDED = "embedded"
+NORMALIZED = "normalized"
+SCHEMAS = [ EMBEDDED, NORMALIZED ]
+
+# The collections that the campaigns are kept in
+CAMPAIGNS = "Campaigns"
+PLAYERS = "Players"
+ITEMS = "Items"
+
+# The fields of the normalized documents that are only used to store them, and aren't part of the campaign itself
+STORAGE_FIELDS = { "_id", "campaign_id", "name", "journal_seq" }
+
+# The field of each campaign that goes up by one every time the campaign changes
+# A change can require the campaign to still have the version it had when it was loaded,
+# so a process with an old copy of the campaign can't overwrite changes that were made by another process
+VERSION_FIELD = "version"
+
+# Each write to the database is a dictionary with the collection it goes to, the operation ("insert", "update", "upsert", "delete" or "delete_many"),
+# the filter that finds the documents it changes, and either the document to insert or the changes to make
+# A write that has "check" set has to match a document, or the campaign was changed by someone else and nothing else is written
+def write(collection, op, filter, **fields):
+  return { "collection": collection, "op": op, "filter": filter, **fields }
+
+# Gets the write that changes a campaign's own document and gives it its next version
+# If a version is given, the write only happens if the campaign still has that version
+# Campaigns that were saved before they had versions count as having version 0
+def get_campaign_write(id, changes, version):
+  changes = { **changes, "$inc": { **changes.get("$inc", {}), VERSION_FIELD: 1 } }
+  if version is None:
+    return write(CAMPAIGNS, "update", { "_id": id }, changes=changes)
+  return write(CAMPAIGNS, "update", { "_id": id, VERSION_FIELD: version or { "$in": [ None, 0 ] } }, changes=changes, check=True)
+
+# Gets the campaign's own fields, without the ones that are only changed by the database
+def get_campaign_fields(document):
+  return { key: value for key, value in document.items() if key not in ("_id", VERSION_FIELD) }
+
+# Gets the filter that finds a player's or item's document
+def get_member_filter(campaign_id, name):
+  return { "campaign_id": campaign_id, "name": name }
+
+# Splits a campaign into its own document and the documents of its players and items
+def split_campaign(campaign):
+  document = { key: value for key, value in campaign.items() if key not in ("players", "items") }
+  players = [ { **get_member_filter(campaign["_id"], player["name"]), "inventory": player["inventory"] } for player in campaign["players"] ]
+  items = [ { **get_member_filter(campaign["_id"], name), **item } for name, item in campaign["items"].items() ]
+  return document, players, items
+
+# Puts a campaign back together from its own document and the documents of its players and items
+# The players are given in the order they were added in
+def join_campaign(document, players, items):
+  campaign = { key: value for key, value in document.items() if key not in ("players", "items") }
+  campaign["players"] = [ { "name": player["name"], "inventory": player.get("inventory", {}) } for player in players ]
+  campaign["items"] = { item["name"]: { key: value for key, value in item.items() if key not in STORAGE_FIELDS } for item in items }
+  return campaign
+
+# Gets the writes that insert a whole campaign
+def get_insert_writes(campaign, schema):
+  if schema == EMBEDDED:
+    return [ write(CAMPAIGNS, "insert", { "_id": campaign["_id"] }, document=campaign) ]
+  document, players, items = split_campaign(campaign)
+  writes = [ write(CAMPAIGNS, "insert", { "_id": campaign["_id"] }, document=document) ]
+  writes += [ write(PLAYERS, "insert", get_member_filter(campaign["_id"], player["name"]), document=player) for player in players ]
+  writes += [ write(ITEMS, "insert", get_member_filter(campaign["_id"], item["name"]), document=item) for item in items ]
+  return writes
+
+# Gets the writes that remove a whole campaign
+def get_remove_writes(campaign, schema):
+  writes = [ write(CAMPAIGNS, "delete", { "_id": campaign["_id"] }) ]
+  if schema == NORMALIZED:
+    writes.append(write(PLAYERS, "delete_many", { "campaign_id": campaign["_id"] }))
+    writes.append(write(ITEMS, "delete_many", { "campaign_id": campaign["_id"] }))
+  return writes
+
+# Gets the writes that make a change to a campaign, such as { "$inc": { "players.2.inventory.Arrow.amount": -1 } }
+# Players are found by their position in the campaign's list of players, so the campaign has to already include the change
+# Without any changes, the whole campaign is written again
+# The write to the campaign's own document always comes first, and if a version is given, it checks that the campaign still has it
+def get_update_writes(campaign, changes, schema, version=None):
+  id = campaign["_id"]
+  if schema == EMBEDDED:
+    return [ get_campaign_write(id, changes if changes is not None else { "$set": get_campaign_fields(campaign) }, version) ]
+  if changes is None:
+    document, players, items = split_campaign(campaign)
+    writes = [ get_campaign_write(id, { "$set": get_campaign_fields(document) }, version) ]
+    writes += [ write(PLAYERS, "delete_many", { "campaign_id": id }), write(ITEMS, "delete_many", { "campaign_id": id }) ]
+    writes += [ write(PLAYERS, "insert", get_member_filter(id, player["name"]), document=player) for player in players ]
+    writes += [ write(ITEMS, "insert", get_member_filter(id, item["name"]), document=item) for item in items ]
+    return writes
+  campaign_changes = {}
+  writes = []
+  # The changes to each player are grouped together, in the order the players were first changed
+  grouped = {}
+  def add_change(collection, filter, operator, path, value):
+    key = (collection, tuple(filter.items()))
+    if key not in grouped:
+      grouped[key] = write(collection, "update", filter, changes={})
+      writes.append(grouped[key])
+    grouped[key]["changes"].setdefault(operator, {})[path] = value
+  for operator, fields in changes.items():
+    for path, value in fields.items():
+      # Players are added and removed as whole documents
+      if path == "players":
+        if operator == "$push":
+          writes.append(write(PLAYERS, "insert", get_member_filter(id, value["name"]), document={ **get_member_filter(id, value["name"]), "inventory": value["inventory"] }))
+        elif operator == "$pull":
+          writes.append(write(PLAYERS, "delete", get_member_filter(id, value["name"])))
+        else:
+          raise ValueError(f"{operator} can't be used on a campaign's players")
+        continue
+      parts = path.split(".", 2)
+      # A player's fields, such as "players.2.inventory.Arrow"
+      if parts[0] == "players" and len(parts) == 3:
+        name = campaign["players"][int(parts[1])]["name"]
+        add_change(PLAYERS, get_member_filter(id, name), operator, parts[2], value)
+      # A whole item, such as "items.Sword", which is the only way items are changed
+      elif parts[0] == "items" and len(parts) == 2:
+        if operator == "$set":
+          writes.append(write(ITEMS, "upsert", get_member_filter(id, parts[1]), changes={ "$set": value }))
+        elif operator == "$unset":
+          writes.append(write(ITEMS, "delete", get_member_filter(id, parts[1])))
+        else:
+          raise ValueError(f"{operator} can't be used on a whole item")
+      elif parts[0] in ("players", "items"):
+        raise ValueError(f"{path} can't be changed in the {NORMALIZED} schema")
+      # The campaign's own fields, such as its name
+      else:
+        campaign_changes.setdefault(operator, {})[path] = value
+  return [ get_campaign_write(id, campaign_changes, version) ] + writes
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import time
+
+# How many seconds a session can go unused before it's closed
+IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 6 * 60 * 60))
+
+# Keeps track of which campaign is active at each table, and in which mode
+# A table is a channel in a server (or a direct message channel), so many tables can run campaigns at the same time
+class SessionManager:
+  def __init__(self, idle_timeout=IDLE_TIMEOUT):
+    self.idle_timeout = idle_timeout
+    # Maps each table to its session, with the least recently used session first
+    self.sessions = OrderedDict()
+    # Maps each campaign's id to the lock that its changes have to be made under
+    self.locks = {}
+    # Maps each name that a campaign is being created with or renamed to, to the lock that checking and taking the name happen under
+    # and how many commands are using or waiting for it
+    self.name_locks = {}
+
+  def __len__(self):
+    return len(self.sessions)
+
+  # Gets the table that an interaction was sent from
+  def get_key(self, interaction):
+    return (interaction.guild_id, interaction.channel_id)
+
+  # Gets the session of the table an interaction was sent from, or None if the table has no session
+  def get(self, interaction):
+    self.evict_idle()
+    key = self.get_key(interaction)
+    session = self.sessions.get(key)
+    if session:
+      session["last_used"] = time.monotonic()
+      self.sessions.move_to_end(key)
+    return session
+
+  # Starts a session for the table an interaction was sent from, replacing the table's previous session
+  def start(self, interaction, campaign, mode):
+    key = self.get_key(interaction)
+    self.sessions[key] = {
+      "campaign_id": campaign["_id"],
+      "mode": mode,
+      "last_used": time.monotonic()
+    }
+    self.sessions.move_to_end(key)
+
+  # Ends the session of the table an interaction was sent from
+  def end(self, interaction):
+    self.sessions.pop(self.get_key(interaction), None)
+
+  # Ends every session playing a campaign and forgets the campaign's lock, used when the campaign is deleted
+  def end_campaign(self, campaign):
+    for key in [key for key, session in self.sessions.items() if session["campaign_id"] == campaign["_id"]]:
+      del self.sessions[key]
+    self.locks.pop(campaign["_id"], None)
+
+  # Closes the sessions that haven't been used for longer than the idle timeout
+  # Sessions are kept in order of use, so only the stale ones at the front have to be checked
+  def evict_idle(self):
+    cutoff = time.monotonic() - self.idle_timeout
+    while self.sessions:
+      key, session = next(iter(self.sessions.items()))
+      if session["last_used"] > cutoff:
+        break
+      del self.sessions[key]
+
+  # Gets the lock of a campaign, so that two commands can't change the same campaign at the same time
+  def lock(self, campaign):
+    if campaign["_id"] not in self.locks:
+      self.locks[campaign["_id"]] = asyncio.Lock()
+    return self.locks[campaign["_id"]]
+
+  # Gets the lock of a campaign name, so that two commands can't both find that the name is free and then both take it
+  # The lock is dropped once nothing is waiting for it, since names are only taken once
+  @asynccontextmanager
+  async def name_lock(self, name):
+    lock, users = self.name_locks.get(name, (asyncio.Lock(), 0))
+    self.name_locks[name] = (lock, users + 1)
+    try:
+      async with lock:
+        yield
+    finally:
+      lock, users = self.name_locks[name]
+      if users == 1:
+        del self.name_locks[name]
+      else:
+        self.name_locks[name] = (lock, users - 1)
@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import time
+
+# This module is imported before anything else, so loading the bot's other modules is timed too
+START_TIME = time.perf_counter()
+
+# Where the hash of the last synced commands is kept between runs
+COMMAND_HASH_FILE = os.getenv("COMMAND_HASH_FILE", ".command_hash")
+
+# How long each phase of starting up took, in seconds, in the order the phases finished
+startup_times = {}
+last_mark = START_TIME
+
+# Records that a phase of starting up just finished, timing it from the end of the phase before it
+def mark_phase(phase):
+  global last_mark
+  now = time.perf_counter()
+  startup_times[phase] = now - last_mark
+  last_mark = now
+
+# Checks if the bot has finished starting up
+def is_ready():
+  return "ready" in startup_times
+
+# Describes how long each phase of starting up took and how long it took to be ready
+def report():
+  phases = ", ".join(f"{phase}: {seconds:.2f}s" for phase, seconds in startup_times.items())
+  return f"Ready after {last_mark - START_TIME:.2f}s ({phases})"
+
+# Gets a hash of the definitions of a command tree's commands
+# It changes whenever a command (or one of its options) is added, removed or changed
+def get_command_hash(tree):
+  definitions = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda definition: definition["name"])
+  return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode()).hexdigest()
+
+# Syncs a command tree's commands with Discord, unless they haven't changed since they were last synced
+# Returns the number of synced commands, or None if the sync was skipped
+async def sync_commands(tree):
+  command_hash = get_command_hash(tree)
+  if os.path.exists(COMMAND_HASH_FILE):
+    with open(COMMAND_HASH_FILE) as file:
+      if file.read().strip() == command_hash:
+        return None
+  synced_commands = await tree.sync()
+  with open(COMMAND_HASH_FILE, "w") as file:
+    file.write(command_hash)
+  return len(synced_commands)
@@ -0,0 +1,30 @@
+# Every test runs offline, against a fresh in-memory mongomock database and a fresh copy of the bot's state
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import bot
+import database
+from helpers import use_mongomock
+from pages import PageCache
+import pubsub
+from registry import CampaignRegistry
+import schema
+from sessions import SessionManager
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+  use_mongomock(monkeypatch.setattr)
+  monkeypatch.setattr(database, "campaign_changes", pubsub.LocalPubSub())
+  monkeypatch.setattr(bot, "campaigns", CampaignRegistry())
+  monkeypatch.setattr(bot, "sessions", SessionManager())
+  monkeypatch.setattr(bot, "rendered_pages", PageCache())
+  monkeypatch.setattr(bot, "player_crits", {})
+
+# Runs a test with each layout of the database
+@pytest.fixture(params=schema.SCHEMAS)
+def layout(request, monkeypatch):
+  monkeypatch.setattr(database, "SCHEMA", request.param)
+  return request.param
@@ -0,0 +1,110 @@
+# Fakes that stand in for Discord and the database, shared by the tests and the benchmarks
+from bisect import bisect_left
+import bot
+import database
+import mongomock
+
+# mongomock's cursor copies the rest of its results for every document it returns, so going through a large collection is quadratic
+# It's replaced with one that goes through the results without copying them, so the benchmarks measure the bot instead of mongomock
+def next_document(self):
+  results = self._compute_results()
+  index = (self._skip or 0) + self._emitted
+  if index >= len(results) or (self._limit and self._emitted >= abs(self._limit)):
+    raise StopIteration()
+  self._emitted += 1
+  return results[index]
+
+# mongomock's bulk_write doesn't work with recent versions of pymongo, so the operations are made one at a time instead
+def bulk_write(self, operations, ordered=True):
+  for operation in operations:
+    match type(operation).__name__:
+      case "InsertOne":
+        self.insert_one(operation._doc)
+      case "UpdateOne":
+        self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+      case "ReplaceOne":
+        self.replace_one(operation._filter, operation._doc, upsert=operation._upsert)
+      case "DeleteOne":
+        self.delete_one(operation._filter)
+      case "DeleteMany":
+        self.delete_many(operation._filter)
+
+# Swaps the database's collections for empty in-memory ones, and works around mongomock's bugs
+# set_attribute can be a test's monkeypatch.setattr, so that everything is put back once the test is over
+def use_mongomock(set_attribute=setattr):
+  set_attribute(mongomock.collection.Cursor, "__next__", next_document)
+  set_attribute(mongomock.collection.Collection, "bulk_write", bulk_write)
+  mock_database = mongomock.MongoClient()["Campaigns"]
+  set_attribute(database, "collection", mock_database["Campaigns"])
+  set_attribute(database, "players_collection", mock_database["Players"])
+  set_attribute(database, "items_collection", mock_database["Items"])
+
+# A fake Discord user or server member
+class FakeMember:
+  def __init__(self, name, id):
+    self.name = name
+    self.id = id
+
+# A fake server that answers member queries like Discord does, with up to a limit of the members whose names start with the query
+# Its members' names are kept sorted, standing in for Discord's own index of them
+class FakeGuild:
+  def __init__(self, id, member_names):
+    self.id = id
+    self.members = { name: FakeMember(name, i) for i, name in enumerate(member_names) }
+    self.sorted_names = sorted(name.lower() for name in self.members)
+    self.lowercase_names = { name.lower(): name for name in self.members }
+
+  async def query_members(self, query, limit=5, cache=True):
+    query = query.lower()
+    start = bisect_left(self.sorted_names, query)
+    # The names that start with the query are all next to each other in sorted order
+    names = [ name for name in self.sorted_names[start:start + limit] if name.startswith(query) ]
+    return [ self.members[self.lowercase_names[name]] for name in names ]
+
+# A fake response that records what would have been sent instead of sending it
+class FakeResponse:
+  def __init__(self):
+    self.messages = []
+
+  async def send_message(self, content=None, **kwargs):
+    self.messages.append(content if content is not None else kwargs)
+
+  async def edit_message(self, **kwargs):
+    self.messages.append(kwargs)
+
+  def is_done(self):
+    return len(self.messages) > 0
+
+# A fake interaction, as if a user called a command in a channel of a server
+class FakeInteraction:
+  def __init__(self, user, guild, channel_id):
+    self.user = user
+    self.guild = guild
+    self.guild_id = guild.id
+    self.channel_id = channel_id
+    self.response = FakeResponse()
+
+# The server that every test's commands are sent from
+guild = FakeGuild(1, [ "dm", "alice", "bob", "carol" ])
+
+# Makes an interaction, as if a user sent a command in a channel of the test server
+def interaction(user, channel=0):
+  return FakeInteraction(guild.members.get(user) or FakeMember(user, hash(user)), guild, channel)
+
+# Adds a campaign to the database, with players (and their inventories) and items
+async def add_campaign(name, dungeon_master="dm", players=None, items=None):
+  campaign = {
+    "name": name,
+    "dungeon_master": dungeon_master,
+    "players": [ { "name": player, "inventory": inventory } for player, inventory in (players or {}).items() ],
+    "items": items or {}
+  }
+  return await database.add_item(campaign)
+
+# Starts a campaign in a mode ("manage" or "play") in a channel, as its dungeon master
+async def start(name, mode, channel=0, dungeon_master="dm"):
+  await bot.campaign.callback(interaction(dungeon_master, channel), mode, name)
+
+# Gets the campaign as it is in the database
+async def load(name):
+  return await database.find_item({ "name": name })
@@ -0,0 +1,63 @@
+# Checks that /givemany and /takemany change nothing at all when any player or item in them has a problem
+import asyncio
+import bot
+import copy
+import database
+from helpers import add_campaign, interaction, load, start
+import pytest
+
+ITEMS = { "Arrow": { "type": "Resource" }, "Sword": { "type": "Melee weapon", "hit": "1d20", "damage": "1d8" } }
+
+PLAYERS = {
+  "alice": { "Arrow": { "item_ref": "Arrow", "amount": 10 }, "Sword": { "item_ref": "Sword", "amount": 1 } },
+  "bob": { "Arrow": { "item_ref": "Arrow", "amount": 3 } }
+}
+
+# Gets every player's inventory
+def get_inventories(campaign):
+  return { player["name"]: player["inventory"] for player in campaign["players"] }
+
+@pytest.mark.parametrize("taking, usernames, items, problems", [
+  (False, "alice, zed", "Arrow:2", [ "`zed` isn't a player in `Dragon`." ]),
+  (False, "alice, bob", "Arrow, Shield:2", [ bot.ITEM_NOT_FOUND("Dragon", "Shield") ]),
+  (True, "alice, zed", "Arrow", [ "`zed` isn't a player in `Dragon`." ]),
+  (True, "alice, bob", "Arrow:5", [ "`bob` only has 3 `Arrow`, so 5 can't be taken." ]),
+  (True, "alice, bob", "Arrow:11, Sword", [
+    "`alice` only has 10 `Arrow`, so 11 can't be taken.",
+    "`bob` only has 3 `Arrow`, so 11 can't be taken.",
+    "`bob` only has 0 `Sword`, so 1 can't be taken."
+  ]),
+  (False, "zed, alice", "Shield, Arrow", [ bot.ITEM_NOT_FOUND("Dragon", "Shield"), "`zed` isn't a player in `Dragon`." ])
+])
+def test_nothing_changes_when_anything_fails(layout, monkeypatch, taking, usernames, items, problems):
+  async def scenario():
+    saved = []
+    async def update_item(item, changes=None):
+      saved.append(changes)
+    monkeypatch.setattr(database, "update_item", update_item)
+    await add_campaign("Dragon", players=copy.deepcopy(PLAYERS), items=ITEMS)
+    await start("Dragon", "play")
+    command = interaction("dm")
+    await (bot.take_many if taking else bot.give_many).callback(command, usernames, items)
+    problem_lines = "".join(f"\n> {problem}" for problem in problems)
+    assert command.response.messages == [ f"Nothing was {'taken' if taking else 'given'}, because:{problem_lines}" ]
+    assert saved == []
+    assert get_inventories(await bot.campaigns.get("Dragon")) == PLAYERS
+    assert get_inventories(await load("Dragon")) == PLAYERS
+  asyncio.run(scenario())
+
+# A long list of problems is cut short to fit in a message
+def test_many_problems_fit_in_a_message(layout):
+  async def scenario():
+    await add_campaign("Dragon", players=copy.deepcopy(PLAYERS), items=ITEMS)
+    await start("Dragon", "play")
+    command = interaction("dm")
+    usernames = ", ".join(f"{'stranger' * 10}{i}" for i in range(bot.MAX_BULK_NAMES))
+    items = ", ".join(f"{'missing' * 10}{i}" for i in range(bot.MAX_BULK_NAMES))
+    await bot.give_many.callback(command, usernames, items)
+    message = command.response.messages[0]
+    assert message.startswith("Nothing was given, because:")
+    assert len(message) <= bot.MESSAGE_LIMIT
+    assert message.endswith(" more")
+    assert get_inventories(await load("Dragon")) == PLAYERS
+  asyncio.run(scenario())
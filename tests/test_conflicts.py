@@ -0,0 +1,104 @@
+# Checks what happens when another process running the bot changes a campaign that this one has cached
+import asyncio
+import benchmark
+import bot
+import database
+from helpers import add_campaign, guild, interaction, load, start
+import pytest
+from registry import CampaignRegistry
+
+# Makes a registry with a cached campaign, and the name of another campaign that isn't cached
+def make_registry():
+  registry = CampaignRegistry()
+  campaign = registry.add({ "_id": 1, "name": "Dragon", "dungeon_master": "dm", "players": [], "items": {}, "version": 1 })
+  registry.name_index.add("Kraken")
+  return registry, campaign
+
+# An update from the change stream doesn't have the campaign's name unless it changed, and the name is kept for autocompleting
+def test_update_keeps_the_name():
+  registry, campaign = make_registry()
+  version = registry.version
+  registry.apply_change({ "op": "update", "campaign_id": 1, "version": 2, "name": None })
+  assert not registry.is_cached(campaign)
+  assert 1 not in registry.versions
+  assert registry.version > version
+  assert list(registry.name_index.search("")) == [ "Dragon", "Kraken" ]
+
+# A change this process made itself keeps the cached campaign
+def test_own_update_keeps_the_campaign():
+  registry, campaign = make_registry()
+  registry.apply_change({ "op": "update", "campaign_id": 1, "version": 1, "name": "Dragon" })
+  assert registry.is_cached(campaign)
+
+# A campaign renamed by another process is only autocompleted by its new name
+def test_rename_moves_the_name():
+  registry, campaign = make_registry()
+  registry.apply_change({ "op": "update", "campaign_id": 1, "version": 2, "name": "Wyrm" })
+  assert list(registry.name_index.search("")) == [ "Kraken", "Wyrm" ]
+
+# A deleted campaign isn't autocompleted any more, whether it was cached or not
+def test_delete_removes_the_name():
+  registry, campaign = make_registry()
+  registry.apply_change({ "op": "delete", "campaign_id": 1, "name": "Dragon" })
+  registry.apply_change({ "op": "delete", "campaign_id": 2, "name": "Kraken" })
+  assert list(registry.name_index.search("")) == []
+  assert len(registry) == 0
+
+# A copy of a campaign that's no longer cached doesn't leave a version behind when it's saved
+def test_bump_skips_dropped_copies():
+  registry, campaign = make_registry()
+  registry.forget(campaign)
+  registry.bump(campaign)
+  assert 1 not in registry.versions
+
+# Changes the campaign in the database and tells the bot, as if another process had changed it
+async def change_elsewhere(name):
+  campaign = await load(name)
+  database.collection.update_one({ "_id": campaign["_id"] }, { "$inc": { "version": 1 } })
+  bot.campaigns.apply_change({ "op": "update", "campaign_id": campaign["_id"], "version": campaign.get("version", 0) + 1, "name": None })
+
+# A player added while the campaign is changed by another process isn't added to the old copy
+def test_add_player_after_a_change_elsewhere(layout, monkeypatch):
+  async def scenario():
+    await add_campaign("Dragon")
+    await start("Dragon", "manage")
+    query_members = guild.query_members
+    async def query_and_change(query, limit=5, cache=True):
+      await change_elsewhere("Dragon")
+      return await query_members(query, limit=limit, cache=cache)
+    monkeypatch.setattr(guild, "query_members", query_and_change)
+    with pytest.raises(database.ConflictError):
+      await bot.add_player.callback(interaction("dm"), "alice")
+    assert (await load("Dragon"))["players"] == []
+    # Trying again works with the campaign as it is now
+    monkeypatch.setattr(guild, "query_members", query_members)
+    command = interaction("dm")
+    await bot.add_player.callback(command, "alice")
+    assert command.response.messages == [ "`alice` is now a player in `Dragon`." ]
+    assert [ player["name"] for player in (await load("Dragon"))["players"] ] == [ "alice" ]
+  asyncio.run(scenario())
+
+# Commands that were waiting for the campaign's lock when it was changed elsewhere don't change the old copy
+@pytest.mark.parametrize("command", [ "give", "givemany" ])
+def test_waiting_commands_after_a_change_elsewhere(layout, command):
+  async def scenario():
+    await add_campaign("Dragon", players={ "alice": {} }, items={ "Arrow": { "type": "Resource" } })
+    await start("Dragon", "play")
+    campaign = await bot.campaigns.get("Dragon")
+    async with bot.sessions.lock(campaign):
+      if command == "give":
+        waiting = asyncio.create_task(bot.give.callback(interaction("dm"), "alice", "Arrow", 5))
+      else:
+        waiting = asyncio.create_task(bot.give_many.callback(interaction("dm"), "alice", "Arrow:5"))
+      await asyncio.sleep(0)
+      await change_elsewhere("Dragon")
+    with pytest.raises(database.ConflictError):
+      await waiting
+    assert campaign["_id"] not in bot.campaigns.versions
+    assert (await load("Dragon"))["players"][0]["inventory"] == {}
+  asyncio.run(scenario())
+
+# Two copies of the bot, as if they were separate processes, give items to the same players at once without losing any
+def test_two_workers(layout, capsys):
+  assert asyncio.run(benchmark.run_workers(2, 3, 20))
+  assert "0 player/s had the wrong amount and 0 worker/s had an out of date campaign cached" in capsys.readouterr().out
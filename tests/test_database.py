@@ -0,0 +1,59 @@
+import asyncio
+import database
+import bot
+from helpers import add_campaign, interaction, load, start
+import pymongo
+import pytest
+import threading
+
+# A collection whose updates wait until they're released, like a database that's slow to answer
+class SlowCollection:
+  def __init__(self, collection):
+    self.collection = collection
+    self.started = threading.Event()
+    self.released = threading.Event()
+
+  def __getattr__(self, name):
+    return getattr(self.collection, name)
+
+  def update_one(self, *args, **kwargs):
+    self.started.set()
+    self.released.wait(5)
+    return self.collection.update_one(*args, **kwargs)
+
+def test_commands_are_answered_while_a_write_is_slow(layout, monkeypatch):
+  async def scenario():
+    await add_campaign("Dragon", players={ "alice": {} })
+    await start("Dragon", "manage", channel=1)
+    await start("Dragon", "play", channel=2)
+    slow_collection = SlowCollection(database.collection)
+    monkeypatch.setattr(database, "collection", slow_collection)
+    rename = asyncio.create_task(bot.change_name.callback(interaction("dm", 1), "Wyrm"))
+    # Wait until the rename is stuck writing to the database
+    assert await asyncio.get_running_loop().run_in_executor(None, slow_collection.started.wait, 5)
+    roll = interaction("dm", 2)
+    await asyncio.wait_for(bot.roll_custom.callback(roll, "1d20"), 1)
+    assert "Custom Roll:" in roll.response.messages[0]
+    assert not rename.done()
+    slow_collection.released.set()
+    await rename
+    assert (await load("Wyrm"))["name"] == "Wyrm"
+  asyncio.run(scenario())
+
+# A change that the database fails to save isn't kept in memory, so later changes aren't made on top of it
+def test_failed_write_drops_the_cached_campaign(layout, monkeypatch):
+  async def scenario():
+    await add_campaign("Dragon", players={ "alice": { "Arrow": { "item_ref": "Arrow", "amount": 1 } } }, items={ "Arrow": { "type": "Resource" } })
+    await start("Dragon", "play")
+    save_writes = database.save_writes
+    async def fail(writes):
+      raise pymongo.errors.AutoReconnect("The database went away")
+    monkeypatch.setattr(database, "save_writes", fail)
+    with pytest.raises(pymongo.errors.AutoReconnect):
+      await bot.give.callback(interaction("dm"), "alice", "Arrow", 5)
+    monkeypatch.setattr(database, "save_writes", save_writes)
+    await bot.give.callback(interaction("dm"), "alice", "Arrow", 10)
+    campaign = await bot.campaigns.get("Dragon")
+    assert campaign["players"][0]["inventory"]["Arrow"]["amount"] == 11
+    assert (await load("Dragon"))["players"][0]["inventory"]["Arrow"]["amount"] == 11
+  asyncio.run(scenario())
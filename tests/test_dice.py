@@ -0,0 +1,189 @@
+import asyncio
+import bot
+import dice
+from dice import DiceTerm
+from helpers import add_campaign, interaction, start
+import pytest
+
+# The chances of a roll are cached, so a test that changes the limits doesn't see another test's results
+@pytest.fixture(autouse=True)
+def clear_caches():
+  dice.distribution.cache_clear()
+  dice.get_stats.cache_clear()
+  yield
+  dice.distribution.cache_clear()
+  dice.get_stats.cache_clear()
+
+# Rolls are split into their groups of dice and the number added to them
+@pytest.mark.parametrize("roll, terms, modifier", [
+  ("2d6 + 1d4 - 1", [ DiceTerm(1, 2, 6, False, None, False), DiceTerm(1, 1, 4, False, None, False) ], -1),
+  ("d20 - 1d4 + 3 - 5", [ DiceTerm(1, 1, 20, False, None, False), DiceTerm(-1, 1, 4, False, None, False) ], -2),
+  ("-1d6", [ DiceTerm(-1, 1, 6, False, None, False) ], 0),
+  ("2D20KH1", [ DiceTerm(1, 2, 20, False, 1, True) ], 0),
+  ("4d6kh3", [ DiceTerm(1, 4, 6, False, 3, True) ], 0),
+  ("2d20kl1 + 2", [ DiceTerm(1, 2, 20, False, 1, False) ], 2),
+  ("3d6!", [ DiceTerm(1, 3, 6, True, None, False) ], 0),
+  ("4d6!kh3", [ DiceTerm(1, 4, 6, True, 3, True) ], 0)
+])
+def test_compile_roll(roll, terms, modifier):
+  compiled = dice.compile_roll(roll)
+  assert list(compiled.terms) == terms
+  assert compiled.modifier == modifier
+
+@pytest.mark.parametrize("roll", [ "", "abc", "5", "d7", "2d3", "0d6", "2d6kh0", "2d6kh3", "2d6kx1", "1d6+", "1d6++1", "1d6!!", "101d6", "60d6 + 41d4" ])
+def test_invalid_rolls(roll):
+  with pytest.raises(ValueError):
+    dice.compile_roll(roll)
+
+# Rolls saved on weapons can roll more dice than MAX_DICE
+def test_stored_rolls_can_roll_more_dice():
+  assert dice.count_dice(dice.compile_roll("200d6", dice.MAX_STORED_DICE)) == 200
+  with pytest.raises(ValueError):
+    dice.compile_roll(f"{dice.MAX_STORED_DICE + 1}d6", dice.MAX_STORED_DICE)
+
+# Gives back the values in order each time a die is rolled
+def roll_values(monkeypatch, values):
+  values = iter(values)
+  monkeypatch.setattr(dice, "randint", lambda low, high: next(values))
+
+# Every die is rolled on its own, rather than one die being multiplied by the number of dice
+def test_each_die_is_rolled(monkeypatch):
+  roll_values(monkeypatch, [ 1, 6, 3, 2 ])
+  result = dice.roll(dice.compile_roll("3d6 - 1d4 + 2"))
+  assert result["total"] == 1 + 6 + 3 - 2 + 2
+  assert dice.describe(result) == "[1, 6, 3] - [2] + 2"
+
+# Only the highest or lowest dice are kept, and the others are crossed out
+def test_kept_dice(monkeypatch):
+  roll_values(monkeypatch, [ 3, 5, 1, 6, 20, 4 ])
+  result = dice.roll(dice.compile_roll("4d6kh3 + 2d20kl1"))
+  assert result["total"] == 5 + 3 + 6 + 4
+  assert dice.describe(result) == "[3, 5, ~1~, 6] + [~20~, 4]"
+  assert not dice.is_natural_20(result)
+
+# An exploding die is rolled again each time it lands on its highest side, and the rolls are added together
+def test_exploding_dice(monkeypatch):
+  roll_values(monkeypatch, [ 6, 6, 2, 5 ])
+  result = dice.roll(dice.compile_roll("2d6!"))
+  assert result["total"] == 6 + 6 + 2 + 5
+  assert dice.describe(result) == "[14, 5]"
+
+# An exploding die stops after MAX_EXPLOSIONS explosions
+def test_explosions_end(monkeypatch):
+  monkeypatch.setattr(dice, "randint", lambda low, high: high)
+  assert dice.roll(dice.compile_roll("1d4!"))["total"] == 4 * (dice.MAX_EXPLOSIONS + 1)
+
+# Rolling many times at once keeps the same dice, and counts the natural 20s
+def test_roll_many(monkeypatch):
+  monkeypatch.setattr(dice, "choices", lambda faces, k: [ faces[-1] if i % 2 == 0 else faces[0] for i in range(k) ])
+  results = dice.roll_many(dice.compile_roll("2d20kh1 - 1d4 + 1"), 3)
+  assert results["totals"] == [ 20 - 4 + 1, 20 - 1 + 1, 20 - 4 + 1 ]
+  assert results["natural_20s"] == [ True, True, True ]
+
+# Small rolls are worked out exactly
+def test_small_rolls_are_exact():
+  stats = dice.get_stats(dice.compile_roll("2d6"), 7)
+  assert stats["samples"] is None
+  assert stats["mean"] == pytest.approx(7)
+  assert stats["percentiles"][50] == 7
+  assert stats["target_chance"] == pytest.approx(21 / 36)
+  stats = dice.get_stats(dice.compile_roll("2d20kh1"))
+  assert stats["mean"] == pytest.approx(13.825)
+  stats = dice.get_stats(dice.compile_roll("1d6!"))
+  assert stats["mean"] == pytest.approx(4.2)
+
+# Rolls that would take too many steps to work out exactly are estimated, instead of working on them for minutes
+@pytest.mark.parametrize("roll", [ "50d100kh25", "30d100!", "100d6kh50" ])
+def test_big_rolls_are_estimated(roll, monkeypatch):
+  monkeypatch.setattr(dice, "MAX_EXACT_STEPS", 100000)
+  monkeypatch.setattr(dice, "SAMPLE_DICE", 20000)
+  compiled = dice.compile_roll(roll)
+  with pytest.raises(dice.TooComplexError):
+    dice.distribution(compiled)
+  stats = dice.get_stats(compiled, 1)
+  assert stats["samples"] == 20000 // dice.count_dice(compiled)
+  assert stats["target_chance"] == pytest.approx(1)
+  assert list(stats["percentiles"]) == [ 10, 25, 50, 75, 90 ]
+
+# /rollstats says when the odds are estimated
+def test_roll_stats_says_when_odds_are_estimated(monkeypatch):
+  monkeypatch.setattr(dice, "MAX_EXACT_STEPS", 100000)
+  monkeypatch.setattr(dice, "SAMPLE_DICE", 20000)
+  command = interaction("alice")
+  asyncio.run(bot.roll_stats.callback(command, "50d100kh25", None))
+  assert command.response.messages[0].startswith("Odds for `50d100kh25`:")
+  assert "estimated from 400 rolls" in command.response.messages[0]
+
+# A weapon saved with a roll that isn't valid anymore gets a message instead of an error
+def test_weapon_stats_with_an_invalid_roll(layout):
+  async def scenario():
+    items = { "Cannon": { "type": "Melee weapon", "hit": "1d20", "damage": "2d7" } }
+    await add_campaign("Dragon", players={ "alice": { "Cannon": { "item_ref": "Cannon", "amount": 1 } } }, items=items)
+    await start("Dragon", "play")
+    command = interaction("alice")
+    await bot.weapon_stats.callback(command, "Cannon", None)
+    assert command.response.messages == [ bot.INVALID_ROLL("2d7") ]
+  asyncio.run(scenario())
+
+# A weapon made before rolls had a limit on their dice can still be rolled, and a roll with too many dice to list shows only its total
+def test_weapon_with_a_big_roll(layout):
+  async def scenario():
+    items = { "Cannon": { "type": "Melee weapon", "hit": "1d20", "damage": "1000d6" } }
+    await add_campaign("Dragon", players={ "alice": { "Cannon": { "item_ref": "Cannon", "amount": 1 } } }, items=items)
+    await start("Dragon", "play")
+    command = interaction("alice")
+    await bot.roll_weapon.callback(command, "damage", "Cannon")
+    assert command.response.messages[0].startswith("Rolled for damage with Cannon:\n> Rolled `1000d6`.\n> Total: `")
+    assert len(command.response.messages[0]) <= bot.MESSAGE_LIMIT
+    command = interaction("alice")
+    await bot.roll_weapon.callback(command, "damage", "Cannon", 5)
+    assert "Rolled `1000d6` 5 times." in command.response.messages[0]
+    command = interaction("alice")
+    await bot.weapon_stats.callback(command, "Cannon", None)
+    assert command.response.messages[0].startswith("Odds to hit with Cannon (`1d20`):")
+  asyncio.run(scenario())
+
+# Starts a campaign where alice has a cannon with a big damage roll, a bow that shoots arrows, and two critical hits saved up
+async def start_with_crits(damage):
+  items = {
+    "Cannon": { "type": "Melee weapon", "hit": "1d20", "damage": damage },
+    "Bow": { "type": "Range weapon", "hit": "1000d20kh1", "damage": "1d6", "range": 60, "projectile": "Arrow" },
+    "Arrow": { "type": "Resource" }
+  }
+  inventory = { name: { "item_ref": name, "amount": 200 if name == "Arrow" else 1 } for name in items }
+  await add_campaign("Dragon", players={ "alice": inventory }, items=items)
+  await start("Dragon", "play")
+  crit_key = ((await bot.campaigns.get("Dragon"))["_id"], "alice")
+  bot.player_crits[crit_key] = 2
+  return crit_key
+
+# Saved critical hits and projectiles aren't used up by a roll that can't be made
+@pytest.mark.parametrize("damage, count, message", [
+  ("1000d6", dice.MAX_BATCH_DICE // 1000 + 1, bot.TOO_MANY_DICE("1000d6", dice.MAX_BATCH_DICE // 1000 + 1)),
+  ("2d7", 1, bot.INVALID_ROLL("2d7")),
+  ("2d7", 3, bot.INVALID_ROLL("2d7"))
+])
+def test_rejected_rolls_keep_crits(layout, damage, count, message):
+  async def scenario():
+    crit_key = await start_with_crits(damage)
+    command = interaction("alice")
+    await bot.roll_weapon.callback(command, "damage", "Cannon", count)
+    assert command.response.messages == [ message ]
+    assert bot.player_crits[crit_key] == 2
+    # A roll that can be made uses up a saved critical hit
+    command = interaction("alice")
+    await bot.roll_weapon.callback(command, "damage", "Bow")
+    assert "CRITICAL DAMAGE!" in command.response.messages[0]
+    assert bot.player_crits[crit_key] == 1
+  asyncio.run(scenario())
+
+def test_rejected_rolls_keep_projectiles(layout):
+  async def scenario():
+    await start_with_crits("1d6")
+    command = interaction("alice")
+    count = dice.MAX_BATCH_DICE // 1000 + 1
+    await bot.roll_weapon.callback(command, "hit", "Bow", count)
+    assert command.response.messages == [ bot.TOO_MANY_DICE("1000d20kh1", count) ]
+    inventory = bot.get_player_inventory("alice", await bot.campaigns.get("Dragon"))
+    assert inventory["Arrow"]["amount"] == 200
+  asyncio.run(scenario())
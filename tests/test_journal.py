@@ -0,0 +1,61 @@
+import asyncio
+import backup
+import bot
+import database
+import journal
+from journal import Journal
+from helpers import add_campaign, interaction, load, start
+from registry import CampaignRegistry
+from sessions import SessionManager
+
+# Starts the bot with a journal, as if it had just been started again with the same journal file
+async def restart(path, monkeypatch):
+  if database.journal:
+    database.journal.flush_task.cancel()
+    database.journal.file.close()
+  monkeypatch.setattr(database, "journal", Journal(str(path), database.write_batch))
+  monkeypatch.setattr(bot, "campaigns", CampaignRegistry())
+  monkeypatch.setattr(bot, "sessions", SessionManager())
+  await database.open_journal()
+
+# Renames the campaign through the bot and writes the journal to the database
+async def rename(old_name, new_name):
+  await start(old_name, "manage")
+  await bot.change_name.callback(interaction("dm"), new_name)
+  await database.journal.flush()
+
+# Once the journal has been compacted down to nothing, the changes made after starting again are still written
+def test_restart_after_compacting(layout, tmp_path, monkeypatch):
+  monkeypatch.setattr(journal, "COMPACT_SIZE", 1)
+  path = tmp_path / "journal.jsonl"
+  async def scenario():
+    await restart(path, monkeypatch)
+    await add_campaign("Dragon", players={ "alice": {} })
+    await rename("Dragon", "Wyrm")
+    assert database.journal.unflushed == []
+    last_sequence = database.journal.sequence
+    await restart(path, monkeypatch)
+    assert database.journal.sequence == last_sequence
+    await rename("Wyrm", "Drake")
+    assert (await load("Drake"))["journal_seq"] > last_sequence
+    # The number is kept through every compaction after that too
+    await restart(path, monkeypatch)
+    await rename("Drake", "Serpent")
+    assert await load("Serpent") is not None
+    database.journal.flush_task.cancel()
+  asyncio.run(scenario())
+
+# Campaigns that are imported don't bring another journal's numbers with them, so the bot's own journal can still change them
+def test_import_leaves_out_journal_numbers(layout, tmp_path, monkeypatch):
+  path = tmp_path / "campaigns.jsonl.gz"
+  async def scenario():
+    await add_campaign("Dragon", players={ "alice": {} })
+    database.collection.update_one({ "name": "Dragon" }, { "$set": { "journal_seq": 1000 } })
+    backup.export(str(path), [], [], 10)
+    backup.import_campaigns(str(path), [], [], 10)
+    assert "journal_seq" not in await load("Dragon")
+    await restart(tmp_path / "journal.jsonl", monkeypatch)
+    await rename("Dragon", "Wyrm")
+    assert await load("Wyrm") is not None
+    database.journal.flush_task.cancel()
+  asyncio.run(scenario())
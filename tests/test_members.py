@@ -0,0 +1,39 @@
+import asyncio
+import bot
+from helpers import FakeGuild, FakeInteraction, add_campaign, load, start
+
+# Adds a player to a campaign, as its dungeon master, in a server with the given members
+async def add_player(guild, username):
+  await add_campaign("Dragon")
+  await start("Dragon", "manage")
+  command = FakeInteraction(guild.members["dm"], guild, 0)
+  await bot.add_player.callback(command, username)
+  return command.response.messages
+
+# A member is found by their exact username, even when other members' names start with it
+def test_add_member(layout):
+  guild = FakeGuild(1, [ "dm", "alice", "alice2", "alicia" ])
+  messages = asyncio.run(add_player(guild, "alice"))
+  assert messages == [ "`alice` is now a player in `Dragon`." ]
+  assert [ player["name"] for player in asyncio.run(load("Dragon"))["players"] ] == [ "alice" ]
+
+# A name that only starts a member's name isn't a member
+def test_add_missing_member(layout):
+  guild = FakeGuild(1, [ "dm", "alice2" ])
+  assert asyncio.run(add_player(guild, "alice")) == [ "No user with the name `alice` exists in this server." ]
+
+# When Discord sends back as many members as it can without the user, the dungeon master is told why they weren't found
+def test_add_member_past_the_query_limit(layout):
+  guild = FakeGuild(1, [ "dm" ] + [ f"alice{i:03}" for i in range(bot.MEMBER_QUERY_LIMIT) ])
+  messages = asyncio.run(add_player(guild, "alice"))
+  assert messages[0].startswith(f"More than {bot.MEMBER_QUERY_LIMIT} members of this server have a name starting with `alice`")
+  assert asyncio.run(load("Dragon"))["players"] == []
+
+# A query that times out gets a message instead of an error
+def test_add_member_timeout(layout, monkeypatch):
+  guild = FakeGuild(1, [ "dm", "alice" ])
+  async def time_out(query, limit=5, cache=True):
+    raise asyncio.TimeoutError()
+  monkeypatch.setattr(guild, "query_members", time_out)
+  assert asyncio.run(add_player(guild, "alice")) == [ "Discord took too long to look up `alice`. Please try again in a moment." ]
+  assert asyncio.run(load("Dragon"))["players"] == []
@@ -0,0 +1,77 @@
+# Checks that two campaigns can't end up with the same name, even when they're given it at the same time
+import asyncio
+import bot
+import database
+from helpers import add_campaign, interaction, load, start
+
+# Counts the campaigns in the database with a name
+def count_named(name):
+  return database.collection.count_documents({ "name": name })
+
+def test_creating_the_same_name_at_once(layout):
+  async def scenario():
+    commands = [ interaction("alice"), interaction("bob") ]
+    await asyncio.gather(*(bot.campaign.callback(command, "create", "Dragon") for command in commands))
+    messages = sorted(command.response.messages[0] for command in commands)
+    assert messages == sorted([ "A new campaign with the name `Dragon` has been created.", bot.NAME_TAKEN("Dragon") ])
+    assert count_named("Dragon") == 1
+    assert bot.sessions.name_locks == {}
+  asyncio.run(scenario())
+
+def test_renaming_to_the_same_name_at_once(layout):
+  async def scenario():
+    await add_campaign("Dragon")
+    await add_campaign("Kraken")
+    await start("Dragon", "manage", channel=1)
+    await start("Kraken", "manage", channel=2)
+    commands = [ interaction("dm", 1), interaction("dm", 2) ]
+    await asyncio.gather(*(bot.change_name.callback(command, "Wyrm") for command in commands))
+    messages = sorted(command.response.messages[0] for command in commands)
+    assert messages == sorted([ "Changed the name of the campaign to `Wyrm`.", bot.NAME_NOT_ALLOWED("Wyrm") ])
+    assert count_named("Wyrm") == 1
+  asyncio.run(scenario())
+
+# Saves a campaign with a name straight to the database before a change is saved, as if another process running the bot had
+def take_name_first(monkeypatch, function_name, name):
+  function = getattr(database, function_name)
+  async def take_first(*args, **kwargs):
+    database.collection.insert_one({ "name": name, "dungeon_master": "someone", "players": [], "items": {} })
+    return await function(*args, **kwargs)
+  monkeypatch.setattr(database, function_name, take_first)
+
+# When another process takes the name first, the database's unique index stops the second campaign from having it
+def test_creating_a_name_taken_elsewhere(layout, monkeypatch):
+  async def scenario():
+    await database.create_indexes()
+    take_name_first(monkeypatch, "add_item", "Dragon")
+    command = interaction("alice")
+    await bot.campaign.callback(command, "create", "Dragon")
+    assert command.response.messages == [ bot.NAME_TAKEN("Dragon") ]
+    assert count_named("Dragon") == 1
+  asyncio.run(scenario())
+
+def test_renaming_to_a_name_taken_elsewhere(layout, monkeypatch):
+  async def scenario():
+    await database.create_indexes()
+    await add_campaign("Dragon")
+    await start("Dragon", "manage")
+    take_name_first(monkeypatch, "update_item", "Wyrm")
+    command = interaction("dm")
+    await bot.change_name.callback(command, "Wyrm")
+    assert command.response.messages == [ bot.NAME_NOT_ALLOWED("Wyrm") ]
+    assert count_named("Wyrm") == 1
+    assert await load("Dragon") is not None
+    # The campaign is loaded again by its old name, which can still be autocompleted
+    assert (await bot.campaigns.get("Dragon"))["name"] == "Dragon"
+    assert "Dragon" in bot.campaigns.name_index
+  asyncio.run(scenario())
+
+# A database with a plain index on the names has it made unique, unless some campaigns already share a name
+def test_name_index():
+  database.collection.create_index("name")
+  database.collection.insert_many([ { "name": "Dragon" }, { "name": "Dragon" } ])
+  database.create_name_index()
+  assert not database.collection.index_information()["name_1"].get("unique")
+  database.collection.delete_one({ "name": "Dragon" })
+  database.create_name_index()
+  assert database.collection.index_information()["name_1"]["unique"]
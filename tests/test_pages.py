@@ -0,0 +1,149 @@
+import asyncio
+import bot
+from helpers import add_campaign, interaction, start
+import pages
+from pages import PageCache, Paginator
+
+# Counts how many lines have been taken from a list of lines
+class CountingLines:
+  def __init__(self, count, length=100):
+    self.lines = [ f"{i}".ljust(length, ".") for i in range(count) ]
+    self.taken = 0
+
+  def __iter__(self):
+    for line in self.lines:
+      self.taken += 1
+      yield line
+
+# Only the lines of the pages that are asked for are rendered
+def test_pages_are_rendered_lazily():
+  lines = CountingLines(1000)
+  paginator = Paginator("Lines", lines)
+  assert lines.taken == 0
+  assert paginator.has_page(0)
+  per_page = len(paginator.pages[0].split("\n"))
+  # The line after the page is taken to find out that it doesn't fit, and is kept for the next page
+  assert lines.taken == per_page + 1
+  assert paginator.has_page(2)
+  assert len(paginator.pages) == 3
+  assert lines.taken == 3 * per_page + 1
+  # Pages that were already rendered aren't rendered again
+  paginator.get_embed(1)
+  assert lines.taken == 3 * per_page + 1
+  assert all(len(page) <= pages.PAGE_LENGTH for page in paginator.pages)
+
+# Every line ends up on exactly one page, and asking for a page past the end renders the rest of the lines once
+def test_pages_hold_every_line():
+  lines = CountingLines(1000)
+  paginator = Paginator("Lines", lines)
+  assert not paginator.has_page(1000)
+  assert lines.taken == 1000
+  assert "\n".join(paginator.pages).split("\n") == lines.lines
+  assert not paginator.render_page()
+  assert paginator.get_embed(len(paginator.pages)).description == "There's nothing to show."
+
+# A line that's longer than a page is cut to fit
+def test_long_lines_are_cut():
+  paginator = Paginator("Lines", [ "x" * (pages.PAGE_LENGTH * 2), "y" ])
+  assert paginator.get_embed(0).description == "x" * pages.PAGE_LENGTH
+  assert paginator.get_embed(1).description == "y"
+  assert paginator.get_embed(1).footer.text == "Page 2"
+
+# A single page has no footer
+def test_single_page():
+  embed = Paginator("Lines", [ "one", "two" ]).get_embed(0)
+  assert embed.description == "one\ntwo"
+  assert embed.footer.text is None
+
+# A list is only given back for the version it was rendered from, and the least recently used lists are dropped
+def test_page_cache():
+  cache = PageCache(size=2)
+  first = cache.add("first", 1, Paginator("First", []))
+  assert cache.get("first", 1) is first
+  assert cache.get("first", 2) is None
+  second = cache.add("second", 1, Paginator("Second", []))
+  # "first" was used more recently than "second", so "second" is dropped
+  cache.get("first", 1)
+  cache.add("third", 1, Paginator("Third", []))
+  assert cache.get("second", 1) is None
+  assert cache.get("first", 1) is first
+  assert second is not None
+  # A newer version replaces the old one
+  newer = cache.add("first", 2, Paginator("First", []))
+  assert cache.get("first", 2) is newer
+  assert cache.get("first", 1) is None
+
+# Renders every page of a list
+def render_all(paginator):
+  while paginator.render_page():
+    pass
+  return paginator.pages
+
+# Presses the next button of the pages that were sent, returning the new page
+async def next_page(view):
+  press = interaction("dm")
+  await view.next_page.callback(press)
+  return press.response.messages[0]["embed"]
+
+# A campaign with many players is shown over several pages, and shown again from the cache until it changes
+def test_campaign_show_pages(layout):
+  async def scenario():
+    players = { f"player{i}": {} for i in range(300) }
+    await add_campaign("Dragon", players=players)
+    first = interaction("dm")
+    await bot.campaign.callback(first, "show", "Dragon")
+    sent = first.response.messages[0]
+    view = sent["view"]
+    assert sent["embed"].title == "Dragon"
+    assert sent["embed"].footer.text == "Page 1"
+    assert "`player0`" in sent["embed"].description
+    # The last page isn't rendered until it's asked for
+    assert len(view.paginator.pages) == 2
+    assert view.previous_page.disabled and not view.next_page.disabled
+    shown = [ sent["embed"].description ]
+    while not view.next_page.disabled:
+      shown.append((await next_page(view)).description)
+    assert len(shown) > 2
+    assert "`player299`" in shown[-1]
+    assert sum(page.count("`player") for page in shown) == 300
+    # Showing the campaign again uses the same rendered pages
+    again = interaction("dm")
+    await bot.campaign.callback(again, "show", "Dragon")
+    assert again.response.messages[0]["view"].paginator is view.paginator
+    # Adding a player changes the campaign's version, so the pages are rendered again with the new player
+    await start("Dragon", "manage")
+    await bot.add_player.callback(interaction("dm"), "alice")
+    changed = interaction("dm")
+    await bot.campaign.callback(changed, "show", "Dragon")
+    paginator = changed.response.messages[0]["view"].paginator
+    assert paginator is not view.paginator
+    assert "`alice`" in render_all(paginator)[-1]
+  asyncio.run(scenario())
+
+# A big inventory is shown over several pages, and rendered again once it changes
+def test_inventory_pages(layout):
+  async def scenario():
+    items = { f"item{i}": { "type": "Resource" } for i in range(200) }
+    inventory = { name: { "item_ref": name, "amount": 2 } for name in items }
+    await add_campaign("Dragon", players={ "alice": inventory }, items=items)
+    await start("Dragon", "play")
+    first = interaction("alice")
+    await bot.inventory.callback(first)
+    view = first.response.messages[0]["view"]
+    assert first.response.messages[0]["embed"].title == "alice's inventory"
+    shown = render_all(view.paginator)
+    assert len(shown) > 2
+    assert sum(page.count("`item") for page in shown) == 200
+    # A page can be gone back to
+    await next_page(view)
+    previous = interaction("alice")
+    await view.previous_page.callback(previous)
+    assert previous.response.messages[0]["embed"].footer.text == "Page 1"
+    # Taking an item changes the campaign's version, so the inventory is rendered again without it
+    await bot.take_many.callback(interaction("dm"), "alice", "item0:2")
+    changed = interaction("alice")
+    await bot.inventory.callback(changed)
+    paginator = changed.response.messages[0]["view"].paginator
+    assert paginator is not view.paginator
+    assert sum(page.count("`item") for page in render_all(paginator)) == 199
+  asyncio.run(scenario())
@@ -0,0 +1,25 @@
+from registry import CampaignRegistry
+
+# Makes a campaign with no players or items
+def make_campaign(id, name):
+  return { "_id": id, "name": name, "dungeon_master": "dm", "players": [], "items": {} }
+
+# Two campaigns with the same name (such as ones that were imported) can be cached and dropped in any order
+def test_campaigns_with_the_same_name():
+  registry = CampaignRegistry(size=1)
+  first = registry.add(make_campaign(1, "Dragon"))
+  second = registry.add(make_campaign(2, "Dragon"))
+  assert not registry.is_cached(first)
+  assert registry.names == { "Dragon": 2 }
+  registry.add(make_campaign(3, "Kraken"))
+  assert registry.names == { "Kraken": 3 }
+  assert list(registry.campaigns) == list(registry.players) == list(registry.versions) == [ 3 ]
+  # Renaming or dropping a campaign doesn't drop another campaign's name
+  registry = CampaignRegistry()
+  first = registry.add(make_campaign(1, "Dragon"))
+  second = registry.add(make_campaign(2, "Dragon"))
+  registry.rename(first, "Wyrm")
+  assert registry.names == { "Dragon": 2, "Wyrm": 1 }
+  registry.add(make_campaign(3, "Wyrm"))
+  registry.forget(first)
+  assert registry.names == { "Dragon": 2, "Wyrm": 3 }
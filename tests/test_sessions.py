@@ -0,0 +1,43 @@
+import asyncio
+import bot
+from helpers import add_campaign, interaction, load, start
+
+ITEMS = { "Arrow": { "type": "Resource" }, "Bow": { "type": "Range weapon", "hit": "1d20", "damage": "1d6", "projectile": "Arrow", "range": 60 } }
+
+# Checks that the campaign in memory matches the campaign in the database
+async def assert_saved(campaign):
+  saved = await load(campaign["name"])
+  assert [ (player["name"], player["inventory"]) for player in saved["players"] ] == [ (player["name"], player["inventory"]) for player in campaign["players"] ]
+
+# A command that waits for another command's lock has to find the player again, since the players can move in the meantime
+def test_give_waits_for_removeplayer(layout):
+  async def scenario():
+    await add_campaign("Dragon", players={ "alice": {}, "bob": {} }, items=ITEMS)
+    await start("Dragon", "play", channel=0)
+    await start("Dragon", "manage", channel=1)
+    give_to_removed = interaction("dm", 0)
+    await asyncio.gather(
+      bot.give.callback(interaction("dm", 0), "alice", "Arrow", 1),
+      bot.remove_player.callback(interaction("dm", 1), "alice"),
+      bot.give.callback(interaction("dm", 0), "bob", "Arrow", 5),
+      bot.give.callback(give_to_removed, "alice", "Arrow", 1)
+    )
+    assert give_to_removed.response.messages == [ "`alice` isn't a player in `Dragon`." ]
+    campaign = await bot.campaigns.get("Dragon")
+    assert [ player["name"] for player in campaign["players"] ] == [ "bob" ]
+    assert campaign["players"][0]["inventory"] == { "Arrow": { "item_ref": "Arrow", "amount": 5 } }
+    await assert_saved(campaign)
+  asyncio.run(scenario())
+
+# Two attacks at once can't use more projectiles than the player has
+def test_attacks_wait_for_each_other(layout):
+  async def scenario():
+    await add_campaign("Dragon", players={ "bob": {}, "alice": { "Arrow": { "item_ref": "Arrow", "amount": 3 }, "Bow": { "item_ref": "Bow", "amount": 1 } } }, items=ITEMS)
+    await start("Dragon", "play")
+    first, second = interaction("alice"), interaction("alice")
+    await asyncio.gather(bot.roll_weapon.callback(first, "hit", "Bow", 2), bot.roll_weapon.callback(second, "hit", "Bow", 2))
+    assert second.response.messages == [ "You only have 1 `Arrow` left, so you can't attack 2 times." ]
+    campaign = await bot.campaigns.get("Dragon")
+    assert campaign["players"][1]["inventory"]["Arrow"]["amount"] == 1
+    await assert_saved(campaign)
+  asyncio.run(scenario())
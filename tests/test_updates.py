@@ -0,0 +1,115 @@
+# Checks that each command sends only the changes it makes to the database, instead of the whole campaign
+import asyncio
+import bot
+import copy
+import database
+from helpers import add_campaign, interaction, load, start
+import pytest
+
+ITEMS = {
+  "Arrow": { "type": "Resource" },
+  "Sword": { "type": "Melee weapon", "hit": "1d20", "damage": "1d8" },
+  "Bow": { "type": "Range weapon", "hit": "1d20", "damage": "1d6", "projectile": "Arrow", "range": 60 }
+}
+
+# Records the changes that each command saves
+@pytest.fixture
+def updates(monkeypatch):
+  changes = []
+  update_item = database.update_item
+  async def record(item, item_changes=None):
+    changes.append(copy.deepcopy(item_changes))
+    await update_item(item, item_changes)
+  monkeypatch.setattr(database, "update_item", record)
+  return changes
+
+# Adds a campaign with two players, alice with some arrows and a bow, and bob with nothing, and starts it in a mode
+async def setup(mode):
+  await add_campaign("Dragon", players={
+    "alice": { "Arrow": { "item_ref": "Arrow", "amount": 10 }, "Bow": { "item_ref": "Bow", "amount": 1 } },
+    "bob": {}
+  }, items=copy.deepcopy(ITEMS))
+  await start("Dragon", mode)
+
+def test_changename(layout, updates):
+  async def scenario():
+    await setup("manage")
+    await bot.change_name.callback(interaction("dm"), "Wyrm")
+    assert updates == [ { "$set": { "name": "Wyrm" } } ]
+    assert await load("Wyrm")
+  asyncio.run(scenario())
+
+def test_addplayer_and_removeplayer(layout, updates):
+  async def scenario():
+    await setup("manage")
+    await bot.add_player.callback(interaction("dm"), "carol")
+    await bot.remove_player.callback(interaction("dm"), "alice")
+    assert updates == [
+      { "$push": { "players": { "name": "carol", "inventory": {} } } },
+      { "$pull": { "players": { "name": "alice" } } }
+    ]
+    assert [ player["name"] for player in (await load("Dragon"))["players"] ] == [ "bob", "carol" ]
+  asyncio.run(scenario())
+
+def test_adding_items(layout, updates):
+  async def scenario():
+    await setup("manage")
+    await bot.add_resource.callback(interaction("dm"), "Rope")
+    await bot.add_melee_weapon.callback(interaction("dm"), "Axe", "1d12")
+    await bot.add_range_weapon.callback(interaction("dm"), "Sling", "1d4", "Arrow", 30)
+    assert updates == [
+      { "$set": { "items.Rope": { "type": "Resource" } } },
+      { "$set": { "items.Axe": { "type": "Melee weapon", "hit": "1d20", "damage": "1d12" } } },
+      { "$set": { "items.Sling": { "type": "Range weapon", "hit": "1d20", "damage": "1d4", "projectile": "Arrow", "range": 30 } } }
+    ]
+    assert set((await load("Dragon"))["items"]) == { "Arrow", "Sword", "Bow", "Rope", "Axe", "Sling" }
+  asyncio.run(scenario())
+
+def test_give(layout, updates):
+  async def scenario():
+    await setup("play")
+    # Adding to an item the player already has only changes its amount
+    await bot.give.callback(interaction("dm"), "alice", "Arrow", 5)
+    # A new item is stored as a reference to the campaign's item
+    await bot.give.callback(interaction("dm"), "bob", "Sword", 1)
+    assert updates == [
+      { "$inc": { "players.0.inventory.Arrow.amount": 5 } },
+      { "$set": { "players.1.inventory.Sword": { "item_ref": "Sword", "amount": 1 } } }
+    ]
+    players = (await load("Dragon"))["players"]
+    assert players[0]["inventory"]["Arrow"]["amount"] == 15
+    assert players[1]["inventory"] == { "Sword": { "item_ref": "Sword", "amount": 1 } }
+  asyncio.run(scenario())
+
+def test_rollweapon_uses_projectiles(layout, updates):
+  async def scenario():
+    await setup("play")
+    await bot.roll_weapon.callback(interaction("alice"), "hit", "Bow", 3)
+    # Using the last arrows removes them from the inventory
+    await bot.roll_weapon.callback(interaction("alice"), "hit", "Bow", 7)
+    assert updates == [
+      { "$inc": { "players.0.inventory.Arrow.amount": -3 } },
+      { "$unset": { "players.0.inventory.Arrow": "" } }
+    ]
+    assert "Arrow" not in (await load("Dragon"))["players"][0]["inventory"]
+  asyncio.run(scenario())
+
+def test_givemany_and_takemany(layout, updates):
+  async def scenario():
+    await setup("play")
+    await bot.give_many.callback(interaction("dm"), "alice, bob", "Arrow:2, Sword")
+    await bot.take_many.callback(interaction("dm"), "alice", "Arrow:12, Sword")
+    await bot.take_many.callback(interaction("dm"), "bob", "Arrow")
+    # Every player and item is changed in a single update
+    assert updates == [
+      {
+        "$set": { "players.0.inventory.Sword": { "item_ref": "Sword", "amount": 1 }, "players.1.inventory.Arrow": { "item_ref": "Arrow", "amount": 2 }, "players.1.inventory.Sword": { "item_ref": "Sword", "amount": 1 } },
+        "$inc": { "players.0.inventory.Arrow.amount": 2 }
+      },
+      { "$unset": { "players.0.inventory.Arrow": "", "players.0.inventory.Sword": "" } },
+      { "$inc": { "players.1.inventory.Arrow.amount": -1 } }
+    ]
+    players = (await load("Dragon"))["players"]
+    assert players[0]["inventory"] == { "Bow": { "item_ref": "Bow", "amount": 1 } }
+    assert players[1]["inventory"] == { "Arrow": { "item_ref": "Arrow", "amount": 1 }, "Sword": { "item_ref": "Sword", "amount": 1 } }
+  asyncio.run(scenario())